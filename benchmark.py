@@ -0,0 +1,283 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# The coders live in two source trees with flat imports, both are made importable from here. The spectral codecs'
+# coders are imported as utils.X since both trees have an ArithmeticBitCoder module.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "recompressor"))
+sys.path.insert(0, os.path.join(ROOT, "compressors"))
+
+import librosa
+from utils.ArithmeticBitCoder import ArithmeticEncoder, ArithmeticDecoder, encode_lanes, decode_lanes, split_lanes
+from utils.RANSCoder import rans_encode, rans_decode
+from ArithmeticBitCoder import ArithmeticBitCoder, GRANULE_BYTES
+import HuffmanSampleCoder
+from NaiveArithmeticBitCoder import ArithmeticBitCoder as NaiveArithmeticBitCoder
+from ArithmeticBinaryEncoder import ArithmeticBinaryEncoder
+from ArithmeticBinaryDecoder import ArithmeticBinaryDecoder
+from Frame import Frame
+from FrameHeader import FrameHeader
+from ID3_Parser import ID3
+
+N_FFT = 1024  # same STFT as toco/ltoco/veco
+MAX_BYTES = 1 << 15  # default length of every benchmark input, the slowest coders run at a few KB/s
+LANES = 513  # as toco --lanes
+MP3_FILE = os.path.join(ROOT, "recompressor", "trance.mp3")
+
+
+def spectrogram_input(wavfile, max_bytes):
+    """
+    Quantised magnitude spectrogram as written by the spectral codecs (int8, frequency line by frequency line)
+    :param wavfile: Audio file, mixed down to mono
+    :param max_bytes: Number of bytes kept
+    :return: Input bytes
+    """
+    original, _ = librosa.load(wavfile, sr=None, mono=True)
+    spectrogram = np.abs(librosa.stft(original, n_fft=N_FFT))
+    spectrogram = (10 * np.sqrt(spectrogram)).round()
+    return np.clip(spectrogram, -127, 127).astype(np.int8).tobytes()[:max_bytes]
+
+
+def granule_input(mp3file, max_bytes):
+    """
+    Quantised MDCT samples of the first frames of an MP3 file after leading silence, one int16 granule (1152 bytes)
+    per granule and channel as coded by the 3PM recompressor
+    :param mp3file: MP3 file
+    :param max_bytes: Number of bytes kept, rounded up to whole granules
+    :return: Input bytes
+    """
+    with open(mp3file, "rb") as file:
+        file_data = file.read()
+    id3 = ID3(file_data)
+    offset = id3.offset if id3.is_valid else 0
+    frame = Frame()
+    header = FrameHeader()
+    granules = bytearray()
+    while len(granules) < max_bytes and offset + 4 < len(file_data):
+        if file_data[offset] != 0xFF or file_data[offset + 1] < 0xE0:
+            break
+        frame.init_header_params(file_data, offset)
+        header.init_header_params(file_data, offset)
+        frame.init_frame_params(file_data, offset)
+        offset += frame.frame_size
+        samples = frame.get_samples()
+        if not granules and not samples.any():
+            continue
+        for gr in range(2):
+            for ch in range(header.channels):
+                granules.extend(samples[gr, ch].tobytes())
+    return bytes(granules)
+
+
+def load_inputs(max_bytes):
+    inputs = {}
+    for wavfile in sorted(glob.glob(os.path.join(ROOT, "data", "*.wav"))):
+        inputs["spectrogram:" + os.path.basename(wavfile)] = spectrogram_input(wavfile, max_bytes)
+    inputs["granules:" + os.path.basename(MP3_FILE)] = granule_input(MP3_FILE, max_bytes)
+    return inputs
+
+
+# Every coder is a pair of functions: encode(data) -> list of compressed streams, decode(streams, n_bytes) -> bytes
+
+def fpaq_encode(data, runs=False):
+    encoder = ArithmeticEncoder(length=len(data), runs=runs)
+    encoder.feed(data)
+    encoder.finish()
+    return [encoder.sink]
+
+
+def fpaq_decode(streams, n_bytes):
+    return ArithmeticDecoder(streams[0]).read()
+
+
+def mp3_encode(data):
+    # One stream per granule with a predictor shared over the whole input, as in Frame.get_3pm_bytes
+    coder = ArithmeticBitCoder()
+    return [coder.encode(data[i:i + GRANULE_BYTES], runs=True) for i in range(0, len(data), GRANULE_BYTES)]
+
+
+def mp3_decode(streams, n_bytes):
+    coder = ArithmeticBitCoder()
+    decoded = bytearray()
+    for stream in streams:
+        size = min(GRANULE_BYTES, n_bytes - len(decoded))
+        decoded += coder.decode(stream, size, len(stream), runs=True)
+    return decoded
+
+
+def sample_encode(data):
+    # Granules as int16 samples as in Frame.get_3pm_bytes, inputs of odd length are padded with a zero byte
+    coder = ArithmeticBitCoder()
+    data = data + bytes(len(data) % 2)
+    return [coder.encode_samples(np.frombuffer(data[i:i + GRANULE_BYTES], dtype=np.int16))
+            for i in range(0, len(data), GRANULE_BYTES)]
+
+
+def sample_decode(streams, n_bytes):
+    coder = ArithmeticBitCoder()
+    decoded = bytearray()
+    for stream in streams:
+        size = min(GRANULE_BYTES, n_bytes + n_bytes % 2 - len(decoded))
+        decoded += coder.decode_samples(stream, size // 2, len(stream)).tobytes()
+    return decoded[:n_bytes]
+
+
+def huffman_encode(data):
+    # Static Huffman code of the fast compression level, granules as in sample_encode
+    data = data + bytes(len(data) % 2)
+    return [HuffmanSampleCoder.encode_samples(np.frombuffer(data[i:i + GRANULE_BYTES], dtype=np.int16))
+            for i in range(0, len(data), GRANULE_BYTES)]
+
+
+def huffman_decode(streams, n_bytes):
+    decoded = bytearray()
+    for stream in streams:
+        size = min(GRANULE_BYTES, n_bytes + n_bytes % 2 - len(decoded))
+        decoded += HuffmanSampleCoder.decode_samples(stream, size // 2).tobytes()
+    return decoded[:n_bytes]
+
+
+def naive_encode(data):
+    return [NaiveArithmeticBitCoder().encode(data)]
+
+
+def naive_decode(streams, n_bytes):
+    return NaiveArithmeticBitCoder().decode(streams[0])
+
+
+def binary_coder(model):
+    def encode(data):
+        return [ArithmeticBinaryEncoder(model).encode(data)]
+
+    def decode(streams, n_bytes):
+        return ArithmeticBinaryDecoder(model).decode(streams[0])
+
+    return encode, decode
+
+
+CODERS = {
+    "fpaq0 (compressors)": (fpaq_encode, fpaq_decode),
+    "fpaq0 + runs (compressors)": (lambda data: fpaq_encode(data, runs=True), fpaq_decode),
+    "fpaq0 lockstep lanes (compressors)": (lambda data: [encode_lanes(split_lanes(data, LANES))],
+                                           lambda streams, n_bytes: bytearray().join(decode_lanes(streams[0]))),
+    "rANS (compressors)": (lambda data: [rans_encode(data)], lambda streams, n_bytes: rans_decode(streams[0])),
+    "fpaq0 + MP3Predictor (recompressor)": (mp3_encode, mp3_decode),
+    "fpaq0 + MP3Predictor samples (recompressor)": (sample_encode, sample_decode),
+    "static Huffman samples (recompressor)": (huffman_encode, huffman_decode),
+    "naive fpaq0 (recompressor)": (naive_encode, naive_decode),
+    "binary MP3": binary_coder("MP3"),
+    "binary MP3_DIFF": binary_coder("MP3_DIFF"),
+    "binary CHAR": binary_coder("CHAR"),
+    "binary dynamic": binary_coder(None),
+}
+
+
+def measure(encode, decode, data, repeat):
+    """
+    Time encode and decode (best of repeat runs), then repeat both once under tracemalloc for the peak memory
+    :return: Dictionary of results
+    """
+    encode_time = decode_time = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        streams = encode(data)
+        encode_time = min(encode_time, time.perf_counter() - start)
+        start = time.perf_counter()
+        decoded = decode(streams, len(data))
+        decode_time = min(decode_time, time.perf_counter() - start)
+    if bytes(decoded) != data:
+        raise ValueError("Decoded data differs from the input")
+
+    # tracemalloc slows allocation heavy code down, so memory is measured in separate runs
+    tracemalloc.start()
+    encode(data)
+    _, encode_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    decode(streams, len(data))
+    _, decode_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    compressed_size = sum(len(stream) for stream in streams)
+    return {
+        "input_bytes": len(data),
+        "compressed_bytes": compressed_size,
+        "bits_per_byte": 8 * compressed_size / len(data),
+        "encode_mb_s": len(data) / encode_time / 1e6,
+        "decode_mb_s": len(data) / decode_time / 1e6,
+        "encode_peak_bytes": encode_peak,
+        "decode_peak_bytes": decode_peak,
+    }
+
+
+def run(coders, max_bytes=MAX_BYTES, repeat=1):
+    inputs = load_inputs(max_bytes)
+    results = []
+    for coder in coders:
+        encode, decode = CODERS[coder]
+        for input_name, data in inputs.items():
+            result = {"coder": coder, "input": input_name}
+            result.update(measure(encode, decode, data, repeat))
+            peak_bytes = max(result["encode_peak_bytes"], result["decode_peak_bytes"])
+            print(f"{coder:44} {input_name:32} {result['encode_mb_s']:8.3f} MB/s enc"
+                  f" {result['decode_mb_s']:8.3f} MB/s dec {result['bits_per_byte']:6.3f} bits/byte"
+                  f" {peak_bytes / 1e6:7.2f} MB peak")
+            results.append(result)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def compare(results, baseline_file):
+    """
+    Print the change in throughput against the results of an earlier run, e.g. of the previous version
+    """
+    with open(baseline_file) as file:
+        baseline = {(r["coder"], r["input"]): r for r in json.load(file)["results"]}
+    print(f"\nChange against {baseline_file}:")
+    for result in results:
+        old = baseline.get((result["coder"], result["input"]))
+        if old is None:
+            continue
+        print(f"{result['coder']:44} {result['input']:32}"
+              f" encode {result['encode_mb_s'] / old['encode_mb_s']:6.2f}x"
+              f" decode {result['decode_mb_s'] / old['decode_mb_s']:6.2f}x"
+              f" size {result['compressed_bytes'] / old['compressed_bytes']:6.3f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput, compression and peak memory of all entropy coders")
+    parser.add_argument("--coders", nargs="+", choices=list(CODERS), default=list(CODERS), metavar="CODER",
+                        help=f"Coders to run, any of: {', '.join(CODERS)}")
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES, help="Length of every benchmark input")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per coder and input, the best one counts")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(args.coders, args.max_bytes, args.repeat)
+    with open(args.output, "w") as file:
+        json.dump({"environment": environment(), "max_bytes": args.max_bytes, "results": results}, file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
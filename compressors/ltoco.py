@@ -5,12 +5,14 @@ from tsc import compress_tsc, reconstruct_tsc
 import soundfile as sf
 import librosa
 import librosa.core.spectrum
-from utils.ArithmeticBitCoder import ArithmeticBitCoder
+from utils.SectionCoder import ARITHMETIC_BACKEND, RANS_BACKEND, write_sections, decode_sections, \
+    print_estimate, read_fields
 from tqdm import tqdm
 
 N_FFT = 1024 # number of samples for every STFT frame
+LEN_HEADER = 28
 
-def compress(infile):
+def compress(infile, backend=ARITHMETIC_BACKEND, estimate_only=False):
     # Read file
     fname = infile.split("/")[-1].split(".")[0]
     _, samplerate = sf.read(infile)
@@ -40,38 +42,36 @@ def compress(infile):
     residue_quant = np.clip((residue * 3), -127, 127).astype(np.int8)
     residuebytes = residue_quant.tobytes()
 
+    if estimate_only:
+        print_estimate(infile, LEN_HEADER, [indexbytes, amplitudes, residuebytes])
+        return
+
     # Entropic coding
     print("Starting entropic coding")
-    ae = ArithmeticBitCoder()
-    cindexes = ae.encode(indexbytes)
-    ae.__init__() # Reset arithmetic coder
-    camplitudes = ae.encode(amplitudes)
-    ae.__init__()
-    cresidue = ae.encode(residuebytes)
-    
-    # Pack into file
-    header = make_header(m, n, len(cindexes), len(camplitudes), len(cresidue), samplerate)
-    write_file(f"{fname}.ltc", header + cindexes + camplitudes + cresidue)
-    
-    print(f"Compression ratio: 1:{os.path.getsize(infile) / (len(header) + len(cindexes) + len(camplitudes) + len(cresidue))}")
+    with open(f"{fname}.ltc", "wb") as file:
+        file.write(bytes(LEN_HEADER))  # placeholder, the sections are streamed behind it
+        len_indexes, len_amplitudes, len_residue = write_sections(file, [indexbytes, amplitudes, residuebytes], backend)
+        file.seek(0)
+        file.write(make_header(m, n, len_indexes, len_amplitudes, len_residue, samplerate, backend))
+
+    print(f"Compression ratio: 1:{os.path.getsize(infile) / (LEN_HEADER + len_indexes + len_amplitudes + len_residue)}")
 
-def make_header(m, n, len_indexes, len_amplitudes, len_residue, samplerate):
+def make_header(m, n, len_indexes, len_amplitudes, len_residue, samplerate, backend):
     # Header format
     # | m (4 bytes)  | n (4 bytes) | # of index bytes (4 bytes) |
-    #  # of amplitude bytes (4 bytes) | | # of residue bytes |  samplerate (4 bytes) |
-    # Total length: 24 bytes
-    return bytes(np.array([m, n, len_indexes, len_amplitudes, len_residue, samplerate], dtype=np.int32))
+    #  # of amplitude bytes (4 bytes) | | # of residue bytes |  samplerate (4 bytes) | entropy backend (4 bytes) |
+    # Total length: 28 bytes
+    return bytes(np.array([m, n, len_indexes, len_amplitudes, len_residue, samplerate, backend], dtype=np.int32))
 
 def decompress(infile):
     fname = infile.split("/")[-1].split(".")[0]
     # Unpack binary file
-    len_header = 24
     offset = 0
     print("Unpacking compressed file")
     with open(infile, "rb") as file:
         fbytes = file.read()
         file.close()
-    m, n, len_indexes, len_amplitudes, len_residue, samplerate = read_header(fbytes[0:len_header])
+    m, n, len_indexes, len_amplitudes, len_residue, samplerate, backend, len_header = read_header(fbytes)
     if (len_header + len_indexes + len_amplitudes + len_residue) != len(fbytes):
         print(
             f"File {fbytes} has length {len(fbytes)}. Expected length from header: {len_header + len_indexes + len_amplitudes + len_residue}")
@@ -80,14 +80,12 @@ def decompress(infile):
 
     print("Starting entropic decoding")
     # Undo entropic coding
-    ae = ArithmeticBitCoder()
-    indexbytes = ae.decode(bytearray(fbytes[offset:offset + len_indexes]))
-    offset += len_indexes
-    ae.__init__()
-    amplitudebytes = ae.decode(bytearray(fbytes[offset:offset + len_amplitudes]))
-    offset += len_amplitudes
-    ae.__init__()
-    residuebytes = ae.decode(bytearray(fbytes[offset:offset + len_residue]))
+    fview = memoryview(fbytes) # in-process, sections are decoded from views of the file bytes without copies
+    sections = []
+    for len_section in (len_indexes, len_amplitudes, len_residue):
+        sections.append(fview[offset:offset + len_section])
+        offset += len_section
+    indexbytes, amplitudebytes, residuebytes = decode_sections(sections, backend)
     
     # Undo serialisation
     indexes = np.unpackbits(indexbytes)
@@ -121,29 +119,31 @@ def decompress(infile):
     reconstructed_waveform = librosa.core.spectrum.griffinlim(spectrogram) # Undo quantisation and STFT
     sf.write(f"{fname}.wav", reconstructed_waveform, samplerate)
     
-def read_header(headerbytes):
-    m, n, len_indexes, len_amplitudes, len_residue, samplerate = np.frombuffer(headerbytes, dtype=np.int32)
-    return m, n, len_indexes, len_amplitudes, len_residue, samplerate
-    
-    
-def write_file(fname, bytes):
-    with open(fname, "wb") as file:
-        file.write(bytes)
-        file.close()
+def read_header(fbytes):
+    # Fields as in make_header, the section lengths are fields 2 to 4
+    (m, n, len_indexes, len_amplitudes, len_residue, samplerate, backend), len_header = \
+        read_fields(fbytes, 7, (2, 3, 4))
+    return m, n, len_indexes, len_amplitudes, len_residue, samplerate, backend, len_header
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
+    backend = RANS_BACKEND if "--rans" in sys.argv else ARITHMETIC_BACKEND
+    estimate_only = "--estimate-only" in sys.argv
+    argv = [arg for arg in sys.argv if arg not in ("--rans", "--estimate-only")]
+    if len(argv) != 3:
         print("Unexpected number of arguments")
         print("Usage:")
-        print("Compression: python3 ltoco.py c <input>.wav")
+        print("Compression: python3 ltoco.py c [--rans | --estimate-only] <input>.wav")
         print("Decompression: python3 ltoco.py d <compressed>.ltc")
-    mode = sys.argv[1]
-    infile = sys.argv[2]
+        print("--rans codes the sections with the faster rANS coder instead of the arithmetic coder")
+        print("--estimate-only prints the estimated compression ratio of the arithmetic coder without coding")
+    mode = argv[1]
+    infile = argv[2]
     if mode not in ["c", "d"]:
         print("Invalid mode. Use 'c' for compression and 'd' for decompression")
     if not os.path.isfile(infile):
         print(f"Could not find {infile}")
     if mode == "c":
-        compress(infile)
+        compress(infile, backend, estimate_only)
     if mode == "d":
         decompress(infile)
\ No newline at end of file
@@ -1,16 +1,19 @@
 import sys
 import os
+import time
 import numpy as np
 from tsc import compress_tsc, reconstruct_tsc
 import soundfile as sf
 import librosa
 import librosa.core.spectrum
-from utils.ArithmeticBitCoder import ArithmeticBitCoder
+from utils.SectionCoder import ARITHMETIC_BACKEND, RANS_BACKEND, LANES_BACKEND, N_LANES, write_sections, \
+    decode_sections, backend_name, print_estimate, read_fields
 from tqdm import tqdm
 
 N_FFT = 1024 # number of samples for every STFT frame
+LEN_HEADER = 24
 
-def compress(infile):
+def compress(infile, backend=ARITHMETIC_BACKEND, estimate_only=False):
     # Read file
     fname = infile.split("/")[-1].split(".")[0]
     _, samplerate = sf.read(infile)
@@ -35,36 +38,38 @@ def compress(infile):
     
     indexbytes = np.packbits(indexes)
 
+    if estimate_only:
+        print_estimate(infile, LEN_HEADER, [indexbytes, amplitudes])
+        return
+
     # Entropic coding
     print("Starting entropic coding")
-    ae = ArithmeticBitCoder()
-    cindexes = ae.encode(indexbytes)
-    ae.__init__() # Reset arithmetic coder
-    camplitudes = ae.encode(amplitudes)
-    
-    # Pack into file
-    header = make_header(m, n, len(cindexes), len(camplitudes), samplerate)
-    write_file(f"{fname}.tc", header + cindexes + camplitudes)
-    
-    print(f"Compression ratio: 1:{os.path.getsize(infile) / (len(header) + len(cindexes) + len(camplitudes))}")
+    start = time.time()
+    with open(f"{fname}.tc", "wb") as file:
+        file.write(bytes(LEN_HEADER))  # placeholder, the sections are streamed behind it
+        len_indexes, len_amplitudes = write_sections(file, [indexbytes, amplitudes], backend)
+        file.seek(0)
+        file.write(make_header(m, n, len_indexes, len_amplitudes, samplerate, backend))
+    print(f"Entropic coding took {time.time() - start:.2f} seconds {backend_name(backend)}")
+
+    print(f"Compression ratio: 1:{os.path.getsize(infile) / (LEN_HEADER + len_indexes + len_amplitudes)}")
 
-def make_header(m, n, len_indexes, len_amplitudes, samplerate):
+def make_header(m, n, len_indexes, len_amplitudes, samplerate, backend):
     # Header format
     # | m (4 bytes)  | n (4 bytes) | # of index bytes (4 bytes) |
-    # of amplitude bytes (4 bytes) | samplerate (4 bytes) |
-    # Total length: 20 bytes
-    return bytes(np.array([m, n, len_indexes, len_amplitudes, samplerate], dtype=np.int32))
+    # of amplitude bytes (4 bytes) | samplerate (4 bytes) | entropy backend (4 bytes) |
+    # Total length: 24 bytes
+    return bytes(np.array([m, n, len_indexes, len_amplitudes, samplerate, backend], dtype=np.int32))
 
 def decompress(infile):
     fname = infile.split("/")[-1].split(".")[0]
     # Unpack binary file
-    len_header = 20
     offset = 0
     print("Unpacking compressed file")
     with open(infile, "rb") as file:
         fbytes = file.read()
         file.close()
-    m, n, len_indexes, len_amplitudes, samplerate = read_header(fbytes[0:len_header])
+    m, n, len_indexes, len_amplitudes, samplerate, backend, len_header = read_header(fbytes)
     if (len_header + len_indexes + len_amplitudes) != len(fbytes):
         print(
             f"File {fbytes} has length {len(fbytes)}. Expected length from header: {len_header + len_indexes + len_amplitudes}")
@@ -73,11 +78,12 @@ def decompress(infile):
 
     print("Starting entropic decoding")
     # Undo entropic coding
-    ae = ArithmeticBitCoder()
-    indexbytes = ae.decode(bytearray(fbytes[offset:offset + len_indexes]))
-    offset += len_indexes
-    ae.__init__()
-    amplitudebytes = ae.decode(bytearray(fbytes[offset:offset + len_amplitudes]))
+    fview = memoryview(fbytes) # in-process, sections are decoded from views of the file bytes without copies
+    start = time.time()
+    indexbytes, amplitudebytes = decode_sections([fview[offset:offset + len_indexes],
+                                                  fview[offset + len_indexes:offset + len_indexes + len_amplitudes]],
+                                                 backend)
+    print(f"Entropic decoding took {time.time() - start:.2f} seconds {backend_name(backend)}")
     
     # Undo serialisation
     indexes = np.unpackbits(indexbytes)
@@ -103,29 +109,32 @@ def decompress(infile):
     reconstructed_waveform = librosa.core.spectrum.griffinlim(np.square(amplitudes/10)) # Undo quantisation and STFT
     sf.write(f"{fname}.wav", reconstructed_waveform, samplerate)
     
-def read_header(headerbytes):
-    m, n, len_indexes, len_amplitudes, samplerate = np.frombuffer(headerbytes, dtype=np.int32)
-    return m, n, len_indexes, len_amplitudes, samplerate
-    
-    
-def write_file(fname, bytes):
-    with open(fname, "wb") as file:
-        file.write(bytes)
-        file.close()
+def read_header(fbytes):
+    # Fields as in make_header, the section lengths are fields 2 and 3
+    (m, n, len_indexes, len_amplitudes, samplerate, backend), len_header = read_fields(fbytes, 6, (2, 3))
+    return m, n, len_indexes, len_amplitudes, samplerate, backend, len_header
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
+    backend = RANS_BACKEND if "--rans" in sys.argv else LANES_BACKEND if "--lanes" in sys.argv else ARITHMETIC_BACKEND
+    estimate_only = "--estimate-only" in sys.argv
+    argv = [arg for arg in sys.argv if arg not in ("--rans", "--lanes", "--estimate-only")]
+    if len(argv) != 3:
         print("Unexpected number of arguments")
         print("Usage:")
-        print("Compression: python3 toco.py c <input>.wav")
+        print("Compression: python3 toco.py c [--rans | --lanes | --estimate-only] <input>.wav")
         print("Decompression: python3 toco.py d <compressed>.tc")
-    mode = sys.argv[1]
-    infile = sys.argv[2]
+        print("--rans codes the sections with the faster rANS coder instead of the arithmetic coder")
+        print("--lanes codes long sections as up to", N_LANES, "arithmetic coded lanes in lockstep,",
+              "faster without numba")
+        print("--estimate-only prints the estimated compression ratio of the arithmetic coder without coding")
+    mode = argv[1]
+    infile = argv[2]
     if mode not in ["c", "d"]:
         print("Invalid mode. Use 'c' for compression and 'd' for decompression")
     if not os.path.isfile(infile):
         print(f"Could not find {infile}")
     if mode == "c":
-        compress(infile)
+        compress(infile, backend, estimate_only)
     if mode == "d":
         decompress(infile)
\ No newline at end of file
@@ -1,75 +1,522 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+# Optional Numba backend. The byte loops of the encoder and decoder also exist as kernels over NumPy arrays, which are
+# compiled and used when numba is installed. Both give identical streams, set NO_JIT=1 to force the pure-Python loops.
+try:
+    if os.environ.get("NO_JIT"):
+        raise ImportError("JIT disabled by NO_JIT")
+    from numba import njit
+    JIT = True
+except ImportError:
+    JIT = False
+
+    def njit(*args, **kwargs):
+        # The kernels are then never called, the decorator only keeps them importable
+        return lambda function: function
+
+READ_CHUNK_SIZE = 1 << 16  # bytes read at once from file-like inputs
+DECODE_CHUNK_SIZE = 1 << 16  # decoded bytes yielded at once by ArithmeticDecoder.chunks
+PROB_BITS = 12  # predictor probabilities are 12-bit integers
+N_CONTEXTS = 512
+MAX_COUNT = 65534  # bit counts are halved once a count exceeds this value
+BLOCK_SIZE = 1 << 20  # default number of input bytes per block in block-parallel mode
+KERNEL_OUT_SIZE = 1 << 18  # output buffer of the encoder kernel
+MAX_BYTES_PER_DECISION = 4  # a decision with probability 0 moves all four bytes of the range out
+MAX_STEP_BYTES = 63 * MAX_BYTES_PER_DECISION  # output of one step of the encoder kernel, a byte or a run length
+NO_RUNS = np.zeros(0, dtype=np.int64)  # run starts and lengths passed to the encoder kernel without run-length coding
+ESTIMATE_BLOCK_SIZE = 1 << 12  # bytes per block of estimate_size
+
+# Status of the decoder kernel
+KERNEL_MORE = 0  # out is full or a run did not fit, call again
+KERNEL_DONE = 1
+KERNEL_CORRUPT_RUN = 2
+KERNEL_RUN_PAST_END = 3
+
+# Stream formats. Legacy streams code a continuation flag before every byte and a final 1 as end-of-stream, their
+# first byte is always >= 0x7f. Newer streams start with a format version below that.
+COUNTED_STREAM = 1  # | version (1 byte) | # of bytes (4 bytes) | coded bytes, 8 decisions each |
+RUN_STREAM = 2  # as COUNTED_STREAM, but the rest of a run of RUN_THRESHOLD identical bytes is coded as its length
+LEN_COUNTED_HEADER = 5
+
+# Decisions coded per byte: the bits from MSB to LSB, in legacy streams after the continuation flag (0)
+BYTE_BITS = [tuple((b >> i) & 1 for i in range(7, -1, -1)) for b in range(256)]
+BYTE_DECISIONS = [(0,) + bits for bits in BYTE_BITS]
+END_DECISIONS = (1,)  # continuation flag terminating a legacy stream
+# The bit contexts are the bits of the byte so far with a leading 1. Without the flag a byte ends at context 256.
+COUNTED_CONTEXTS = 256
+# Run lengths are Elias-gamma coded with one context per bit position in the contexts the bytes leave unused
+RUN_THRESHOLD = 2
+RUN_PREFIX_CONTEXTS = 256  # unary part, up to 32 decisions
+RUN_BIT_CONTEXTS = 288  # remaining bits, up to 31 decisions
+
+
+def _count_byte_decisions():
+    # Number of 0 and 1 decisions every byte value codes in every context, for estimate_size
+    values = np.arange(256)
+    zeros = np.zeros((256, N_CONTEXTS))
+    ones = np.zeros((256, N_CONTEXTS))
+    for k in range(8):
+        bits = (values >> (7 - k)) & 1
+        contexts = (1 << k) | (values >> (8 - k))
+        ones[values, contexts] += bits
+        zeros[values, contexts] += 1 - bits
+    return zeros, ones
+
+
+BYTE_ZEROS, BYTE_ONES = _count_byte_decisions()
+
+
+def byte_reader(source, limit=None):
+    """
+    Iterate over the bytes of a buffer (bytes, bytearray, memoryview, mmap) or a file-like object without copying
+    or consuming it
+    :param source: Compressed input
+    :param limit: Maximum number of bytes to read, e.g. the length of a section inside a larger file
+    :return: Iterator yielding one int per byte
+    """
+    if hasattr(source, "read"):
+        return _file_reader(source, limit)
+    view = memoryview(source).cast("B")
+    return iter(view if limit is None else view[:limit])
+
+
+def _file_reader(file, limit):
+    remaining = -1 if limit is None else limit
+    while remaining:
+        chunk = file.read(READ_CHUNK_SIZE if remaining < 0 else min(remaining, READ_CHUNK_SIZE))
+        if not chunk:
+            break
+        remaining -= len(chunk) if remaining > 0 else 0
+        yield from chunk
+
 
 # Python translation of fpaq0 coder by M. Mahoney (http://mattmahoney.net/dc/fpaq0.cpp)
+# The coder state is held in plain Python ints masked to 32 bits and the predictor is inlined into the
+# encode/decode loops. Output is byte-identical to the former np.int64 version (ReferenceArithmeticBitCoder.py).
+class ArithmeticEncoder:
+    """
+    Incremental encoder: data is fed in chunks and the compressed stream is written to a sink as it is produced.
+    If the length of the data is known up front, it is stored in the stream and every byte takes 8 decisions.
+    Otherwise a legacy stream with a continuation flag per byte is written.
+    """
+
+    def __init__(self, sink=None, predictor=None, length=None, runs=False):
+        """
+        :param sink: Writable file-like object or bytearray, a new bytearray if omitted
+        :param predictor: Probability model, a fresh NaivePredictor if omitted
+        :param length: Total number of bytes that will be fed, None writes a legacy stream
+        :param runs: Code long runs of identical bytes as run lengths, needs the length
+        """
+        if runs and length is None:
+            raise ValueError("Run-length coding needs the length of the data")
+        self.sink = bytearray() if sink is None else sink
+        self.predictor = NaivePredictor() if predictor is None else predictor
+        self.x1 = 0
+        self.x2 = 0xffffffff
+        self.n_bytes = 0  # compressed bytes written so far
+        self.length = length
+        self.runs = runs
+        self.pending = b""  # run at the end of the data fed so far, it may continue in the next chunk
+        self.n_fed = 0
+        self.finished = False
+        self.__write = self.sink.extend if isinstance(self.sink, bytearray) else self.sink.write
+        if length is not None:
+            version = RUN_STREAM if runs else COUNTED_STREAM
+            self.__write(bytes((version,)) + np.array([length], dtype=np.int32).tobytes())
+            self.n_bytes = LEN_COUNTED_HEADER
+
+    def feed(self, chunk):
+        """
+        Encode the next chunk of data
+        :param chunk: Any bytes-like object
+        """
+        if self.finished:
+            raise ValueError("Encoder has already been finished")
+        view = memoryview(chunk).cast("B")
+        self.n_fed += len(view)
+        if self.length is None:
+            self.__code_bytes(view, True)
+        elif self.n_fed > self.length:
+            raise ValueError(f"More than the announced {self.length} bytes fed")
+        elif self.runs:
+            self.__code_runs(view, False)
+        else:
+            self.__code_bytes(view)
+
+    def finish(self):
+        """
+        Terminate the stream and flush the coder
+        :return: Total length of the compressed stream in bytes
+        """
+        if not self.finished:
+            if self.length is None:
+                self.__code((END_DECISIONS,), N_CONTEXTS)
+            elif self.n_fed != self.length:
+                raise ValueError(f"{self.n_fed} bytes fed, {self.length} announced")
+            elif self.runs:
+                self.__code_runs(b"", True)
+            self.__write(bytes((self.x2 >> 24,)))
+            self.n_bytes += 1
+            self.finished = True
+        return self.n_bytes
+
+    def __code_bytes(self, data, legacy=False):
+        # Whole bytes, in legacy streams each after a continuation flag
+        if self.__use_kernel():
+            self.__code_kernel(np.frombuffer(data, dtype=np.uint8), NO_RUNS, NO_RUNS, legacy)
+        elif legacy:
+            self.__code(map(BYTE_DECISIONS.__getitem__, data), N_CONTEXTS)
+        else:
+            self.__code(map(BYTE_BITS.__getitem__, data), COUNTED_CONTEXTS)
+
+    def __use_kernel(self):
+        return JIT and isinstance(self.predictor.probs, np.ndarray)
+
+    def __code_kernel(self, symbols, run_starts, run_lengths, legacy):
+        # Codes symbols and the given runs with _encode_kernel, writing the output whenever the buffer fills up
+        predictor = self.predictor
+        out = np.empty(KERNEL_OUT_SIZE, dtype=np.uint8)
+        pos = 0
+        i_run = 0
+        while pos < len(symbols) or i_run < len(run_starts):
+            pos, i_run, predictor.context, self.x1, self.x2, n_out = _encode_kernel(
+                symbols, run_starts, run_lengths, pos, i_run, legacy, predictor.n0, predictor.n1, predictor.probs,
+                predictor.context, self.x1, self.x2, out)
+            if n_out:
+                self.__write(out[:n_out].tobytes())
+                self.n_bytes += n_out
+
+    def __code(self, decision_lists, n_contexts):
+        predictor = self.predictor
+        n0, n1, probs = predictor.n0, predictor.n1, predictor.probs
+        ctx = predictor.context
+        x1 = self.x1
+        x2 = self.x2
+        compressed = bytearray()
+        append = compressed.append
+
+        for decisions in decision_lists:
+            for y in decisions:
+                xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[ctx]
+                c0 = n0[ctx]
+                c1 = n1[ctx]
+                if y:
+                    x2 = xmid
+                    c1 += 1
+                    if c1 > MAX_COUNT:
+                        c0 >>= 1
+                        c1 >>= 1
+                        n0[ctx] = c0
+                    n1[ctx] = c1
+                else:
+                    x1 = xmid + 1
+                    c0 += 1
+                    if c0 > MAX_COUNT:
+                        c0 >>= 1
+                        c1 >>= 1
+                        n1[ctx] = c1
+                    n0[ctx] = c0
+                probs[ctx] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+                ctx += ctx + y
+                if ctx >= n_contexts:
+                    ctx = 1
+
+                while not (x1 ^ x2) & 0xff000000:
+                    append(x2 >> 24)
+                    x1 = (x1 << 8) & 0xffffffff
+                    x2 = ((x2 << 8) & 0xffffffff) | 255
+
+        predictor.context = ctx
+        self.x1 = x1
+        self.x2 = x2
+        if compressed:
+            self.__write(compressed)
+            self.n_bytes += len(compressed)
+
+    def __code_runs(self, view, final):
+        # Runs are found with NumPy and only bytes outside of them go through the bit coder. The decoder counts
+        # identical bytes and reads a run length after the RUN_THRESHOLD-th, so runs have to be complete: the
+        # trailing run of a chunk is held back until the next chunk or the end of the data.
+        data = self.pending + bytes(view)
+        if not data:
+            return
+        symbols = np.frombuffer(data, dtype=np.uint8)
+        starts = np.concatenate(([0], np.flatnonzero(symbols[1:] != symbols[:-1]) + 1))
+        if final:
+            end = len(data)
+        else:
+            end = int(starts[-1])
+            starts = starts[:-1]
+        self.pending = data[end:]
+        lengths = np.diff(np.append(starts, end))
+        if self.__use_kernel():
+            long = lengths >= RUN_THRESHOLD
+            self.__code_kernel(symbols[:end], starts[long].astype(np.int64), lengths[long].astype(np.int64), False)
+            return
+        pos = 0
+        for start, length in zip(starts[lengths >= RUN_THRESHOLD].tolist(), lengths[lengths >= RUN_THRESHOLD].tolist()):
+            self.__code_bytes(data[pos:start + RUN_THRESHOLD])
+            self.__code_run_length(length - RUN_THRESHOLD)
+            pos = start + length
+        self.__code_bytes(data[pos:end])
+
+    def __code_run_length(self, run):
+        # Elias-gamma code of run + 1, one decision at a time since runs are rare compared to bytes
+        value = run + 1
+        n_bits = value.bit_length()
+        steps = [(int(i == n_bits - 1), RUN_PREFIX_CONTEXTS + i) for i in range(n_bits)]
+        steps += [((value >> k) & 1, RUN_BIT_CONTEXTS + k) for k in range(n_bits - 2, -1, -1)]
+        compressed = bytearray()
+        for y, ctx in steps:
+            xmid = self.x1 + ((self.x2 - self.x1) >> PROB_BITS) * self.predictor.probs[ctx]
+            if y:
+                self.x2 = xmid
+            else:
+                self.x1 = xmid + 1
+            self.predictor.update_slot(y, ctx)
+            while not (self.x1 ^ self.x2) & 0xff000000:
+                compressed.append(self.x2 >> 24)
+                self.x1 = (self.x1 << 8) & 0xffffffff
+                self.x2 = ((self.x2 << 8) & 0xffffffff) | 255
+        self.__write(compressed)
+        self.n_bytes += len(compressed)
+
+
+class ArithmeticDecoder:
+    """
+    Incremental decoder, reads the compressed stream through a cursor and yields the decoded data in chunks.
+    Streams with a byte count and legacy streams are told apart by their first byte.
+    """
+
+    def __init__(self, source, predictor=None, limit=None):
+        """
+        :param source: Buffer (bytes, bytearray, memoryview, mmap) or readable file-like object
+        :param predictor: Probability model, must match the encoder's. A fresh NaivePredictor if omitted
+        :param limit: Length of the compressed stream if the source continues after it. Bytes past the end of
+                      the stream are read as zeros.
+        """
+        self.reader = byte_reader(source, limit)
+        self.predictor = NaivePredictor() if predictor is None else predictor
+        # Buffers are also decoded by the kernel, which needs the whole stream as an array
+        self.buffer = None
+        if JIT and not hasattr(source, "read"):
+            self.buffer = np.frombuffer(memoryview(source).cast("B")[:limit], dtype=np.uint8)
+
+    def chunks(self, chunk_size=DECODE_CHUNK_SIZE):
+        """
+        :param chunk_size: Number of decoded bytes per chunk (the last chunk may be shorter)
+        :return: Generator yielding bytearrays of decoded data
+        """
+        reader = self.reader
+        predictor = self.predictor
+        n0, n1, probs = predictor.n0, predictor.n1, predictor.probs
+        ctx = predictor.context
+        x1 = 0
+        x2 = 0xffffffff
+        x = next(reader, 0)
+        runs = x == RUN_STREAM
+        if x == COUNTED_STREAM or runs:
+            remaining = int(np.frombuffer(bytes(next(reader, 0) for _ in range(4)), dtype=np.int32)[0])
+            if remaining == 0:
+                return
+            x = next(reader, 0)
+            n_contexts = COUNTED_CONTEXTS
+            first_b = 1
+        elif x >= 0x7f:
+            remaining = -1  # legacy stream, ends with the end flag
+            n_contexts = N_CONTEXTS
+            first_b = 0
+        else:
+            raise ValueError(f"Unknown stream format {x}")
+        decompressed = bytearray()
+        append = decompressed.append
+        for i in range(3):  # initialise first four bytes of x with compressed file
+            x = (x << 8) | next(reader, 0)
+        if self.buffer is not None and isinstance(probs, np.ndarray):
+            pos = 4 if remaining < 0 else LEN_COUNTED_HEADER + 4
+            yield from self.__kernel_chunks(chunk_size, pos, x, remaining, runs, n_contexts, first_b)
+            return
+
+        b = first_b  # partially decoded byte with a leading 1, or 0 while a continuation flag is expected
+        last = -1  # last byte and number of times it was repeated, for run-length streams
+        repeats = 0
+        while True:
+            xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[ctx]
+            c0 = n0[ctx]
+            c1 = n1[ctx]
+            if x <= xmid:
+                y = 1
+                x2 = xmid
+                c1 += 1
+                if c1 > MAX_COUNT:
+                    c0 >>= 1
+                    c1 >>= 1
+                    n0[ctx] = c0
+                n1[ctx] = c1
+            else:
+                y = 0
+                x1 = xmid + 1
+                c0 += 1
+                if c0 > MAX_COUNT:
+                    c0 >>= 1
+                    c1 >>= 1
+                    n1[ctx] = c1
+                n0[ctx] = c0
+            probs[ctx] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+            ctx += ctx + y
+            if ctx >= n_contexts:
+                ctx = 1
+
+            while not (x1 ^ x2) & 0xff000000:
+                x1 = (x1 << 8) & 0xffffffff
+                x2 = ((x2 << 8) & 0xffffffff) | 255
+                x = ((x << 8) & 0xffffffff) | next(reader, 0)
+
+            if b:
+                b += b + y
+                if b >= 256:
+                    append(b - 256)
+                    remaining -= 1
+                    if runs:
+                        if b == last:
+                            repeats += 1
+                            if repeats == RUN_THRESHOLD:
+                                run, x1, x2, x = self.__decode_run_length(x1, x2, x)
+                                decompressed += bytes((b - 256,)) * run
+                                remaining -= run
+                                repeats = 0
+                                if remaining < 0:
+                                    raise ValueError("Corrupt stream, run past the end of the data")
+                        else:
+                            last = b
+                            repeats = 1
+                    b = first_b
+                    if not remaining:
+                        break
+                    if len(decompressed) >= chunk_size:
+                        yield decompressed
+                        decompressed = bytearray()
+                        append = decompressed.append
+            elif y:
+                break
+            else:
+                b = 1
+
+        predictor.context = ctx
+        if decompressed:
+            yield decompressed
+
+    def __kernel_chunks(self, chunk_size, pos, x, remaining, runs, n_contexts, first_b):
+        # Same decoding as chunks by _decode_kernel, continuing after the first four bytes of x at pos
+        predictor = self.predictor
+        x1 = 0
+        x2 = 0xffffffff
+        last = -1
+        repeats = 0
+        while True:
+            out = np.empty(chunk_size, dtype=np.uint8)
+            pos, x1, x2, x, predictor.context, remaining, last, repeats, n_out, pending, status = _decode_kernel(
+                self.buffer, pos, x1, x2, x, predictor.n0, predictor.n1, predictor.probs, predictor.context,
+                n_contexts, first_b, runs, remaining, last, repeats, out)
+            if status == KERNEL_CORRUPT_RUN:
+                raise ValueError("Corrupt stream, run length out of range")
+            if status == KERNEL_RUN_PAST_END:
+                raise ValueError("Corrupt stream, run past the end of the data")
+            decompressed = bytearray(out[:n_out].tobytes())
+            if pending:  # rest of a run that did not fit into out
+                decompressed += bytes((decompressed[-1],)) * pending
+            if decompressed:
+                yield decompressed
+            if status == KERNEL_DONE:
+                return
+
+    def __decode_run_length(self, x1, x2, x):
+        # Mirror of ArithmeticEncoder.__code_run_length, takes and returns the coder state of the chunks loop
+        n_bits = 1
+        value = 1
+        k = None  # bit position of the next remaining bit, None while in the unary part
+        while k is None or k >= 0:
+            ctx = RUN_PREFIX_CONTEXTS + n_bits - 1 if k is None else RUN_BIT_CONTEXTS + k
+            xmid = x1 + ((x2 - x1) >> PROB_BITS) * self.predictor.probs[ctx]
+            y = int(x <= xmid)
+            if y:
+                x2 = xmid
+            else:
+                x1 = xmid + 1
+            self.predictor.update_slot(y, ctx)
+            while not (x1 ^ x2) & 0xff000000:
+                x1 = (x1 << 8) & 0xffffffff
+                x2 = ((x2 << 8) & 0xffffffff) | 255
+                x = ((x << 8) & 0xffffffff) | next(self.reader, 0)
+            if k is not None:
+                value += value + y
+                k -= 1
+            elif y:
+                k = n_bits - 2
+            elif n_bits == 32:
+                raise ValueError("Corrupt stream, run length out of range")
+            else:
+                n_bits += 1
+        return value - 1, x1, x2, x
+
+    def read(self):
+        """
+        :return: The complete decoded data
+        """
+        decompressed = bytearray()
+        for chunk in self.chunks():
+            decompressed += chunk
+        return decompressed
+
+
 class ArithmeticBitCoder:
+    """
+    Whole-buffer interface to ArithmeticEncoder/ArithmeticDecoder plus single decision coding
+    """
 
     def __init__(self):
         self.predictor = NaivePredictor()
-        self.x1 = np.int64(0)
-        self.x2 = np.int64(0xffffffff)
-        self.x = np.int64(0)
+        self.x1 = 0
+        self.x2 = 0xffffffff
+        self.x = 0
         self.compressed = bytearray()
-        self.context = 1
+        self.reader = iter(())
 
     def encode(self, data: bytes):
-        self.x1 = np.int64(0)
-        self.x2 = np.int64(0xffffffff)
-        self.x = np.int64(0)
-        self.compressed = bytearray()
-        self.context = 1
-        sample_idx = 0
-        twobytes = 0
-        for b in data:
-            self.encode_symbol(0)
-            for i in range(7, -1, -1):
-                self.encode_symbol((b >> i) & 1)
-        self.encode_symbol(1)
-        self.flush()
+        encoder = ArithmeticEncoder(predictor=self.predictor, length=len(data))
+        encoder.feed(data)
+        encoder.finish()
+        self.x1 = encoder.x1
+        self.x2 = encoder.x2
+        self.compressed = encoder.sink
         return self.compressed
 
     def encode_symbol(self, y: int):
-        xmid = np.int64(self.x1 + (
-                (self.x2 - self.x1) >> 12) * self.predictor.p())  # shift by twelve accounts for the 12-bit probability
-        assert (self.x1 <= xmid < self.x2)
-        # print(xmid)
+        xmid = self.x1 + ((self.x2 - self.x1) >> PROB_BITS) * self.predictor.p()
         if y != 0:
             self.x2 = xmid
         else:
             self.x1 = xmid + 1
-
         self.predictor.update(y)
-        self.context += self.context + y
-        if self.context >= 512:
-            self.context = 1
 
         while ((self.x1 ^ self.x2) & 0xff000000) == 0:
-            # print(f"Shifting with x1 {self.x1} and x2 {self.x2}")
-            self.compressed.append((self.x2 >> 24).tobytes()[0])
-            self.x1 <<= 8
-            self.x2 = (self.x2 << 8) + 255
+            self.compressed.append(self.x2 >> 24)
+            self.x1 = (self.x1 << 8) & 0xffffffff
+            self.x2 = ((self.x2 << 8) & 0xffffffff) | 255
 
-    def decode(self, compressed: bytearray):
-        self.compressed = compressed
-        decompressed = bytearray()
-        for i in range(4):  # initialise first four bytes of x with compressed file
-            if len(compressed) == 0:
-                b = 0
-            else:
-                b = compressed.pop(0)
-            self.x = (self.x << 8) + (b & 0xff)
-
-        while self.decode_symbol() == 0:
-            b = 1
-            while b < 256:
-                b += b + self.decode_symbol()
-            decompressed.append(b - 256)
-        return decompressed
+    def decode(self, compressed):
+        """
+        Decode a stream, reading it through a cursor. Bytes past the end of the stream are read as zeros.
+        :param compressed: Buffer (bytes, bytearray, memoryview, mmap) or readable file-like object
+        :return: Decoded bytes
+        """
+        return ArithmeticDecoder(compressed, self.predictor).read()
 
     def decode_symbol(self):
-        xmid = np.int64(self.x1 + (
-                (self.x2 - self.x1) >> 12) * self.predictor.p())
-        assert self.x1 <= xmid < self.x2
+        xmid = self.x1 + ((self.x2 - self.x1) >> PROB_BITS) * self.predictor.p()
         y = 0
         if self.x <= xmid:
             y = 1
@@ -79,43 +526,538 @@ class ArithmeticBitCoder:
         self.predictor.update(y)
 
         while ((self.x1 ^ self.x2) & 0xff000000) == 0:
-            self.x1 <<= 8
-            self.x2 = (self.x2 << 8) + 255
-            if len(self.compressed) == 0:
-                c = 0
-            else:
-                c = self.compressed.pop(0)
-            self.x = (self.x << 8) + c
+            self.x1 = (self.x1 << 8) & 0xffffffff
+            self.x2 = ((self.x2 << 8) & 0xffffffff) | 255
+            self.x = ((self.x << 8) & 0xffffffff) | next(self.reader, 0)
 
         return y
 
     def flush(self):
         while ((self.x1 ^ self.x2) & 0xff000000) == 0:
-            self.compressed.append((self.x2 >> 24).tobytes()[0])
-            self.x1 <<= 8
-            self.x2 = (self.x2 << 8) + 255
-        self.compressed.append((self.x2 >> 24).tobytes()[0])
+            self.compressed.append(self.x2 >> 24)
+            self.x1 = (self.x1 << 8) & 0xffffffff
+            self.x2 = ((self.x2 << 8) & 0xffffffff) | 255
+        self.compressed.append(self.x2 >> 24)
+
+
+def encode_blocks(data, block_size=BLOCK_SIZE, workers=None):
+    """
+    Block-parallel mode: the data is split into fixed-size blocks which are coded with independent coder state
+    on a process pool. The stream starts with a block table so that blocks can also be decoded individually.
+    Stream format:
+    | # of blocks (8 bytes) | block size (8 bytes) | end offset of every coded block (8 bytes each) | coded blocks |
+    :param data: Any bytes-like object
+    :param block_size: Number of input bytes per block
+    :param workers: Number of worker processes, defaults to the number of CPUs
+    :return: Compressed stream
+    """
+    view = memoryview(data).cast("B")
+    blocks = [bytes(view[i:i + block_size]) for i in range(0, len(view), block_size)]
+    coded = _map_blocks(_encode_block, blocks, workers)
+    ends = np.cumsum([len(c) for c in coded], dtype=np.int64)
+    stream = bytearray(np.array([len(blocks), block_size], dtype=np.int64).tobytes() + ends.tobytes())
+    for c in coded:
+        stream += c
+    return stream
+
+
+def decode_blocks(compressed, workers=None):
+    """
+    Decode a stream written by encode_blocks, the blocks are decoded on a process pool
+    :param compressed: Buffer holding the complete stream
+    :param workers: Number of worker processes, defaults to the number of CPUs
+    :return: Decoded bytes
+    """
+    view = memoryview(compressed).cast("B")
+    starts, ends = _read_block_table(view)
+    decoded = bytearray()
+    for block in _map_blocks(_decode_block, [bytes(view[s:e]) for s, e in zip(starts, ends)], workers):
+        decoded += block
+    return decoded
+
+
+def decode_block(compressed, block_idx):
+    """
+    Decode a single block of a stream written by encode_blocks
+    :param compressed: Buffer holding the complete stream
+    :param block_idx: Index of the block, the block covers input bytes block_idx * block_size onwards
+    :return: Decoded bytes of the block
+    """
+    view = memoryview(compressed).cast("B")
+    starts, ends = _read_block_table(view)
+    return ArithmeticDecoder(view[starts[block_idx]:ends[block_idx]]).read()
+
+
+def _read_block_table(view):
+    n_blocks, _ = np.frombuffer(view[:16], dtype=np.int64)
+    len_table = 16 + 8 * int(n_blocks)
+    ends = np.frombuffer(view[16:len_table], dtype=np.int64) + len_table
+    starts = np.concatenate([[len_table], ends[:-1]]).astype(np.int64)
+    return starts.tolist(), ends.tolist()
+
+
+def _map_blocks(function, blocks, workers):
+    if len(blocks) <= 1 or workers == 1:
+        return [function(block) for block in blocks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, blocks))
+
+
+def _encode_block(block):
+    encoder = ArithmeticEncoder(length=len(block))
+    encoder.feed(block)
+    encoder.finish()
+    return bytes(encoder.sink)
+
+
+def _decode_block(stream):
+    return bytes(ArithmeticDecoder(stream).read())
+
+
+def estimate_size(data, runs=False):
+    """
+    Estimate the length of the stream ArithmeticEncoder(length=len(data), runs=runs) writes, without coding the data.
+    Within a block of ESTIMATE_BLOCK_SIZE bytes, the code length of the decisions of one context only depends on how
+    many 0s and 1s it codes, so only the byte values (and with runs, the run lengths) of every block are counted.
+    Counts are halved between blocks rather than at the decision that exceeds MAX_COUNT and probabilities are not
+    rounded to PROB_BITS bits, which is within a fraction of a percent of the real length.
+    :param data: Any bytes-like object
+    :param runs: Estimate a RUN_STREAM
+    :return: Estimated stream length in bytes
+    """
+    symbols = np.frombuffer(memoryview(data).cast("B"), dtype=np.uint8)
+    n_blocks = max(1, -(-len(symbols) // ESTIMATE_BLOCK_SIZE))
+    if runs and len(symbols):
+        # Of every run, the first RUN_THRESHOLD bytes are coded as bytes and the rest as its length
+        starts = np.concatenate(([0], np.flatnonzero(symbols[1:] != symbols[:-1]) + 1))
+        lengths = np.diff(np.append(starts, len(symbols)))
+        byte_counts = np.bincount(starts // ESTIMATE_BLOCK_SIZE * 256 + symbols[starts],
+                                  weights=np.minimum(lengths, RUN_THRESHOLD), minlength=n_blocks * 256)
+        long = lengths >= RUN_THRESHOLD
+        n0, n1 = _count_run_lengths(starts[long] // ESTIMATE_BLOCK_SIZE, lengths[long] - RUN_THRESHOLD, n_blocks)
+    else:
+        byte_counts = np.bincount(np.arange(len(symbols)) // ESTIMATE_BLOCK_SIZE * 256 + symbols,
+                                  minlength=n_blocks * 256)
+        n0 = n1 = 0
+    # The counts are exact in float64, whose matrix products are much faster than int64 ones
+    byte_counts = byte_counts.reshape(n_blocks, 256).astype(np.float64)
+    n0 = n0 + (byte_counts @ BYTE_ZEROS).astype(np.int64)
+    n1 = n1 + (byte_counts @ BYTE_ONES).astype(np.int64)
+    return LEN_COUNTED_HEADER + int(np.ceil(adaptive_code_length(n0, n1) / 8)) + 1
+
+
+def adaptive_code_length(n0, n1):
+    """
+    Code length of decisions coded with the probabilities of NaivePredictor, (count + 1) / (total + 2). The decisions
+    of a context in one block take log2((c0 + c1 + m0 + m1 + 1)! / (c0 + c1 + 1)! * c0! / (c0 + m0)! * c1! / (c1 + m1)!)
+    bits in any order, where c0, c1 are the counts before the block and m0, m1 the decisions in it.
+    :param n0: Number of 0s coded in every block and context, shape (blocks, contexts)
+    :param n1: Number of 1s coded in every block and context
+    :return: Code length in bits
+    """
+    c0 = np.zeros(n0.shape[1], dtype=np.int64)
+    c1 = np.zeros(n0.shape[1], dtype=np.int64)
+    log_factorial = _log2_factorials(2 * MAX_COUNT + 2 * int(max(n0.max(initial=0), n1.max(initial=0))) + 4)
+    bits = 0.0
+    for m0, m1 in zip(n0, n1):
+        bits += np.sum(log_factorial[c0 + c1 + m0 + m1 + 1] - log_factorial[c0 + c1 + 1]
+                       - log_factorial[c0 + m0] + log_factorial[c0] - log_factorial[c1 + m1] + log_factorial[c1])
+        c0 += m0
+        c1 += m1
+        while c0.max() > MAX_COUNT or c1.max() > MAX_COUNT:
+            halve = (c0 > MAX_COUNT) | (c1 > MAX_COUNT)
+            c0[halve] >>= 1
+            c1[halve] >>= 1
+    return float(bits)
+
+
+def _log2_factorials(n):
+    # log2(k!) for k < n
+    return np.concatenate(([0.0], np.cumsum(np.log2(np.arange(1, n, dtype=np.float64)))))
+
+
+def _count_run_lengths(blocks, runs, n_blocks):
+    # Decisions of the Elias-gamma codes of the runs per block, see ArithmeticEncoder.__code_run_length
+    n0 = np.zeros((n_blocks, N_CONTEXTS), dtype=np.int64)
+    n1 = np.zeros((n_blocks, N_CONTEXTS), dtype=np.int64)
+    values = runs + 1
+    n_bits = np.frexp(values.astype(np.float64))[1]
+    for i in range(int(n_bits.max(initial=0))):
+        n1[:, RUN_PREFIX_CONTEXTS + i] = np.bincount(blocks, weights=n_bits == i + 1, minlength=n_blocks)
+        n0[:, RUN_PREFIX_CONTEXTS + i] = np.bincount(blocks, weights=n_bits > i + 1, minlength=n_blocks)
+        coded = n_bits > i + 1  # bit i is coded below the leading one
+        ones = coded & ((values >> i) & 1).astype(bool)
+        n1[:, RUN_BIT_CONTEXTS + i] = np.bincount(blocks, weights=ones, minlength=n_blocks)
+        n0[:, RUN_BIT_CONTEXTS + i] = np.bincount(blocks, weights=coded & ~ones, minlength=n_blocks)
+    return n0, n1
+
+
+def encode_lanes(lanes):
+    """
+    Lockstep mode: independent lanes (e.g. the frequency rows of a spectrogram) are coded at the same time in one
+    process. The coder state of every lane is an entry of a NumPy array and every step codes one decision of all
+    lanes, so the interpreter overhead is shared by the lanes. Every lane is coded as the COUNTED_STREAM
+    ArithmeticEncoder would write for it.
+    Stream format:
+    | # of lanes (8 bytes) | end offset of every coded lane (8 bytes each) | coded lanes |
+    :param lanes: List of bytes-like objects
+    :return: Compressed stream
+    """
+    coded = _encode_lanes([np.frombuffer(memoryview(lane).cast("B"), dtype=np.uint8) for lane in lanes])
+    ends = np.cumsum([len(c) for c in coded], dtype=np.int64)
+    stream = bytearray(np.array([len(coded)], dtype=np.int64).tobytes() + ends.tobytes())
+    for c in coded:
+        stream += c
+    return stream
+
+
+def decode_lanes(compressed):
+    """
+    Decode a stream written by encode_lanes, all lanes in lockstep
+    :param compressed: Buffer holding the complete stream
+    :return: List with the decoded bytes of every lane
+    """
+    view = memoryview(compressed).cast("B")
+    n_lanes = int(np.frombuffer(view[:8], dtype=np.int64)[0])
+    len_table = 8 + 8 * n_lanes
+    ends = np.frombuffer(view[8:len_table], dtype=np.int64) + len_table
+    starts = np.concatenate([[len_table], ends[:-1]]).astype(np.int64)
+    return _decode_lanes([view[s:e] for s, e in zip(starts.tolist(), ends.tolist())])
+
+
+def split_lanes(data, n_lanes):
+    """
+    :param data: Any bytes-like object
+    :param n_lanes: Number of lanes, fewer if data is shorter
+    :return: List of n_lanes views of data of nearly equal length for encode_lanes
+    """
+    view = memoryview(data).cast("B")
+    n_lanes = max(1, min(n_lanes, len(view)))
+    bounds = [len(view) * i // n_lanes for i in range(n_lanes + 1)]
+    return [view[bounds[i]:bounds[i + 1]] for i in range(n_lanes)]
+
+
+def _lane_order(lengths):
+    # Lanes sorted by decreasing length, so the lanes still coding at any position are a prefix
+    order = np.argsort(-np.asarray(lengths, dtype=np.int64), kind="stable")
+    lengths = np.asarray(lengths, dtype=np.int64)[order]
+    max_len = int(lengths[0]) if len(lengths) else 0
+    n_active = len(lengths) - np.searchsorted(lengths[::-1], np.arange(max_len), side="right")
+    return order.tolist(), lengths, n_active.tolist()
+
+
+class _LaneModels:
+    # NaivePredictor and coder state of every lane, the counts of lane i are at i * COUNTED_CONTEXTS of flat arrays
+
+    def __init__(self, n_lanes):
+        self.n0 = np.zeros(n_lanes * COUNTED_CONTEXTS, dtype=np.int64)
+        self.n1 = np.zeros(n_lanes * COUNTED_CONTEXTS, dtype=np.int64)
+        self.probs = np.full(n_lanes * COUNTED_CONTEXTS, 1 << (PROB_BITS - 1), dtype=np.int64)
+        self.base = np.arange(n_lanes, dtype=np.int64) * COUNTED_CONTEXTS
+        self.x1 = np.zeros(n_lanes, dtype=np.int64)
+        self.x2 = np.full(n_lanes, 0xffffffff, dtype=np.int64)
+
+    def step(self, k, ctx, y=None, x=None):
+        """
+        Code one decision of the first k lanes
+        :param ctx: Context of every lane
+        :param y: Decisions to encode as bool array, or None to decode them with x
+        :return: Decisions, indices of the lanes whose leading byte is settled and has to be shifted out
+        """
+        slots = self.base[:k] + ctx
+        x1 = self.x1[:k]
+        x2 = self.x2[:k]
+        xmid = x1 + ((x2 - x1) >> PROB_BITS) * self.probs[slots]
+        if y is None:
+            y = x <= xmid
+        x1 = np.where(y, x1, xmid + 1)
+        x2 = np.where(y, xmid, x2)
+        c1 = self.n1[slots] + y
+        c0 = self.n0[slots] + ~y
+        if c0.max() > MAX_COUNT or c1.max() > MAX_COUNT:
+            halve = (c0 > MAX_COUNT) | (c1 > MAX_COUNT)
+            c0 >>= halve
+            c1 >>= halve
+        self.n0[slots] = c0
+        self.n1[slots] = c1
+        self.probs[slots] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+        self.x1[:k] = x1
+        self.x2[:k] = x2
+        return y, np.flatnonzero(x1 ^ x2 < 1 << 24)
+
+    def shift(self, lanes):
+        """
+        Shift the settled leading byte out of the given lanes
+        :return: The bytes, indices of the lanes that have another settled byte
+        """
+        x1 = self.x1[lanes]
+        x2 = self.x2[lanes]
+        self.x1[lanes] = (x1 << 8) & 0xffffffff
+        self.x2[lanes] = ((x2 << 8) & 0xffffffff) | 255
+        return x2 >> 24, lanes[(x1 ^ x2) & 0xffffff < 1 << 16]
+
+
+def _encode_lanes(lanes):
+    order, lengths, n_active = _lane_order([len(lane) for lane in lanes])
+    n_lanes = len(lanes)
+    data = np.zeros((len(n_active), n_lanes), dtype=np.int64)  # position-major, a position of all lanes is a row
+    for row, i in enumerate(order):
+        data[:len(lanes[i]), row] = lanes[i]
+    models = _LaneModels(n_lanes)
+    width = len(n_active) // 2 + 8 * MAX_BYTES_PER_DECISION
+    out = np.zeros(n_lanes * width, dtype=np.uint8)
+    n_out = np.zeros(n_lanes, dtype=np.int64)
+
+    for pos, k in enumerate(n_active):
+        if n_out[:k].max() > width - 8 * MAX_BYTES_PER_DECISION:
+            out = np.concatenate([out.reshape(n_lanes, width), np.zeros((n_lanes, width), dtype=np.uint8)], axis=1)
+            width *= 2
+            out = out.ravel()
+        byte = data[pos, :k]
+        ctx = np.ones(k, dtype=np.int64)
+        for shift in range(7, -1, -1):
+            y = ((byte >> shift) & 1).astype(bool)
+            _, moved = models.step(k, ctx, y)
+            ctx += ctx + y
+            while len(moved):
+                out[moved * width + n_out[moved]], next_moved = models.shift(moved)
+                n_out[moved] += 1
+                moved = next_moved
+
+    coded = [None] * n_lanes
+    out = out.reshape(n_lanes, width)
+    for row, i in enumerate(order):
+        header = bytes((COUNTED_STREAM,)) + np.array([lengths[row]], dtype=np.int32).tobytes()
+        coded[i] = header + out[row, :n_out[row]].tobytes() + bytes((int(models.x2[row]) >> 24,))
+    return coded
+
+
+def _decode_lanes(streams):
+    # Mirror of _encode_lanes, reads past the end of a lane give zeros like past the end of a single stream
+    headers = [bytes(stream[:LEN_COUNTED_HEADER]).ljust(LEN_COUNTED_HEADER, b"\0") for stream in streams]
+    for header in headers:
+        if header[0] != COUNTED_STREAM:
+            raise ValueError(f"Lanes must be counted streams, got format {header[0]}")
+    order, lengths, n_active = _lane_order([int(np.frombuffer(header[1:], dtype=np.int32)[0]) for header in headers])
+    n_lanes = len(streams)
+    # Every lane is followed by zeros for the reads of the last decisions, which go up to three bytes past its end
+    width = max((len(stream) for stream in streams), default=0) + MAX_BYTES_PER_DECISION
+    buffer = np.zeros(n_lanes * width, dtype=np.int64)
+    for row, i in enumerate(order):
+        buffer[row * width:row * width + len(streams[i])] = np.frombuffer(streams[i], dtype=np.uint8)
+    models = _LaneModels(n_lanes)
+    in_pos = np.arange(n_lanes, dtype=np.int64) * width + LEN_COUNTED_HEADER
+    x = np.zeros(n_lanes, dtype=np.int64)
+    for _ in range(4):
+        x = (x << 8) | buffer[in_pos]
+        in_pos += 1
+    decoded = np.zeros((len(n_active), n_lanes), dtype=np.uint8)
+
+    for pos, k in enumerate(n_active):
+        ctx = np.ones(k, dtype=np.int64)
+        for _ in range(8):
+            y, moved = models.step(k, ctx, x=x[:k])
+            ctx += ctx + y
+            while len(moved):
+                _, next_moved = models.shift(moved)
+                x[moved] = ((x[moved] << 8) & 0xffffffff) | buffer[in_pos[moved]]
+                in_pos[moved] += 1
+                moved = next_moved
+        decoded[pos, :k] = ctx - 256
+
+    lanes = [None] * n_lanes
+    for row, i in enumerate(order):
+        lanes[i] = bytearray(decoded[:lengths[row], row].tobytes())
+    return lanes
+
+
+@njit
+def _encode_bit(y, ctx, x1, x2, n0, n1, probs, out, n_out):
+    # One decision of ArithmeticEncoder.__code including the predictor update, returns the new coder state
+    xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[ctx]
+    c0 = n0[ctx]
+    c1 = n1[ctx]
+    if y:
+        x2 = xmid
+        c1 += 1
+    else:
+        x1 = xmid + 1
+        c0 += 1
+    if c0 > MAX_COUNT or c1 > MAX_COUNT:
+        c0 >>= 1
+        c1 >>= 1
+    n0[ctx] = c0
+    n1[ctx] = c1
+    probs[ctx] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+    while not (x1 ^ x2) & 0xff000000:
+        out[n_out] = x2 >> 24
+        n_out += 1
+        x1 = (x1 << 8) & 0xffffffff
+        x2 = ((x2 << 8) & 0xffffffff) | 255
+    return x1, x2, n_out
+
+
+@njit
+def _decode_bit(ctx, x1, x2, x, buffer, pos, n0, n1, probs):
+    # Mirror of _encode_bit, bytes past the end of the buffer are read as zeros
+    xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[ctx]
+    c0 = n0[ctx]
+    c1 = n1[ctx]
+    if x <= xmid:
+        y = 1
+        x2 = xmid
+        c1 += 1
+    else:
+        y = 0
+        x1 = xmid + 1
+        c0 += 1
+    if c0 > MAX_COUNT or c1 > MAX_COUNT:
+        c0 >>= 1
+        c1 >>= 1
+    n0[ctx] = c0
+    n1[ctx] = c1
+    probs[ctx] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+    while not (x1 ^ x2) & 0xff000000:
+        x1 = (x1 << 8) & 0xffffffff
+        x2 = ((x2 << 8) & 0xffffffff) | 255
+        x = ((x << 8) & 0xffffffff) | (buffer[pos] if pos < len(buffer) else 0)
+        pos += 1
+    return y, x1, x2, x, pos
+
+
+@njit
+def _encode_kernel(symbols, run_starts, run_lengths, pos, i_run, legacy, n0, n1, probs, ctx, x1, x2, out):
+    # Kernel of ArithmeticEncoder.__code and __code_runs. Codes the symbols from pos on, where the rest of the i-th
+    # run after RUN_THRESHOLD bytes is coded as its length. Stops early when out may not hold the next step and
+    # returns where to continue along with the coder state and the number of bytes written.
+    n_contexts = N_CONTEXTS if legacy else COUNTED_CONTEXTS
+    n_out = 0
+    while (pos < len(symbols) or i_run < len(run_starts)) and n_out <= len(out) - MAX_STEP_BYTES:
+        if i_run < len(run_starts) and pos == run_starts[i_run] + RUN_THRESHOLD:
+            # Elias-gamma code of the run length + 1
+            value = run_lengths[i_run] - RUN_THRESHOLD + 1
+            n_bits = 1
+            while value >> n_bits:
+                n_bits += 1
+            for i in range(n_bits):
+                x1, x2, n_out = _encode_bit(int(i == n_bits - 1), RUN_PREFIX_CONTEXTS + i, x1, x2, n0, n1, probs,
+                                            out, n_out)
+            for k in range(n_bits - 2, -1, -1):
+                x1, x2, n_out = _encode_bit((value >> k) & 1, RUN_BIT_CONTEXTS + k, x1, x2, n0, n1, probs, out,
+                                            n_out)
+            pos = run_starts[i_run] + run_lengths[i_run]
+            i_run += 1
+            continue
+        b = symbols[pos]
+        for k in range(0 if legacy else 1, 9):  # continuation flag (0), then the bits MSB first
+            y = (b >> (8 - k)) & 1 if k else 0
+            x1, x2, n_out = _encode_bit(y, ctx, x1, x2, n0, n1, probs, out, n_out)
+            ctx += ctx + y
+            if ctx >= n_contexts:
+                ctx = 1
+        pos += 1
+    return pos, i_run, ctx, x1, x2, n_out
+
+
+@njit
+def _decode_kernel(buffer, pos, x1, x2, x, n0, n1, probs, ctx, n_contexts, first_b, runs, remaining, last, repeats,
+                   out):
+    # Kernel of ArithmeticDecoder.chunks, decodes whole bytes until out is full or the stream ends. The rest of a run
+    # that does not fit into out is returned as pending.
+    n_out = 0
+    pending = 0
+    b = first_b
+    while n_out < len(out):
+        y, x1, x2, x, pos = _decode_bit(ctx, x1, x2, x, buffer, pos, n0, n1, probs)
+        ctx += ctx + y
+        if ctx >= n_contexts:
+            ctx = 1
+        if b:
+            b += b + y
+            if b >= 256:
+                out[n_out] = b - 256
+                n_out += 1
+                remaining -= 1
+                if runs:
+                    if b == last:
+                        repeats += 1
+                        if repeats == RUN_THRESHOLD:
+                            # Elias-gamma coded run length, see ArithmeticEncoder.__code_run_length
+                            n_bits = 1
+                            while True:
+                                y, x1, x2, x, pos = _decode_bit(RUN_PREFIX_CONTEXTS + n_bits - 1, x1, x2, x, buffer,
+                                                                pos, n0, n1, probs)
+                                if y:
+                                    break
+                                if n_bits == 32:
+                                    return pos, x1, x2, x, ctx, remaining, last, repeats, n_out, 0, KERNEL_CORRUPT_RUN
+                                n_bits += 1
+                            value = 1
+                            for k in range(n_bits - 2, -1, -1):
+                                y, x1, x2, x, pos = _decode_bit(RUN_BIT_CONTEXTS + k, x1, x2, x, buffer, pos, n0, n1,
+                                                                probs)
+                                value += value + y
+                            run = value - 1
+                            remaining -= run
+                            repeats = 0
+                            if remaining < 0:
+                                return pos, x1, x2, x, ctx, remaining, last, repeats, n_out, 0, KERNEL_RUN_PAST_END
+                            fill = min(run, len(out) - n_out)
+                            out[n_out:n_out + fill] = b - 256
+                            n_out += fill
+                            pending = run - fill
+                    else:
+                        last = b
+                        repeats = 1
+                b = first_b
+                if not remaining:
+                    return pos, x1, x2, x, ctx, remaining, last, repeats, n_out, pending, KERNEL_DONE
+                if pending:
+                    break
+        elif y:
+            return pos, x1, x2, x, ctx, remaining, last, repeats, n_out, pending, KERNEL_DONE
+        else:
+            b = 1
+    return pos, x1, x2, x, ctx, remaining, last, repeats, n_out, pending, KERNEL_MORE
 
 
 class NaivePredictor:
 
     def __init__(self):
         self.context = 1
-        self.counter = [[0] * 2 for i in range(512)]
+        # Lists are fastest for the pure-Python loops, the kernels need arrays
+        if JIT:
+            self.n0 = np.zeros(N_CONTEXTS, dtype=np.int64)  # bit counts per context
+            self.n1 = np.zeros(N_CONTEXTS, dtype=np.int64)
+            self.probs = np.full(N_CONTEXTS, 1 << (PROB_BITS - 1), dtype=np.int64)  # 12-bit probability of a 1
+        else:
+            self.n0 = [0] * N_CONTEXTS  # bit counts per context
+            self.n1 = [0] * N_CONTEXTS
+            self.probs = [1 << (PROB_BITS - 1)] * N_CONTEXTS  # 12-bit probability of a 1 per context
 
     def p(self):
-        return np.int64(4096 * (self.counter[self.context][1] + 1) / (
-                self.counter[self.context][0] + self.counter[self.context][1] + 2))
+        return self.probs[self.context]
 
     def update(self, y):
-        self.counter[self.context][y] += 1
-        if self.counter[self.context][y] > 65534:
-            self.counter[self.context][0] >>= 1
-            self.counter[self.context][1] >>= 1
+        self.update_slot(y, self.context)
         self.context += self.context + y
-        if self.context >= 512:
+        if self.context >= N_CONTEXTS:
             self.context = 1
 
+    def update_slot(self, y, ctx):
+        c0 = self.n0[ctx]
+        c1 = self.n1[ctx]
+        if y:
+            c1 += 1
+        else:
+            c0 += 1
+        if c0 > MAX_COUNT or c1 > MAX_COUNT:
+            c0 >>= 1
+            c1 >>= 1
+        self.n0[ctx] = c0
+        self.n1[ctx] = c1
+        self.probs[ctx] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+
 
 def test():
     data = b'\r\x00\x05\x00\xfb\xff\xf5\xff\x02\x00\xcf\xff\xf6\xff\xfa\xff\x01\x00\xfc\xff\r\x00\xfb\xff\x0e\x00\xfd\xff\x03\x00\xff\xff\x07\x00\xff\xff\x06\x00\x00\x00\x06\x00\xfa\xff\x04\x00\xfe\xff\xfd\xff\xfe\xff\xff\xff\xff\xff\xf4\xff\xfb\xff\x01\x00\xfe\xff\x01\x00\x02\x00\x0b\x00\x04\x00\xfe\xff\xff\xff\xff\xff\xff\xff\xff\xff\x06\x00\x01\x00\x03\x00\xfe\xff\xff\xff\x02\x00\xff\xff\x00\x00\x00\x00\x00\x00\x04\x00\x07\x00\xfe\xff\x00\x00\x00\x00\xff\xff\xfe\xff\xfb\xff\x00\x00\x01\x00\xfe\xff\xff\xff\xff\xff\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\xfb\xff\x04\x00\xff\xff\x01\x00\x02\x00\x01\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\xff\xff\xfe\xff\x02\x00\x00\x00\x00\x00\xff\xff\xfe\xff\x03\x00\xfe\xff\xfe\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\xfe\xff\x01\x00\x02\x00\x02\x00\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x01\x00\x01\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x02\x00\x01\x00\xff\xff\x01\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x01\x00\x02\x00\x00\x00\x01\x00\x01\x00\x00\x00\x02\x00\xff\xff\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\x00\x00\x01\x00\x00\x00\xfd\xff\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x01\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x01\x00\x01\x00\xff\xff\x01\x00\x00\x00\x00\x00\x01\x00\x01\x00\xff\xff\x00\x00\x01\x00\xff\xff\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\xff\xff\x01\x00\x01\x00\x00\x00\x01\x00\xff\xff\x01\x00\x01\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x10\x00\r\x00\xf3\xff\x05\x00\xfe\xff\x0b\x00\x04\x00\x01\x00\xff\xff\x06\x00\x05\x00\xfb\xff\xfa\xff\xfe\xff\x00\x00\x03\x00\xfe\xff\x05\x00\xff\xff\x02\x00\xfc\xff\xfc\xff\xfd\xff\xfe\xff\x02\x00\xf8\xff\x04\x00\xfa\xff\xf9\xff\xff\xff\x02\x00\x02\x00\x00\x00\x03\x00\x05\x00\xfe\xff\xff\xff\xff\xff\xff\xff\xff\xff\x00\x00\x02\x00\x02\x00\xff\xff\x00\x00\xff\xff\x01\x00\x00\x00\xff\xff\x01\x00\x02\x00\x02\x00\x04\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\xfe\xff\x00\x00\x01\x00\xff\xff\x01\x00\xff\xff\xff\xff\x00\x00\x00\x00\x01\x00\xff\xff\x02\x00\xff\xff\x01\x00\x01\x00\x01\x00\xfd\xff\x03\x00\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x01\x00\x01\x00\xff\xff\xff\xff\xff\xff\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x01\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\r\x00\xfa\xff\xf8\xff\xf8\xff\x19\x00\xb5\xff\xc8\xff\xf6\xff\t\x00\x0c\x00\x15\x00\xe1\xff\x06\x00\xfb\xff\x06\x00\x07\x00\xfc\xff\x1a\x00\xfc\xff\xfe\xff\xee\xff\x01\x00\xfc\xff\x06\x00\x02\x00\x02\x00\xfd\xff\x00\x00\r\x00\xf4\xff\x03\x00\xff\xff\x01\x00\x04\x00\xeb\xff\xf4\xff\x00\x00\x00\x00\xff\xff\x01\x00\xfd\xff\xf6\xff\x03\x00\t\x00\xff\xff\x02\x00\xfe\xff\xff\xff\x02\x00\xfe\xff\xfd\xff\xff\xff\xfd\xff\xff\xff\x00\x00\x00\x00\x02\x00\xfd\xff\x01\x00\x03\x00\x01\x00\x01\x00\xfe\xff\xff\xff\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\xfa\xff\x05\x00\xfc\xff\x04\x00\xff\xff\x01\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\xff\xff\x00\x00\xff\xff\x02\x00\x01\x00\xfe\xff\x00\x00\x01\x00\x00\x00\x01\x00\xff\xff\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\xfe\xff\x02\x00\xfd\xff\xfd\xff\x01\x00\x01\x00\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\xff\xff\xff\xff\xff\xff\xff\xff\x01\x00\xff\xff\xff\xff\x00\x00\x01\x00\x00\x00\x01\x00\x01\x00\xff\xff\x00\x00\x00\x00\x01\x00\xff\xff\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x01\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\xff\xff\x02\x00\xfe\xff\xff\xff\x01\x00\x01\x00\x01\x00\x01\x00\xff\xff\x01\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x01\x00\xff\xff\x01\x00\x01\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x0b\x00\x06\x00\x0e\x00\x04\x00\xfd\xff\x06\x00\x08\x00\x00\x00\xfe\xff\x02\x00\xfa\xff\x05\x00\xfc\xff\x01\x00\x06\x00\x00\x00\xfc\xff\xfb\xff\xfd\xff\x01\x00\xf6\xff\x05\x00\x03\x00\xfc\xff\xfe\xff\xfe\xff\x01\x00\x01\x00\x03\x00\x06\x00\xfa\xff\xfd\xff\xff\xff\xff\xff\xf5\xff\xfd\xff\x01\x00\x01\x00\x00\x00\xff\xff\x03\x00\xfb\xff\x00\x00\x01\x00\x02\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x02\x00\x03\x00\x00\x00\xff\xff\x01\x00\xff\xff\x00\x00\x04\x00\x00\x00\x01\x00\x02\x00\xff\xff\xff\xff\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\xfd\xff\xfe\xff\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\xff\xff\x00\x00\x01\x00\xfd\xff\x02\x00\x01\x00\x00\x00\xfe\xff\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x02\x00\xff\xff\x00\x00\xfc\xff\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xfe\xff\x01\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\xff\xff\xff\xff\x00\x00\x00\x00\xff\xff\x01\x00\xff\xff\xff\xff\xff\xff\xfe\xff\x01\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x02\x00\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x01\x00\xff\xff\xff\xff\x01\x00\x01\x00\x00\x00\x02\x00\x01\x00\x00\x00\xff\xff\xff\xff\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x01\x00\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
@@ -130,5 +1072,78 @@ def test_decode():
     pass
 
 
+def test_lanes():
+    # Every lane has to be the stream the scalar encoder writes for it
+    import random
+    rng = random.Random(1)
+    lanes = [bytes(min(int(rng.expovariate(0.3)), 127) for _ in range(rng.randint(0, 300))) for _ in range(50)]
+    lanes += [b"", b"a", b"\xff" * 1000, bytes(range(256)) * 3]
+    stream = encode_lanes(lanes)
+    len_table = 8 + 8 * len(lanes)
+    ends = np.frombuffer(bytes(stream[8:len_table]), dtype=np.int64) + len_table
+    for i, (start, end, lane) in enumerate(zip([len_table] + ends[:-1].tolist(), ends.tolist(), lanes)):
+        assert bytes(stream[start:end]) == bytes(ArithmeticBitCoder().encode(lane)), f"Lane {i} differs"
+    assert [bytes(lane) for lane in decode_lanes(stream)] == lanes
+    print(f"Coded {len(lanes)} lanes in lockstep")
+
+
+def test_estimate():
+    # The estimate has to be close to the real length, also once counts are halved and with runs
+    import random
+    rng = random.Random(2)
+    inputs = [bytes(min(int(rng.expovariate(0.3)), 127) for _ in range(50000)),
+              bytes(min(int(rng.expovariate(0.05 + i / 200000)), 255) for i in range(200000)),
+              b"".join(bytes([rng.choice((0, 0, 0, 1, 7))]) * rng.randint(1, 40) for _ in range(20000))]
+    for data in inputs:
+        for runs in (False, True):
+            start = time.perf_counter()
+            estimate = estimate_size(data, runs)
+            estimate_time = time.perf_counter() - start
+            encoder = ArithmeticEncoder(length=len(data), runs=runs)
+            encoder.feed(data)
+            encoder.finish()
+            real = len(encoder.sink)
+            assert abs(estimate - real) <= 0.005 * real + 8, (estimate, real)
+            print(f"Estimated {estimate} bytes for {real} in {estimate_time * 1000:.1f} ms (runs: {runs})")
+
+
+def benchmark(n_bytes=100000):
+    """
+    Compare encode/decode throughput with the former np.int64 implementation and check that the streams are identical
+    :param n_bytes: Length of the synthetic test input (small amplitudes similar to the toco amplitude stream)
+    """
+    import random
+    from ReferenceArithmeticBitCoder import ArithmeticBitCoder as ReferenceArithmeticBitCoder
+
+    rng = random.Random(0)
+    data = bytes(min(int(rng.expovariate(0.3)), 127) for _ in range(n_bytes))
+
+    results = {}
+    # The reference only writes legacy streams, the fast coder is compared in both formats
+    for name, encode in (("reference", lambda d: ReferenceArithmeticBitCoder().encode(d)),
+                         ("fast", _legacy_encode), ("fast, counted", lambda d: ArithmeticBitCoder().encode(d))):
+        start = time.perf_counter()
+        enc = encode(data)
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        dec = ArithmeticBitCoder().decode(bytearray(enc))
+        decode_time = time.perf_counter() - start
+        assert dec == data
+        results[name] = bytes(enc)
+        print(f"{name}: encode {n_bytes / encode_time / 1000:.1f} KB/s, decode {n_bytes / decode_time / 1000:.1f} KB/s,"
+              f" {len(enc)} bytes")
+    assert results["reference"] == results["fast"], "Streams differ from the reference implementation"
+
+
+def _legacy_encode(data):
+    encoder = ArithmeticEncoder()
+    encoder.feed(data)
+    encoder.finish()
+    return encoder.sink
+
+
 if __name__ == "__main__":
     test()
+    test_lanes()
+    test_estimate()
+    benchmark()
@@ -0,0 +1,171 @@
+import time
+import numpy as np
+
+# Interleaved range-ANS coder for whole sections. Unlike the adaptive arithmetic coder, symbol statistics are counted
+# up front and stored in the stream, one order-0 frequency table per block of input so that the tables follow the
+# data (spectrogram sections are ordered by frequency line and their statistics drift). The input is dealt
+# round-robin to independent lanes and every lane keeps its own state, which lets NumPy update all lanes of a step
+# at once.
+FREQ_BITS = 12  # symbol frequencies are normalised to sum up to 1 << FREQ_BITS
+FREQ_TOTAL = 1 << FREQ_BITS
+STATE_LOW = 1 << 16  # lane states are kept in [STATE_LOW, STATE_LOW << 16)
+WORD_BITS = 16  # renormalisation moves 16 bits at a time, i.e. at most one word per symbol
+MIN_LANES = 32
+MAX_LANES = 1024
+SYMBOLS_PER_LANE = 2048  # the number of lanes grows with the section length up to MAX_LANES
+TABLE_BLOCK_BITS = 16  # every 64 KiB of input get their own frequency table
+LEN_STREAM_HEADER = 8
+LEN_TABLE = 2 * 256
+
+
+def rans_encode(data):
+    """
+    Encode a section with the interleaved rANS coder
+    Stream format:
+    | # of bytes (4 bytes) | # of lanes (4 bytes) | frequency of every byte value per block (256 * 2 bytes each) |
+    | final state of every lane (4 bytes each) | renormalisation words (2 bytes each) |
+    :param data: Any bytes-like object
+    :return: Compressed stream
+    """
+    symbols = np.frombuffer(memoryview(data).cast("B"), dtype=np.uint8)
+    n_bytes = len(symbols)
+    n_lanes = min(max(n_bytes // SYMBOLS_PER_LANE, MIN_LANES), MAX_LANES)
+    n_blocks = (n_bytes + (1 << TABLE_BLOCK_BITS) - 1) >> TABLE_BLOCK_BITS
+    # Symbols are indexed into the flattened tables of all blocks
+    table_idx = (np.arange(n_bytes) >> TABLE_BLOCK_BITS) * 256 + symbols
+    counts = np.bincount(table_idx, minlength=n_blocks * 256).reshape(n_blocks, 256)
+    freq = np.array([normalise_frequencies(c) for c in counts], dtype=np.int64).reshape(n_blocks, 256)
+    cum = (np.cumsum(freq, axis=1) - freq).astype(np.uint64).ravel()
+    # Per-symbol coding parameters are looked up once for the whole section
+    sym_freq = freq.astype(np.uint64).ravel()[table_idx]
+    sym_cum = cum[table_idx]
+    sym_max = sym_freq << np.uint64(2 * WORD_BITS - FREQ_BITS)  # states at or above this are renormalised first
+
+    # rANS decodes in reverse order of encoding, so the steps are coded back to front and the words of every
+    # step are collected in lane order. The decoder reads them front to back.
+    states = np.full(n_lanes, STATE_LOW, dtype=np.uint64)
+    words = []
+    for start in range(((n_bytes - 1) // n_lanes) * n_lanes if n_bytes else -1, -1, -n_lanes):
+        step = slice(start, start + n_lanes)
+        f = sym_freq[step]
+        x = states[:len(f)]
+        renorm = x >= sym_max[step]
+        words.append((x[renorm] & 0xffff).astype(np.uint16))
+        x[renorm] >>= np.uint64(WORD_BITS)
+        q, r = np.divmod(x, f)
+        x[:] = (q << np.uint64(FREQ_BITS)) + r + sym_cum[step]
+    words.reverse()
+
+    header = np.array([n_bytes, n_lanes], dtype=np.int32).tobytes() + freq.astype(np.uint16).tobytes()
+    return header + states.astype(np.uint32).tobytes() + np.concatenate(words + [np.zeros(0, np.uint16)]).tobytes()
+
+
+def rans_decode(compressed):
+    """
+    Decode a stream written by rans_encode
+    :param compressed: Buffer holding the complete stream, e.g. a memoryview of a section inside a larger file
+    :return: Decoded bytearray, like ArithmeticDecoder.read
+    """
+    view = memoryview(compressed).cast("B")
+    n_bytes, n_lanes = (int(v) for v in np.frombuffer(view[:8], dtype=np.int32))
+    if n_bytes == 0:
+        return bytearray()
+    n_blocks = (n_bytes + (1 << TABLE_BLOCK_BITS) - 1) >> TABLE_BLOCK_BITS
+    tables_end = LEN_STREAM_HEADER + n_blocks * LEN_TABLE
+    freq = np.frombuffer(view[LEN_STREAM_HEADER:tables_end], dtype=np.uint16).reshape(n_blocks, 256).astype(np.int64)
+    states_end = tables_end + 4 * n_lanes
+    states = np.frombuffer(view[tables_end:states_end], dtype=np.uint32).astype(np.uint64)
+    words = np.frombuffer(view[states_end:], dtype=np.uint16).astype(np.uint64)
+    if np.any(freq.sum(axis=1) != FREQ_TOTAL):
+        raise ValueError("Corrupt rANS stream")
+
+    # Decoding tables indexed by block * FREQ_TOTAL + slot
+    cum = np.cumsum(freq, axis=1) - freq
+    slot_symbol = np.concatenate([np.repeat(np.arange(256, dtype=np.uint8), f) for f in freq])  # symbol of every slot
+    slot_table = (np.arange(n_blocks * FREQ_TOTAL) >> FREQ_BITS) * 256 + slot_symbol
+    slot_freq = freq.ravel().astype(np.uint64)[slot_table]
+    slot_bias = (np.arange(n_blocks * FREQ_TOTAL) % FREQ_TOTAL - cum.ravel()[slot_table]).astype(np.uint64)
+
+    out = bytearray(n_bytes)
+    decoded = np.frombuffer(out, dtype=np.uint8)  # writable view, the symbols are decoded into out without a copy
+    lane_offsets = np.arange(n_lanes, dtype=np.uint64)
+    pos = 0
+    for start in range(0, n_bytes, n_lanes):
+        x = states[:min(n_lanes, n_bytes - start)]
+        # Slot within the table of the block every lane's symbol belongs to
+        slot = (((lane_offsets[:len(x)] + np.uint64(start)) >> np.uint64(TABLE_BLOCK_BITS)) << np.uint64(FREQ_BITS)) \
+            | (x & np.uint64(FREQ_TOTAL - 1))
+        decoded[start:start + len(x)] = slot_symbol[slot]
+        x[:] = slot_freq[slot] * (x >> np.uint64(FREQ_BITS)) + slot_bias[slot]
+        renorm = x < STATE_LOW
+        n_words = int(np.count_nonzero(renorm))
+        if pos + n_words > len(words):
+            raise ValueError("Corrupt rANS stream")
+        x[renorm] = (x[renorm] << np.uint64(WORD_BITS)) | words[pos:pos + n_words]
+        pos += n_words
+    if pos != len(words) or np.any(states != STATE_LOW):
+        raise ValueError("Corrupt rANS stream")
+    return out
+
+
+def normalise_frequencies(counts):
+    """
+    Scale byte counts to frequencies summing up to FREQ_TOTAL, every byte that occurs keeps a frequency of at least 1
+    :param counts: Occurrences of every byte value
+    :return: np.int64 array of 256 frequencies
+    """
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(256, dtype=np.int64)
+    freq = counts.astype(np.int64) * FREQ_TOTAL // total
+    freq[(counts > 0) & (freq == 0)] = 1
+    # Rounding leaves the sum off by a little, the difference is taken from (or given to) the most frequent bytes
+    diff = FREQ_TOTAL - int(freq.sum())
+    while diff:
+        top = int(np.argmax(freq))
+        change = diff if diff > 0 else max(diff, 1 - int(freq[top]))
+        freq[top] += change
+        diff -= change
+    return freq
+
+
+def benchmark(n_bytes=2000000):
+    """
+    Compare rANS with the arithmetic coder on a synthetic section (small amplitudes similar to the toco residue)
+    :param n_bytes: Length of the synthetic test input
+    """
+    from ArithmeticBitCoder import ArithmeticDecoder
+
+    rng = np.random.default_rng(0)
+    data = np.clip(rng.laplace(0, 3, n_bytes).round(), -127, 127).astype(np.int8).tobytes()
+    for name, encode, decode in (("rANS", rans_encode, rans_decode),
+                                 ("arithmetic", _arithmetic_encode, lambda c: ArithmeticDecoder(c).read())):
+        start = time.perf_counter()
+        enc = encode(data)
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        dec = decode(enc)
+        decode_time = time.perf_counter() - start
+        assert bytes(dec) == data
+        print(f"{name}: encode {n_bytes / encode_time / 1e6:.2f} MB/s, decode {n_bytes / decode_time / 1e6:.2f} MB/s,"
+              f" {len(enc)} bytes")
+
+
+def _arithmetic_encode(data):
+    from ArithmeticBitCoder import ArithmeticEncoder
+    encoder = ArithmeticEncoder(length=len(data))
+    encoder.feed(data)
+    encoder.finish()
+    return encoder.sink
+
+
+def test():
+    for data in (b"", b"a", b"aaaa", bytes(range(256)) * 3, np.random.default_rng(1).bytes(100000),
+                 bytes(50000) + b"\x01", bytes(100000) + bytes(range(256)) * 300):
+        assert rans_decode(rans_encode(data)) == data
+    print("rANS round trips ok")
+
+
+if __name__ == "__main__":
+    test()
+    benchmark()
@@ -0,0 +1,175 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.ArithmeticBitCoder import ArithmeticEncoder, ArithmeticDecoder, JIT, encode_lanes, decode_lanes, \
+    split_lanes, estimate_size
+from utils.RANSCoder import rans_encode, rans_decode
+
+# Entropy coding of the sections of the toco, ltoco and veco containers. Every container starts with a header of
+# int32 fields, the last of which selects the entropy backend. Files written before the backend was recorded lack
+# that field and are arithmetic coded.
+ARITHMETIC_BACKEND = 0
+RANS_BACKEND = 1
+LANES_BACKEND = 2  # arithmetic coder, long sections split into up to N_LANES streams coded in lockstep
+N_LANES = 513  # about one lane per frequency line of the codecs' 1024 sample STFT frames
+MIN_LANE_BYTES = 2048  # every lane learns its own model, shorter lanes make the section noticeably larger
+MIN_LANES = 128  # fewer lanes are slower than the single coder, such sections are coded by it
+LEN_BACKEND = 4  # length of the backend field, missing in legacy headers
+SINGLE_CODER_LANES = bytes(8)  # lane count of a lanes section too short for lanes, see encode_section
+
+
+def encode_section(data, backend=ARITHMETIC_BACKEND):
+    """
+    :param data: Any bytes-like object
+    :param backend: Entropy backend the section is coded with
+    :return: Compressed section
+    """
+    if backend == RANS_BACKEND:
+        return rans_encode(data)
+    if backend == LANES_BACKEND:
+        n_lanes = min(memoryview(data).nbytes // MIN_LANE_BYTES, N_LANES)
+        if n_lanes >= MIN_LANES:
+            return encode_lanes(split_lanes(data, n_lanes))
+        return SINGLE_CODER_LANES + encode_section(data)  # a lane count of 0, the single coder's stream follows
+    ae = ArithmeticEncoder(length=memoryview(data).nbytes, runs=True)  # every section uses a fresh coder
+    ae.feed(data)
+    ae.finish()
+    return ae.sink
+
+
+def decode_section(section, backend):
+    if backend == RANS_BACKEND:
+        return rans_decode(section)
+    if backend == LANES_BACKEND:
+        view = memoryview(section).cast("B")
+        if view[:len(SINGLE_CODER_LANES)] == SINGLE_CODER_LANES:
+            return ArithmeticDecoder(view[len(SINGLE_CODER_LANES):]).read()
+        return bytearray().join(decode_lanes(section))
+    return ArithmeticDecoder(section).read()
+
+
+def encode_sections(sections, backend, workers=None):
+    """
+    Code the sections of a container. They are independent streams, so they are coded concurrently.
+    :param sections: Bytes-like objects
+    :param backend: Entropy backend all sections are coded with
+    :param workers: Number of processes, by default one per section up to the number of cores
+    :return: List of compressed sections in the order of sections
+    """
+    return _map_sections(encode_section, sections, backend, workers)
+
+
+def write_sections(file, sections, backend, workers=None):
+    """
+    Code the sections of a container and write them to a file one after the other. With one worker, every section is
+    streamed into the file while it is coded. Otherwise they are coded concurrently and written once all are done.
+    :param file: Writable file-like object, positioned behind the header
+    :param sections: Bytes-like objects
+    :param backend: Entropy backend all sections are coded with
+    :param workers: Number of processes, by default one per section up to the number of cores
+    :return: List of the lengths of the compressed sections
+    """
+    if _n_workers(sections, workers) <= 1:
+        return [_stream_section(section, backend, file) for section in sections]
+    lengths = []
+    for section in encode_sections(sections, backend, workers):
+        file.write(section)
+        lengths.append(len(section))
+    return lengths
+
+
+def _stream_section(data, backend, file):
+    if backend != ARITHMETIC_BACKEND:
+        section = encode_section(data, backend)
+        file.write(section)
+        return len(section)
+    ae = ArithmeticEncoder(file, length=memoryview(data).nbytes, runs=True)
+    ae.feed(data)
+    return ae.finish()
+
+
+def decode_sections(sections, backend, workers=None):
+    return _map_sections(decode_section, sections, backend, workers)
+
+
+def _n_workers(sections, workers):
+    return min(len(sections), os.cpu_count() or 1) if workers is None else workers
+
+
+def _map_sections(function, sections, backend, workers):
+    if _n_workers(sections, workers) <= 1:
+        return [function(section, backend) for section in sections]
+    # Views of the file can't be sent to worker processes, so the sections are copied
+    with ProcessPoolExecutor(max_workers=_n_workers(sections, workers)) as executor:
+        return list(executor.map(function, [bytes(section) for section in sections], [backend] * len(sections)))
+
+
+def print_estimate(infile, len_header, sections):
+    # Compression ratio of the arithmetic coder, from estimate_size instead of coding the sections
+    start = time.time()
+    size = len_header + sum(estimate_size(section, runs=True) for section in sections)
+    print(f"Estimated compression ratio: 1:{os.path.getsize(infile) / size} ({size} bytes,"
+          f" estimated in {(time.time() - start) * 1000:.0f} ms)")
+
+
+def backend_name(backend):
+    # The arithmetic coder runs as numba kernels when numba is installed, which is about 10x faster
+    if backend == RANS_BACKEND:
+        return "(rANS)"
+    if backend == LANES_BACKEND:
+        return f"(arithmetic, up to {N_LANES} lanes in lockstep)"
+    return "(arithmetic, numba kernels)" if JIT else "(arithmetic, pure Python)"
+
+
+def read_fields(fbytes, n_fields, section_fields):
+    """
+    Read the header of a container file
+    :param fbytes: Contents of the file
+    :param n_fields: Number of int32 fields of the header, the backend included
+    :param section_fields: Indices of the fields that hold the lengths of the sections behind the header
+    :return: (list of the fields with the backend last, length of the header). The section lengths of legacy files only
+    add up with the shorter header, their backend is ARITHMETIC_BACKEND.
+    """
+    len_header = 4 * n_fields
+    if len(fbytes) >= len_header:
+        fields = np.frombuffer(fbytes[0:len_header], dtype=np.int32)
+        if len_header + sum(int(fields[i]) for i in section_fields) == len(fbytes):
+            return list(fields), len_header
+    fields = np.frombuffer(fbytes[0:len_header - LEN_BACKEND], dtype=np.int32)
+    return list(fields) + [ARITHMETIC_BACKEND], len_header - LEN_BACKEND
+
+
+def test():
+    # Run as python3 -m utils.SectionCoder in compressors/. A container of a packed index section as in toco and a
+    # residue section is written to a file and read back as the codecs do, for every backend and worker count.
+    rng = np.random.default_rng(0)
+    indexes = rng.random((64, 300)) < 0.2
+    residue = np.clip(rng.laplace(0, 3, 300000).round(), -127, 127).astype(np.int8).tobytes()  # long enough for lanes
+    path = os.path.join(tempfile.mkdtemp(), "test.tc")
+    for backend in (ARITHMETIC_BACKEND, RANS_BACKEND, LANES_BACKEND):
+        for workers in (1, 2):
+            with open(path, "wb") as file:
+                file.write(bytes(12))
+                lengths = write_sections(file, [np.packbits(indexes), residue], backend, workers)
+                file.seek(0)
+                file.write(np.array(lengths + [backend], dtype=np.int32).tobytes())
+            with open(path, "rb") as file:
+                fbytes = file.read()
+            (len_indexes, len_residue, read_backend), len_header = read_fields(fbytes, 3, (0, 1))
+            fview = memoryview(fbytes)
+            indexbytes, residuebytes = decode_sections([fview[len_header:len_header + len_indexes],
+                                                        fview[len_header + len_indexes:]], read_backend, workers)
+            assert read_backend == backend
+            assert np.array_equal(np.unpackbits(indexbytes)[:indexes.size].reshape(indexes.shape), indexes)
+            assert np.frombuffer(residuebytes, dtype=np.int8).tobytes() == residue
+        print(f"Container round trip ok {backend_name(backend)}")
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    test()
@@ -5,12 +5,14 @@ from tsc import compress_tsc, reconstruct_tsc
 import soundfile as sf
 import librosa
 import librosa.core.spectrum
-from utils.ArithmeticBitCoder import ArithmeticBitCoder
+from utils.SectionCoder import ARITHMETIC_BACKEND, RANS_BACKEND, write_sections, decode_sections, \
+    print_estimate, read_fields
 from sklearn.cluster import KMeans
 
 N_FFT = 1024 # number of samples for every STFT frame
+LEN_HEADER = 28
 
-def compress(infile, compression_factor=4):
+def compress(infile, compression_factor=4, backend=ARITHMETIC_BACKEND, estimate_only=False):
     # Read file
     fname = infile.split("/")[-1].split(".")[0]
     _, samplerate = sf.read(infile)
@@ -49,36 +51,37 @@ def compress(infile, compression_factor=4):
     vecbytes = res.cluster_centers_.flatten().round().astype(np.int8).tobytes()
     labelbytes = res.labels_.astype(np.int32).tobytes()
 
+    if estimate_only:
+        print_estimate(infile, LEN_HEADER, [vecbytes, labelbytes])
+        return
+
     # Entropic coding
     print("Starting entropic coding")
-    ae = ArithmeticBitCoder()
-    cvecs = ae.encode(vecbytes)
-    ae.__init__() # Reset arithmetic coder
-    clabels = ae.encode(labelbytes)
-    
-    # Pack into file
-    header = make_header(n_vecs, n_frequencies, len(cvecs), len(clabels), samplerate, 1 if n_channels == 2 else 0)
-    write_file(f"{fname}.vc", header + cvecs + clabels)
-    
-    print(f"Compression ratio: 1:{os.path.getsize(infile) / (len(header) + len(cvecs) + len(clabels))}")
+    with open(f"{fname}.vc", "wb") as file:
+        stereo = 1 if n_channels == 2 else 0
+        file.write(bytes(LEN_HEADER))  # placeholder, the sections are streamed behind it
+        len_vecs, len_labels = write_sections(file, [vecbytes, labelbytes], backend)
+        file.seek(0)
+        file.write(make_header(n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo, backend))
 
-def make_header(n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo):
+    print(f"Compression ratio: 1:{os.path.getsize(infile) / (LEN_HEADER + len_vecs + len_labels)}")
+
+def make_header(n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo, backend):
     # Header format
     # | n_vecs (4 bytes)  | n_frequencies (4 bytes) | # len_vecs (4 bytes) |
-    # | len_labels (4 bytes)  | samplerate (4 bytes) | stereo (4 bytes) |
-    # Total length: 24 bytes
-    return bytes(np.array([n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo], dtype=np.int32))
+    # | len_labels (4 bytes)  | samplerate (4 bytes) | stereo (4 bytes) | entropy backend (4 bytes) |
+    # Total length: 28 bytes
+    return bytes(np.array([n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo, backend], dtype=np.int32))
 
 def decompress(infile):
     fname = infile.split("/")[-1].split(".")[0]
     # Unpack binary file
-    len_header = 24
     offset = 0
     print("Unpacking compressed file")
     with open(infile, "rb") as file:
         fbytes = file.read()
         file.close()
-    n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo = read_header(fbytes[0:len_header])
+    n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo, backend, len_header = read_header(fbytes)
     if (len_header + len_vecs + len_labels) != len(fbytes):
         print(
             f"File {infile} has length {len(fbytes)}. Expected length from header: {len_header + len_vecs + len_labels}")
@@ -87,11 +90,9 @@ def decompress(infile):
 
     print("Starting entropic decoding")
     # Undo entropic coding
-    ae = ArithmeticBitCoder()
-    vecbytes = ae.decode(bytearray(fbytes[offset:offset + len_vecs]))
-    offset += len_vecs
-    ae.__init__()
-    labelbytes = ae.decode(bytearray(fbytes[offset:offset + len_labels]))
+    fview = memoryview(fbytes) # in-process, sections are decoded from views of the file bytes without copies
+    vecbytes, labelbytes = decode_sections([fview[offset:offset + len_vecs],
+                                            fview[offset + len_vecs:offset + len_vecs + len_labels]], backend)
     
     # Undo serialisation
     vectors = np.frombuffer(vecbytes, dtype=np.int8)
@@ -116,36 +117,39 @@ def decompress(infile):
         reconstructed_waveform = librosa.core.spectrum.griffinlim(spectrogram)
     sf.write(f"{fname}.wav", reconstructed_waveform.T, samplerate)
     
-def read_header(headerbytes):
-    n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo = np.frombuffer(headerbytes, dtype=np.int32)
-    return  n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo
-    
-def write_file(fname, bytes):
-    with open(fname, "wb") as file:
-        file.write(bytes)
-        file.close()
+def read_header(fbytes):
+    # Fields as in make_header, the section lengths are fields 2 and 3
+    (n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo, backend), len_header = \
+        read_fields(fbytes, 7, (2, 3))
+    return n_vecs, n_frequencies, len_vecs, len_labels, samplerate, stereo, backend, len_header
+
 
 if __name__ == "__main__":
-    if len(sys.argv) not in (3, 4):
+    backend = RANS_BACKEND if "--rans" in sys.argv else ARITHMETIC_BACKEND
+    estimate_only = "--estimate-only" in sys.argv
+    argv = [arg for arg in sys.argv if arg not in ("--rans", "--estimate-only")]
+    if len(argv) not in (3, 4):
         print("Unexpected number of arguments")
         print("Usage:")
-        print("Compression: python3 veco.py c F <input>.wav")
+        print("Compression: python3 veco.py c [--rans | --estimate-only] F <input>.wav")
         print("Decompression: python3 veco.py d <compressed>.vc")
         print("F is a compression factor 1...20")
-    mode = sys.argv[1]
+        print("--rans codes the sections with the faster rANS coder instead of the arithmetic coder")
+        print("--estimate-only prints the estimated compression ratio of the arithmetic coder without coding")
+    mode = argv[1]
 
     if mode not in ["c", "d"]:
         print("Invalid mode. Use 'c' for compression and 'd' for decompression")
     if mode == "c":
-        compression_factor = int(sys.argv[2])
+        compression_factor = int(argv[2])
         if (1 <= compression_factor <= 20):
-            infile = sys.argv[3]
+            infile = argv[3]
             if os.path.isfile(infile):
-                compress(infile, compression_factor)
+                compress(infile, compression_factor, backend, estimate_only)
             else:
                 print(f"Could not find {infile}")
         else:
             print("Invalid compression factor. Choose from 1 to 20")
     if mode == "d":
-        infile = sys.argv[2]
+        infile = argv[2]
         decompress(infile)
\ No newline at end of file
@@ -1,11 +1,18 @@
 from arithmetic_model import *
 
+WORD_BYTES = 8  # bytes taken from the input at once
+
 
 class ArithmeticBinaryDecoder:
 
     def __init__(self, model="MP3"):
         self.model = model
-        self.__freq, self.__cumfreq, self.__ch2idx, self.__idx2ch = get_model_params(model)
+        if model:
+            self.__freq, self.__cumfreq, self.__ch2idx, self.__idx2ch = get_model_params(model)
+            self.__symbol_table = STATIC_SYMBOL_TABLES[model]
+            self.__adaptive_model = None
+        else:
+            self.__adaptive_model = AdaptiveModel()
 
         self.__high = MAX_VALUE
         self.__low = 0
@@ -20,57 +27,130 @@ class ArithmeticBinaryDecoder:
         """
         if self.model: # No updates needed for static model
             return
-        if self.__cumfreq[0] == MAX_FREQ:
-            cum = 0
-            for i in range(N_SYMBOLS, -1, -1):
-                self.__freq[i] = (self.__freq[i] + 1) / 2
-                self.__cumfreq[i] = cum
-                cum += self.__freq[i]
-        self.__freq[0] = 0;
-
-        i = symbol_index
-        while self.__freq[i] == self.__freq[i - 1]: i -= 1
-        if i < symbol_index:
-            ch_i = self.__idx2ch[i]  # chars are one lower than indexes
-            ch_symbol = self.__idx2ch[symbol_index]
-            self.__idx2ch[i] = ch_symbol
-            self.__idx2ch[symbol_index] = ch_i
-            self.__ch2idx[ch_i] = symbol_index
-            self.__ch2idx[ch_symbol] = i
-        self.__freq[i] += 1
-        while i > 0:
-            i -= 1
-            self.__cumfreq[i] += 1
+        self.__adaptive_model.update(symbol_index)
 
 
     def decode(self, data: bytes):
-        self.__buffer = ReadBuffer(data)
-
+        view = memoryview(data).cast("B")
+        legacy = len(view) == 0 or view[-1] < 0x80
+        if not legacy:
+            if view[-1] != TERMINATED_STREAM:
+                raise ValueError(f"Unknown stream version {view[-1]:#x}")
+            view = view[:-1]
+        self.__buffer = ReadBuffer(view, legacy)
+        return self.__decode_data(legacy)
+
+    def __decode_data(self, legacy):
+        # Same as the loop over decode_symbol and update_tables, with the input read a word at a time. Symbols of
+        # static models are found by table lookup. Bits past the end of the input read as 0, which is what the
+        # termination in ArithmeticBinaryEncoder expects. The last symbols can only be decoded with some of them.
+        # In legacy streams they read as -1 and decoding stops as soon as the input runs out.
+        adaptive_model = self.__adaptive_model
+        if adaptive_model:
+            find = adaptive_model.find
+            update = adaptive_model.update
+            idx2ch = adaptive_model.idx2ch
+        else:
+            cumfreq = self.__cumfreq
+            total = cumfreq[0]
+            symbol_table = self.__symbol_table
+            idx2ch = self.__idx2ch
+        read_word = self.__buffer.read_word
+        low = self.__low
+        high = self.__high
+        value = self.__value
+        bits = 0
+        n_bits = 0
+        past_end = 0  # bits read past the end of the input
+        fill = -1 if legacy else 0
         decoded = bytearray()
 
-        for i in range(1, CODE_VALUE + 1):
-            self.__value = 2 * self.__value + self.__buffer.read_bit()
-
+        for i in range(CODE_VALUE):
+            if n_bits == 0:
+                bits, n_bits = read_word()
+            if n_bits:
+                value = 2 * value + (bits & 1)
+                bits >>= 1
+                n_bits -= 1
+            else:
+                past_end += 1
+                value = 2 * value + fill
 
         while True:
-            d = self.decode_symbol()
-            if d == EOF or self.__buffer.end_encoding:
+            width = high - low
+            if adaptive_model:
+                total = adaptive_model.total
+                cum = (((value - low) + 1) * total - 1) // width
+                symbol_index, cum_high, cum_low = find(cum)
+            else:
+                cum = (((value - low) + 1) * total - 1) // width
+                if 0 <= cum < total:
+                    symbol_index = symbol_table[cum]
+                else:
+                    symbol_index = 1
+                    while cumfreq[symbol_index] > cum:
+                        symbol_index += 1
+                cum_high = cumfreq[symbol_index - 1]
+                cum_low = cumfreq[symbol_index]
+
+            high = low + (width * cum_high) // total
+            low = low + (width * cum_low) // total
+
+            while True:
+                if high < HALF:
+                    pass
+                elif low >= HALF:
+                    value -= HALF
+                    low -= HALF
+                    high -= HALF
+                elif low >= FIRST_QUARTER and high < THIRD_QUARTER:
+                    value -= FIRST_QUARTER
+                    low -= FIRST_QUARTER
+                    high -= FIRST_QUARTER
+                else:
+                    break
+                low *= 2
+                high *= 2
+                if n_bits == 0:
+                    bits, n_bits = read_word()
+                if n_bits:
+                    value = 2 * value + (bits & 1)
+                    bits >>= 1
+                    n_bits -= 1
+                else:
+                    past_end += 1
+                    value = 2 * value + fill
+
+            if symbol_index == EOF or legacy and past_end:
                 break
-            b = self.__idx2ch[d]
-            decoded.append(b)
-            self.update_tables(d)
+            decoded.append(idx2ch[symbol_index])
+            if adaptive_model:
+                update(symbol_index)
+            if past_end > CODE_VALUE:  # a complete stream ends before, stop on truncated input
+                break
+
+        self.__low = low
+        self.__high = high
+        self.__value = value
+        self.__buffer.end_encoding = past_end > 0
         return decoded
 
     def decode_symbol(self):
         range = self.__high - self.__low
-        cum = int((((self.__value - self.__low) + 1) * self.__cumfreq[0] - 1) // range)
-
-        symbol_index = 1
-        while self.__cumfreq[symbol_index] > cum:
-            symbol_index += 1
-
-        self.__high = int(self.__low + (range * self.__cumfreq[symbol_index - 1] / self.__cumfreq[0]))
-        self.__low = int(self.__low + (range * self.__cumfreq[symbol_index] / self.__cumfreq[0]))
+        if self.__adaptive_model:
+            total = self.__adaptive_model.total
+            cum = (((self.__value - self.__low) + 1) * total - 1) // range
+            symbol_index, cum_high, cum_low = self.__adaptive_model.find(cum)
+        else:
+            total = self.__cumfreq[0]
+            cum = (((self.__value - self.__low) + 1) * total - 1) // range
+            symbol_index = 1
+            while self.__cumfreq[symbol_index] > cum:
+                symbol_index += 1
+            cum_high, cum_low = self.__cumfreq[symbol_index - 1], self.__cumfreq[symbol_index]
+
+        self.__high = self.__low + (range * cum_high) // total
+        self.__low = self.__low + (range * cum_low) // total
 
         while True:
             if self.__high < HALF:
@@ -92,28 +172,36 @@ class ArithmeticBinaryDecoder:
 
 
 class ReadBuffer:
-    def __init__(self, data: bytes):
-        self.__byte = 0
-        self.__curr_byte_index = 0
+    def __init__(self, data: bytes, legacy=False):
+        self.__bits = 0  # bits of the current word not read yet, the next one in the LSB
         self.__bits_to_read = 0
-        self.__garbage_bits = 0
+        self.__curr_byte_index = 0
         self.__data = data
+        self.__fill = -1 if legacy else 0  # bit read past the end of the data
         self.end_encoding = False
 
     def read_bit(self):
         if self.__bits_to_read == 0:
-            if self.__curr_byte_index == len(self.__data):
+            self.__bits, self.__bits_to_read = self.read_word()
+            if self.__bits_to_read == 0:
                 self.end_encoding = True
-                return -1
-            self.__byte = self.__data[self.__curr_byte_index]
-            self.__bits_to_read = 8
-            self.__curr_byte_index += 1
+                return self.__fill
 
-        bit = self.__byte & 0x1 # get last bit
-        self.__byte >>= 1
+        bit = self.__bits & 0x1 # get last bit
+        self.__bits >>= 1
         self.__bits_to_read -= 1
         return bit
 
+    def read_word(self):
+        """
+        Take the next WORD_BYTES bytes (fewer at the end of the data) as one integer. Within a byte the least
+        significant bit is read first.
+        :return: Bits with the next one in the LSB, number of bits (0 at the end of the data)
+        """
+        word = self.__data[self.__curr_byte_index:self.__curr_byte_index + WORD_BYTES]
+        self.__curr_byte_index += len(word)
+        return int.from_bytes(word, "little"), len(word) << 3
+
 if __name__ == "__main__":
     data = bytearray(b'I\xe0\x9d\xdcL\xe3\x95\x7f\xad\x9b\x8b\x10\xcep\xe3\x93e\xe5\x15\x00')
     ad = ArithmeticBinaryDecoder(None)
@@ -1,12 +1,17 @@
 from arithmetic_model import *
 
+FLUSH_BITS = 64  # pending bits moved to the output at once
 
 
 class ArithmeticBinaryEncoder:
     def __init__(self, model="MP3"):
         self.model = model
 
-        self.__freq, self.__cumfreq, self.__ch2idx, self.__idx2ch = get_model_params(model)
+        if model:
+            self.__freq, self.__cumfreq, self.__ch2idx, self.__idx2ch = get_model_params(model)
+            self.__adaptive_model = None
+        else:
+            self.__adaptive_model = AdaptiveModel()
         self.__high = MAX_VALUE
         self.__low = 0
         self.__opposite_bits = 0
@@ -19,43 +24,70 @@ class ArithmeticBinaryEncoder:
         """
         if self.model: # No updates needed for static model
             return
-        if self.__cumfreq[0] == MAX_FREQ:
-            cum = 0
-            for i in range(N_SYMBOLS, -1, -1):
-                self.__freq[i] = (self.__freq[i] + 1) / 2
-                self.__cumfreq[i] = cum
-                cum += self.__freq[i]
-        self.__freq[0] = 0;
-
-        i = symbol_index
-        while self.__freq[i] == self.__freq[i - 1]: i -= 1
-        if i < symbol_index:
-            ch_i = self.__idx2ch[i]  # chars are one lower than indexes
-            ch_symbol = self.__idx2ch[symbol_index]
-            self.__idx2ch[i] = ch_symbol
-            self.__idx2ch[symbol_index] = ch_i
-            self.__ch2idx[ch_i] = symbol_index
-            self.__ch2idx[ch_symbol] = i
-        self.__freq[i] += 1
-        while i > 0:
-            i -= 1
-            self.__cumfreq[i] += 1
+        self.__adaptive_model.update(symbol_index)
 
     def encode(self, data: bytes):
         self.__init__(self.model) # clean old stuff
-        for b in data:
-            sym = self.__ch2idx[b]
-            self.encode_symbol(sym)
-            self.update_tables(sym)
+        self.__encode_data(data)
         self.encode_symbol(EOF)
         self.terminate_encoding()
-        return self.__buffer.get_data()
-
+        return self.__buffer.get_data() + bytes((TERMINATED_STREAM,))
+
+    def __encode_data(self, data: bytes):
+        # Same as calling encode_symbol and update_tables for every byte, with the coder state held in locals
+        adaptive_model = self.__adaptive_model
+        if adaptive_model:
+            ch2idx = adaptive_model.ch2idx
+            interval = adaptive_model.interval
+            update = adaptive_model.update
+        else:
+            cumfreq = self.__cumfreq
+            total = cumfreq[0]
+            ch2idx = self.__ch2idx
+        write_bits = self.__buffer.write_bits
+        low = self.__low
+        high = self.__high
+        opposite_bits = self.__opposite_bits
+        for b in data:
+            sym = ch2idx[b]
+            if adaptive_model:
+                cum_high, cum_low, total = interval(sym)
+                update(sym)
+            else:
+                cum_high = cumfreq[sym - 1]
+                cum_low = cumfreq[sym]
+            width = high - low
+            high = low + (width * cum_high) // total
+            low = low + (width * cum_low) // total
+            while True:
+                if high < HALF:
+                    write_bits(((1 << opposite_bits) - 1) << 1, opposite_bits + 1)  # 0, then the opposite bits
+                    opposite_bits = 0
+                elif low >= HALF:
+                    write_bits(1, opposite_bits + 1)
+                    opposite_bits = 0
+                    low -= HALF
+                    high -= HALF
+                elif low >= FIRST_QUARTER and high < THIRD_QUARTER:
+                    opposite_bits += 1
+                    low -= FIRST_QUARTER
+                    high -= FIRST_QUARTER
+                else:
+                    break
+                low *= 2
+                high *= 2
+        self.__low = low
+        self.__high = high
+        self.__opposite_bits = opposite_bits
 
     def encode_symbol(self, symbol: int):
+        if self.__adaptive_model:
+            cum_high, cum_low, total = self.__adaptive_model.interval(symbol)
+        else:
+            cum_high, cum_low, total = self.__cumfreq[symbol - 1], self.__cumfreq[symbol], self.__cumfreq[0]
         range = self.__high - self.__low
-        self.__high = int(self.__low + (range * self.__cumfreq[symbol - 1]) // self.__cumfreq[0]) # divide by normalisation value
-        self.__low = int(self.__low + (range * self.__cumfreq[symbol]) // self.__cumfreq[0])
+        self.__high = int(self.__low + (range * cum_high) // total) # divide by normalisation value
+        self.__low = int(self.__low + (range * cum_low) // total)
         while True:
             if self.__high < HALF:
                 self.write_bit(0)
@@ -73,42 +105,62 @@ class ArithmeticBinaryEncoder:
             self.__high *= 2
 
     def write_bit(self, bit: int):
-        self.__buffer.write_bit(bit)
-        while self.__opposite_bits > 0:
-            self.__buffer.write_bit(abs(1 - bit))
-            self.__opposite_bits -= 1
+        # Write the bit followed by the pending opposite bits
+        if bit == 1:
+            self.__buffer.write_bits(1, self.__opposite_bits + 1)
+        else:
+            self.__buffer.write_bits(((1 << self.__opposite_bits) - 1) << 1, self.__opposite_bits + 1)
+        self.__opposite_bits = 0
 
     def terminate_encoding(self):
+        # Two more bits select a quarter inside the final interval, the pending opposite bits have to follow the first
         self.__opposite_bits += 1
         if self.__low < FIRST_QUARTER:
-            self.__buffer.write_bit(0)
+            self.write_bit(0)
         else:
-            self.__buffer.write_bit(1)
+            self.write_bit(1)
         self.__buffer.flush_remaining()
 
 
 class WriteBuffer:
+    """
+    Collects bits in an integer, the first bit in the LSB, and moves whole bytes to the output. Within a byte the
+    first bit written is the least significant one.
+    """
+
     def __init__(self):
-        self.__byte = 0
-        self.__bits_to_write = 8
+        self.__bits = 0
+        self.__n_bits = 0
         self.__data = bytearray()
 
     def write_bit(self, bit: int):
-        self.__byte >>= 1
-        if bit == 1:
-            self.__byte |= 0x80 # write MSB of byte
-        self.__bits_to_write -= 1
-        if self.__bits_to_write == 0:
-            self.__data.append(self.__byte)
-            self.__bits_to_write = 8
-            self.__byte = 0
+        self.write_bits(bit, 1)
+
+    def write_bits(self, bits: int, count: int):
+        """
+        Append count bits
+        :param bits: Bits to write, the first one in the LSB
+        :param count: Number of bits
+        """
+        self.__bits |= bits << self.__n_bits
+        self.__n_bits += count
+        if self.__n_bits >= FLUSH_BITS:
+            n_bytes = self.__n_bits >> 3
+            self.__data += (self.__bits & ((1 << (n_bytes << 3)) - 1)).to_bytes(n_bytes, "little")
+            self.__bits >>= n_bytes << 3
+            self.__n_bits &= 7
 
     def flush_remaining(self):
-        self.__byte >>= self.__bits_to_write
-        self.__data.append(self.__byte)
+        # Write all pending bits, the last byte padded with zeros (a whole zero byte if there are no pending bits)
+        n_bytes = (self.__n_bits >> 3) + 1
+        self.__data += self.__bits.to_bytes(n_bytes, "little")
+        self.__bits = 0
+        self.__n_bits = 0
 
     def get_data(self):
         return self.__data.copy()
+
+
 def test_text_encoding():
     data = b"nevergonnagiveyouup"
     ae = ArithmeticBinaryEncoder(model=None)
@@ -1,5 +1,69 @@
 import numpy as np
-from MP3Predictor import MP3Predictor
+from MP3Predictor import MP3Predictor, N_CONTEXTS, PROB_BITS, MAX_COUNT
+from jit import JIT, njit
+from util import byte_reader
+
+GRANULE_BYTES = 2 * 576  # one granule of one channel as int16 samples
+LOOKAHEAD_RETRIES = 32  # stream ends tried around the first guess when the lookahead changed the result
+
+# 3PM file versions. Legacy files start directly with the first MP3 frame header (0xFF) and their granule streams code
+# a continuation flag before every byte and an end flag. Newer files start with FILE_MAGIC and a version byte, and
+# every granule stream is prefixed with its length (uint16) and codes exactly 8 decisions per byte. From RUN_VERSION
+# on, the rest of a run of RUN_THRESHOLD identical bytes is coded as its length. From SAMPLE_VERSION on, granules are
+# coded sample by sample (see encode_samples) instead of byte by byte. From LEVEL_VERSION on, the version byte is
+# followed by the compression level, which selects how the granule streams are coded.
+FILE_MAGIC = b"3PM"
+LEGACY_VERSION = 0
+COUNTED_VERSION = 1
+RUN_VERSION = 2
+SAMPLE_VERSION = 3
+LEVEL_VERSION = 4
+LEN_STREAM_LENGTH = 2
+
+# Compression levels, from fastest to smallest. Only the adaptive level carries state from frame to frame.
+LEVEL_STORE = 0  # int16 samples as they are
+LEVEL_HUFFMAN = 1  # static canonical Huffman code, see HuffmanSampleCoder
+LEVEL_ADAPTIVE = 2  # SAMPLE_VERSION streams, arithmetic coded with the MP3Predictor
+DEFAULT_LEVEL = LEVEL_ADAPTIVE
+
+# Run lengths are Elias-gamma coded with one context per bit position in the contexts the bytes leave unused
+RUN_THRESHOLD = 16  # granules mostly end in one long run of zeros, shorter runs code better byte by byte
+RUN_PREFIX_CONTEXTS = 256  # unary part
+RUN_BIT_CONTEXTS = 288  # remaining bits
+
+# (bit, context) of the eight decisions per byte, MSB first. The context is the bit prefix with a leading 1.
+BYTE_STEPS = [tuple(((b >> (7 - k)) & 1, (1 << k) | (b >> (8 - k))) for k in range(8)) for b in range(256)]
+
+# Contexts of the sample binarization: a zero flag, the sign, and the magnitude as Exp-Golomb code (one 1 per bit
+# above the leading one, a terminating 0, then the bits below the leading one). The zero flag and the unary part
+# depend on the magnitude of the previous sample (0, 1 or more).
+SAMPLE_ZERO_CONTEXTS = 1
+SAMPLE_SIGN_CONTEXT = 4
+SAMPLE_PREFIX_CONTEXTS = 16  # 16 per magnitude class of the previous sample
+SAMPLE_BIT_CONTEXTS = 64
+MAX_MAGNITUDE_BITS = 16  # |-32768| has 16 bits
+SAMPLE_CLASSES = 3
+N_STEP_VALUES = 256  # decisions of the magnitudes below this are precomputed
+MAX_BYTES_PER_DECISION = 4  # a decision with probability 0 moves all four bytes of the range out
+
+
+def magnitude_steps(value, cls):
+    """
+    Sign and Exp-Golomb magnitude decisions of a non-zero sample
+    :param value: Sample value
+    :param cls: Magnitude class of the previous sample
+    :return: Tuple of (bit, context)
+    """
+    magnitude = abs(value)
+    n_bits = magnitude.bit_length() - 1
+    prefix = SAMPLE_PREFIX_CONTEXTS + 16 * cls
+    return ((int(value < 0), SAMPLE_SIGN_CONTEXT),) + tuple((1, prefix + k) for k in range(n_bits)) + \
+        ((0, prefix + n_bits),) + tuple(((magnitude >> k) & 1, SAMPLE_BIT_CONTEXTS + k) for k in range(n_bits - 1, -1, -1))
+
+
+# Decisions of every sample value below N_STEP_VALUES in magnitude, indexed by [class][value + N_STEP_VALUES - 1]
+SAMPLE_STEPS = [[((1, SAMPLE_ZERO_CONTEXTS + cls),) if v == 0 else ((0, SAMPLE_ZERO_CONTEXTS + cls),) + magnitude_steps(v, cls)
+                 for v in range(-N_STEP_VALUES + 1, N_STEP_VALUES)] for cls in range(SAMPLE_CLASSES)]
 
 
 # Python translation of fpaq0 coder by M. Mahoney (http://mattmahoney.net/dc/fpaq0.cpp)
@@ -8,101 +72,874 @@ class ArithmeticBitCoder:
 
     def __init__(self):
         self.predictor = MP3Predictor(576)
-        self.x1 = np.int64(0)
-        self.x2 = np.int64(0xffffffff)
-        self.x = np.int64(0)
+        self.x1 = 0
+        self.x2 = 0xffffffff
+        self.x = 0
         self.compressed = bytearray()
         self.context = 1
+        self.reader = None
+        self.n_consumed = 0
 
-    def encode(self, data: bytes):
-        self.x1 = np.int64(0)
-        self.x2 = np.int64(0xffffffff)
-        self.x = np.int64(0)
-        self.compressed = bytearray()
-        self.context = 1
-        sample_idx = 0
-        twobytes = 0
-        for b in data:
-            self.encode_symbol(0, sample_idx)
-            self.context = 1
-            for i in range(7, -1, -1):
-                self.encode_symbol((b >> i) & 1, sample_idx)
-            twobytes += 1
-            if twobytes % 2 == 0:
-                sample_idx += 1
-                twobytes = 0
-        sample_idx = 0
-        self.encode_symbol(1, sample_idx)
+    def encode(self, data: bytes, legacy=False, runs=False):
+        """
+        Encode one stream. Streams share the predictor, so they have to be decoded in the order they were encoded.
+        :param data: Bytes to encode
+        :param legacy: Code a continuation flag before every byte and an end flag as in legacy 3PM files
+        :param runs: Code the rest of every run of RUN_THRESHOLD identical bytes as its length
+        :return: Compressed stream
+        """
+        if JIT and not legacy:
+            predictor = self.predictor
+            data = np.frombuffer(data, dtype=np.uint8)
+            out = np.empty(MAX_BYTES_PER_DECISION * (8 * len(data) + 63 * (len(data) // RUN_THRESHOLD + 1)),
+                           dtype=np.uint8)
+            self.x1, self.x2, n_out = _encode_bytes_kernel(data, runs, predictor.region_slots,
+                                                           predictor.last_region_slot, predictor.n0, predictor.n1,
+                                                           predictor.probs, out)
+            self.compressed = bytearray(out[:n_out].tobytes())
+            self.context = 256 + int(data[-1]) if len(data) else 1
+            self.flush()
+            return self.compressed
+
+        # Same decisions as calling encode_symbol for every bit, with the coder and predictor state held in locals
+        predictor = self.predictor
+        n0, n1, probs = predictor.n0, predictor.n1, predictor.probs
+        region_slots = predictor.region_slots
+        n_slots = len(region_slots)
+        x1 = 0
+        x2 = 0xffffffff
+        compressed = bytearray()
+        append = compressed.append
+        context = 1  # context of the continuation flag, left over from the previous byte
+
+        # Bytes from start to end are coded one by one, followed by the length of a run (if any)
+        segments = run_segments(data) if runs else [(0, len(data), None)]
+        for start, end, run in segments:
+            for i, b in enumerate(data[start:end], start):
+                sample_idx = i >> 1  # two bytes per int16 sample
+                base = region_slots[sample_idx] if sample_idx < n_slots else predictor.last_region_slot
+                for y, ctx in ((0, context),) + BYTE_STEPS[b] if legacy else BYTE_STEPS[b]:
+                    slot = base + ctx
+                    xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[slot]
+                    c0 = n0[slot]
+                    c1 = n1[slot]
+                    if y:
+                        x2 = xmid
+                        c1 += 1
+                        if c1 > MAX_COUNT:
+                            c0 >>= 1
+                            c1 >>= 1
+                            n0[slot] = c0
+                        n1[slot] = c1
+                    else:
+                        x1 = xmid + 1
+                        c0 += 1
+                        if c0 > MAX_COUNT:
+                            c0 >>= 1
+                            c1 >>= 1
+                            n1[slot] = c1
+                        n0[slot] = c0
+                    probs[slot] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+
+                    while not (x1 ^ x2) & 0xff000000:
+                        append(x2 >> 24)
+                        x1 = (x1 << 8) & 0xffffffff
+                        x2 = ((x2 << 8) & 0xffffffff) | 255
+                context = 256 + b
+            if run is not None:
+                x1, x2 = self.__encode_run_length(run, end >> 1, x1, x2, append)
+
+        self.x1 = x1
+        self.x2 = x2
+        self.compressed = compressed
+        self.context = context
+        if legacy:
+            self.encode_symbol(1, 0)
+        self.flush()
+        return self.compressed
+
+    def encode_samples(self, samples):
+        """
+        Encode one granule sample by sample. Most quantised MDCT values are 0 or +-1, which take 1 to 4 decisions
+        instead of 16 for the int16 bytes.
+        :param samples: Integer samples (np.int16 array)
+        :return: Compressed stream
+        """
+        predictor = self.predictor
+        if JIT:
+            out = np.empty(MAX_BYTES_PER_DECISION * (2 * MAX_MAGNITUDE_BITS + 2) * len(samples), dtype=np.uint8)
+            self.x1, self.x2, n_out = _encode_samples_kernel(samples, predictor.region_slots,
+                                                             predictor.last_region_slot, predictor.n0, predictor.n1,
+                                                             predictor.probs, out)
+            self.compressed = bytearray(out[:n_out].tobytes())
+            self.flush()
+            return self.compressed
+
+        n0, n1, probs = predictor.n0, predictor.n1, predictor.probs
+        region_slots = predictor.region_slots
+        n_slots = len(region_slots)
+        x1 = 0
+        x2 = 0xffffffff
+        compressed = bytearray()
+        append = compressed.append
+        cls = 0  # magnitude class of the previous sample
+
+        for i, v in enumerate(samples.tolist()):
+            base = region_slots[i] if i < n_slots else predictor.last_region_slot
+            if -N_STEP_VALUES < v < N_STEP_VALUES:
+                steps = SAMPLE_STEPS[cls][v + N_STEP_VALUES - 1]
+            else:
+                steps = ((0, SAMPLE_ZERO_CONTEXTS + cls),) + magnitude_steps(v, cls)
+            for y, ctx in steps:
+                slot = base + ctx
+                xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[slot]
+                c0 = n0[slot]
+                c1 = n1[slot]
+                if y:
+                    x2 = xmid
+                    c1 += 1
+                    if c1 > MAX_COUNT:
+                        c0 >>= 1
+                        c1 >>= 1
+                        n0[slot] = c0
+                    n1[slot] = c1
+                else:
+                    x1 = xmid + 1
+                    c0 += 1
+                    if c0 > MAX_COUNT:
+                        c0 >>= 1
+                        c1 >>= 1
+                        n1[slot] = c1
+                    n0[slot] = c0
+                probs[slot] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+
+                while not (x1 ^ x2) & 0xff000000:
+                    append(x2 >> 24)
+                    x1 = (x1 << 8) & 0xffffffff
+                    x2 = ((x2 << 8) & 0xffffffff) | 255
+            cls = min(abs(v), 2)
+
+        self.x1 = x1
+        self.x2 = x2
+        self.compressed = compressed
         self.flush()
         return self.compressed
 
+    def __encode_run_length(self, run, sample_idx, x1, x2, append):
+        # Elias-gamma code of run + 1 in the region of the first sample after the coded bytes
+        value = run + 1
+        n_bits = value.bit_length()
+        steps = [(int(i == n_bits - 1), RUN_PREFIX_CONTEXTS + i) for i in range(n_bits)]
+        steps += [((value >> k) & 1, RUN_BIT_CONTEXTS + k) for k in range(n_bits - 2, -1, -1)]
+        for y, ctx in steps:
+            slot = self.predictor.slot(sample_idx, ctx)
+            xmid = x1 + ((x2 - x1) >> PROB_BITS) * self.predictor.probs[slot]
+            if y:
+                x2 = xmid
+            else:
+                x1 = xmid + 1
+            self.predictor.update_slot(y, slot)
+            while not (x1 ^ x2) & 0xff000000:
+                append(x2 >> 24)
+                x1 = (x1 << 8) & 0xffffffff
+                x2 = ((x2 << 8) & 0xffffffff) | 255
+        return x1, x2
+
     def encode_symbol(self, y: int, sample_idx=0):
-        xmid = np.int64(self.x1 + (
-                (self.x2 - self.x1) >> 12) * self.predictor.p(sample_idx, self.context))  # shift by twelve accounts for the 12-bit probability
-        assert (self.x1 <= xmid < self.x2)
-        # print(xmid)
+        # shift by twelve accounts for the 12-bit probability
+        xmid = self.x1 + ((self.x2 - self.x1) >> PROB_BITS) * self.predictor.p_and_update(y, sample_idx, self.context)
         if y != 0:
             self.x2 = xmid
         else:
             self.x1 = xmid + 1
 
-        self.predictor.update(y, sample_idx, self.context)
         self.context += self.context + y
         if self.context >= 512:
             self.context = 1
 
         while ((self.x1 ^ self.x2) & 0xff000000) == 0:
-            # print(f"Shifting with x1 {self.x1} and x2 {self.x2}")
-            self.compressed.append((self.x2 >> 24).tobytes()[0])
-            self.x1 <<= 8
-            self.x2 = (self.x2 << 8) + 255
+            self.compressed.append(self.x2 >> 24)
+            self.x1 = (self.x1 << 8) & 0xffffffff
+            self.x2 = ((self.x2 << 8) & 0xffffffff) | 255
 
-    def decode(self, compressed: bytearray):
-        self.compressed = compressed
-        decompressed = bytearray()
-        for i in range(4):  # initialise first four bytes of x with compressed file
-            if len(compressed) == 0:
-                b = 0
+    def decode(self, compressed, n_bytes=GRANULE_BYTES, limit=None, legacy=False, runs=False):
+        """
+        Decode one stream written by encode. The decoder has to know the number of bytes in advance (1152 for a
+        granule of int16 samples), in legacy streams the end flag is coded in region 0 rather than in the region of
+        the next sample.
+        :param compressed: Buffer that starts with the stream and may continue with other data
+        :param n_bytes: Number of bytes to decode
+        :param limit: Length of the stream if known, bytes past it are read as zero. Streams without continuation
+        flags need it whenever other data follows, since the last decisions look ahead past the end of the stream.
+        :param legacy: Decode a stream with continuation flags, see decode_candidates
+        :param runs: Decode a stream with run lengths, see encode
+        :return: Decoded bytes, the stream length is left in self.n_consumed
+        """
+        if legacy:
+            for decompressed in self.decode_candidates(compressed, n_bytes, limit):
+                return decompressed
+            raise ValueError("Corrupt 3PM stream")
+        buffer = memoryview(compressed).cast("B")
+        size = len(buffer) if limit is None else min(limit, len(buffer))
+        if JIT:
+            predictor = self.predictor
+            out = np.empty(n_bytes, dtype=np.uint8)
+            self.x1, self.x2, self.x, pos, status = _decode_bytes_kernel(
+                np.frombuffer(buffer[:size], dtype=np.uint8), runs, predictor.region_slots,
+                predictor.last_region_slot, predictor.n0, predictor.n1, predictor.probs, out)
+            if status == KERNEL_CORRUPT_RUN:
+                raise ValueError("Corrupt 3PM stream, run length out of range")
+            if status == KERNEL_RUN_PAST_END:
+                raise ValueError("Corrupt 3PM stream, run past the end of the granule")
+            self.context = 1
+            self.n_consumed = pos - 3
+            decompressed = bytearray(out.tobytes())
+        else:
+            decompressed = self.__decode_stream(buffer, size, n_bytes, False, runs)
+        if limit is not None and self.n_consumed != limit:
+            raise ValueError("Corrupt 3PM stream")
+        return decompressed
+
+    def decode_samples(self, compressed, n_samples=GRANULE_BYTES // 2, limit=None):
+        """
+        Decode one granule written by encode_samples
+        :param compressed: Buffer that starts with the stream and may continue with other data
+        :param n_samples: Number of samples to decode
+        :param limit: Length of the stream, needed whenever other data follows
+        :return: np.int16 array of samples, the stream length is left in self.n_consumed
+        """
+        buffer = memoryview(compressed).cast("B")
+        size = len(buffer) if limit is None else min(limit, len(buffer))
+        predictor = self.predictor
+        if JIT:
+            samples = np.empty(n_samples, dtype=np.int16)
+            self.x1, self.x2, self.x, pos, status = _decode_samples_kernel(
+                np.frombuffer(buffer[:size], dtype=np.uint8), predictor.region_slots, predictor.last_region_slot,
+                predictor.n0, predictor.n1, predictor.probs, samples)
+            if status == KERNEL_CORRUPT_SAMPLE:
+                raise ValueError("Corrupt 3PM stream, sample out of range")
+            self.n_consumed = pos - 3
+            if limit is not None and self.n_consumed != limit:
+                raise ValueError("Corrupt 3PM stream")
+            return samples
+
+        n0, n1, probs = predictor.n0, predictor.n1, predictor.probs
+        region_slots = predictor.region_slots
+        n_slots = len(region_slots)
+        x1 = 0
+        x2 = 0xffffffff
+        x = 0
+        for pos in range(4):  # initialise first four bytes of x with compressed file
+            x = (x << 8) | (buffer[pos] if pos < size else 0)
+        pos = 4
+        samples = [0] * n_samples
+        cls = 0
+
+        for i in range(n_samples):
+            base = region_slots[i] if i < n_slots else predictor.last_region_slot
+            slot = base + SAMPLE_ZERO_CONTEXTS + cls
+            # Decisions of one sample: zero flag, sign, unary part of the magnitude (k counts the 1s), lower bits
+            phase = 0
+            k = 0
+            while True:
+                xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[slot]
+                c0 = n0[slot]
+                c1 = n1[slot]
+                if x <= xmid:
+                    y = 1
+                    x2 = xmid
+                    c1 += 1
+                    if c1 > MAX_COUNT:
+                        c0 >>= 1
+                        c1 >>= 1
+                        n0[slot] = c0
+                    n1[slot] = c1
+                else:
+                    y = 0
+                    x1 = xmid + 1
+                    c0 += 1
+                    if c0 > MAX_COUNT:
+                        c0 >>= 1
+                        c1 >>= 1
+                        n1[slot] = c1
+                    n0[slot] = c0
+                probs[slot] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+
+                while not (x1 ^ x2) & 0xff000000:
+                    x1 = (x1 << 8) & 0xffffffff
+                    x2 = ((x2 << 8) & 0xffffffff) | 255
+                    x = ((x << 8) & 0xffffffff) | (buffer[pos] if pos < size else 0)
+                    pos += 1
+
+                if phase == 0:  # zero flag
+                    if y:
+                        break
+                    phase = 1
+                    slot = base + SAMPLE_SIGN_CONTEXT
+                elif phase == 1:  # sign
+                    negative = y
+                    phase = 2
+                    slot = base + SAMPLE_PREFIX_CONTEXTS + 16 * cls
+                elif phase == 2:  # unary part
+                    if y:
+                        k += 1
+                        if k >= MAX_MAGNITUDE_BITS:
+                            raise ValueError("Corrupt 3PM stream, sample out of range")
+                        slot += 1
+                    else:
+                        magnitude = 1
+                        if not k:
+                            break
+                        phase = 3
+                        k -= 1
+                        slot = base + SAMPLE_BIT_CONTEXTS + k
+                else:  # bits below the leading one
+                    magnitude += magnitude + y
+                    if not k:
+                        break
+                    k -= 1
+                    slot -= 1
+            if phase:
+                v = -magnitude if negative else magnitude
+                samples[i] = v
+                cls = min(magnitude, 2)
             else:
-                b = compressed.pop(0)
-            self.x = (self.x << 8) + (b & 0xff)
+                cls = 0
+
+        self.x1 = x1
+        self.x2 = x2
+        self.x = x
+        self.n_consumed = pos - 3
+        if limit is not None and self.n_consumed != limit:
+            raise ValueError("Corrupt 3PM stream")
+        return np.array(samples, dtype=np.int16)
+
+    def decode_candidates(self, compressed, n_bytes=GRANULE_BYTES, limit=None):
+        """
+        Legacy streams carry no length and are not padded, so near its end the decoder looks ahead into whatever follows
+        the stream, and a stream may also be consistent with more than one end. Yields every decoding that ends
+        where the encoder would have ended it, most likely first. The predictor is reset to its initial state
+        before each attempt, so after a yield it holds the state for that candidate.
+        :param compressed: Buffer that starts with the stream and may continue with other data
+        :param n_bytes: Number of bytes to decode
+        :param limit: Length of the stream if known, then there is a single candidate
+        :return: Generator of decoded bytes, the stream length is left in self.n_consumed
+        """
+        buffer = memoryview(compressed).cast("B")
+        size = len(buffer) if limit is None else min(limit, len(buffer))
+        state = self.predictor.copy_state()
+        decompressed = self.__decode_stream(buffer, size, n_bytes, True)
+        if decompressed is not None and (limit is None or self.n_consumed == limit):
+            yield decompressed
+        if limit is None:
+            # Decode again with zero padding at the possible ends. Reading past the stream usually makes the end
+            # more expensive, so shorter streams are tried first.
+            guess = self.n_consumed
+            limits = list(range(guess, max(guess - LOOKAHEAD_RETRIES, 0), -1))
+            for limit in limits + list(range(guess + 1, guess + LOOKAHEAD_RETRIES // 4)):
+                self.predictor.restore_state(state)
+                decompressed = self.__decode_stream(buffer, min(limit, size), n_bytes, True)
+                if decompressed is not None and self.n_consumed == limit:
+                    yield decompressed
+        self.predictor.restore_state(state)
 
-        while self.decode_symbol() == 0:
+    def __decode_stream(self, buffer, size, n_bytes, legacy, runs=False):
+        # Mirror of encode. Returns None if a legacy stream does not end where the encoder would have ended it.
+        predictor = self.predictor
+        n0, n1, probs = predictor.n0, predictor.n1, predictor.probs
+        region_slots = predictor.region_slots
+        n_slots = len(region_slots)
+        x1 = 0
+        x2 = 0xffffffff
+        x = 0
+        for pos in range(4):  # initialise first four bytes of x with compressed file
+            x = (x << 8) | (buffer[pos] if pos < size else 0)
+        pos = 4
+        decompressed = bytearray(n_bytes)
+        context = 1
+        valid = True
+        first_step = 0 if legacy else 1  # step 0 is the continuation flag
+        repeats = 0  # number of times the last byte was repeated, for streams with run lengths
+
+        i = 0
+        while i < n_bytes:
+            sample_idx = i >> 1
+            base = region_slots[sample_idx] if sample_idx < n_slots else predictor.last_region_slot
+            slot = base + (context if legacy else 1)
             b = 1
-            while b < 256:
-                b += b + self.decode_symbol()
-            decompressed.append(b - 256)
-        return decompressed
+            for k in range(first_step, 9):  # continuation flag, then the bits MSB first
+                xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[slot]
+                c0 = n0[slot]
+                c1 = n1[slot]
+                if x <= xmid:
+                    y = 1
+                    x2 = xmid
+                    c1 += 1
+                    if c1 > MAX_COUNT:
+                        c0 >>= 1
+                        c1 >>= 1
+                        n0[slot] = c0
+                    n1[slot] = c1
+                else:
+                    y = 0
+                    x1 = xmid + 1
+                    c0 += 1
+                    if c0 > MAX_COUNT:
+                        c0 >>= 1
+                        c1 >>= 1
+                        n1[slot] = c1
+                    n0[slot] = c0
+                probs[slot] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+
+                while not (x1 ^ x2) & 0xff000000:
+                    x1 = (x1 << 8) & 0xffffffff
+                    x2 = ((x2 << 8) & 0xffffffff) | 255
+                    x = ((x << 8) & 0xffffffff) | (buffer[pos] if pos < size else 0)
+                    pos += 1
+                if k:
+                    b += b + y
+                elif y:
+                    valid = False  # end flag before n_bytes
+                slot = base + b
+            decompressed[i] = b - 256
+            i += 1
+            if runs:
+                repeats = repeats + 1 if b == context else 1
+                if repeats == RUN_THRESHOLD:
+                    run, x1, x2, x, pos = self.__decode_run_length(i >> 1, x1, x2, x, buffer, pos, size)
+                    if i + run > n_bytes:
+                        raise ValueError("Corrupt 3PM stream, run past the end of the granule")
+                    decompressed[i:i + run] = bytes((b - 256,)) * run
+                    i += run
+                    repeats = 0
+            context = b
+
+        if not legacy:
+            # Only the flushed top byte of x2 follows the last decision
+            self.x1 = x1
+            self.x2 = x2
+            self.x = x
+            self.context = 1
+            self.n_consumed = pos - 3
+            return decompressed
 
-    def decode_symbol(self):
-        xmid = np.int64(self.x1 + (
-                (self.x2 - self.x1) >> 12) * self.predictor.p())
-        assert self.x1 <= xmid < self.x2
+        # The end flag is known to be 1, so x is not compared against xmid (its low bytes may already belong to
+        # whatever follows the stream). Instead every byte the encoder writes from here on, including the flushed
+        # top byte of x2, has to match the stream.
+        slot = region_slots[0] + context
+        x2 = x1 + ((x2 - x1) >> PROB_BITS) * probs[slot]
+        predictor.update_slot(1, slot)
+        while not (x1 ^ x2) & 0xff000000:
+            valid = valid and x >> 24 == x2 >> 24
+            x1 = (x1 << 8) & 0xffffffff
+            x2 = ((x2 << 8) & 0xffffffff) | 255
+            x = ((x << 8) & 0xffffffff) | (buffer[pos] if pos < size else 0)
+            pos += 1
+        valid = valid and x >> 24 == x2 >> 24
+
+        self.x1 = x1
+        self.x2 = x2
+        self.x = x
+        self.context = context
+        self.n_consumed = pos - 3
+        return decompressed if valid else None
+
+    def __decode_run_length(self, sample_idx, x1, x2, x, buffer, pos, size):
+        # Mirror of __encode_run_length, takes and returns the coder state of __decode_stream
+        n_bits = 1
+        value = 1
+        k = None  # bit position of the next remaining bit, None while in the unary part
+        while k is None or k >= 0:
+            slot = self.predictor.slot(sample_idx, RUN_PREFIX_CONTEXTS + n_bits - 1 if k is None else RUN_BIT_CONTEXTS + k)
+            xmid = x1 + ((x2 - x1) >> PROB_BITS) * self.predictor.probs[slot]
+            y = int(x <= xmid)
+            if y:
+                x2 = xmid
+            else:
+                x1 = xmid + 1
+            self.predictor.update_slot(y, slot)
+            while not (x1 ^ x2) & 0xff000000:
+                x1 = (x1 << 8) & 0xffffffff
+                x2 = ((x2 << 8) & 0xffffffff) | 255
+                x = ((x << 8) & 0xffffffff) | (buffer[pos] if pos < size else 0)
+                pos += 1
+            if k is not None:
+                value += value + y
+                k -= 1
+            elif y:
+                k = n_bits - 2
+            elif n_bits == 32:
+                raise ValueError("Corrupt 3PM stream, run length out of range")
+            else:
+                n_bits += 1
+        return value - 1, x1, x2, x, pos
+
+    def decode_symbol(self, sample_idx=0):
+        # Single decision, reading from self.reader. Call init_decoder first.
+        xmid = self.x1 + ((self.x2 - self.x1) >> PROB_BITS) * self.predictor.p(sample_idx, self.context)
         y = 0
         if self.x <= xmid:
             y = 1
             self.x2 = xmid
         else:
             self.x1 = xmid + 1
-        self.predictor.update(y)
+        self.predictor.update(y, sample_idx, self.context)
+
+        self.context += self.context + y
+        if self.context >= 512:
+            self.context = 1
 
         while ((self.x1 ^ self.x2) & 0xff000000) == 0:
-            self.x1 <<= 8
-            self.x2 = (self.x2 << 8) + 255
-            if len(self.compressed) == 0:
-                c = 0
-            else:
-                c = self.compressed.pop(0)
-            self.x = (self.x << 8) + c
+            self.x1 = (self.x1 << 8) & 0xffffffff
+            self.x2 = ((self.x2 << 8) & 0xffffffff) | 255
+            self.x = ((self.x << 8) & 0xffffffff) | next(self.reader, 0)
 
         return y
 
+    def init_decoder(self, compressed):
+        self.reader = byte_reader(compressed)
+        self.x1 = 0
+        self.x2 = 0xffffffff
+        self.x = 0
+        for i in range(4):
+            self.x = (self.x << 8) | next(self.reader, 0)
+
     def flush(self):
         while ((self.x1 ^ self.x2) & 0xff000000) == 0:
-            self.compressed.append((self.x2 >> 24).tobytes()[0])
-            self.x1 <<= 8
-            self.x2 = (self.x2 << 8) + 255
-        self.compressed.append((self.x2 >> 24).tobytes()[0])
+            self.compressed.append(self.x2 >> 24)
+            self.x1 = (self.x1 << 8) & 0xffffffff
+            self.x2 = ((self.x2 << 8) & 0xffffffff) | 255
+        self.compressed.append(self.x2 >> 24)
+
+
+def run_segments(data):
+    """
+    Split data for run-length coding
+    :param data: Bytes to encode
+    :return: List of (start, end, run): the bytes from start to end are coded one by one, followed by the length of
+    the run of the last of them (None after the last segment)
+    """
+    symbols = np.frombuffer(data, dtype=np.uint8)
+    if not len(symbols):
+        return [(0, 0, None)]
+    starts = np.concatenate(([0], np.flatnonzero(symbols[1:] != symbols[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(symbols)))
+    long = lengths >= RUN_THRESHOLD
+    segments = []
+    pos = 0
+    for start, length in zip(starts[long].tolist(), lengths[long].tolist()):
+        segments.append((pos, start + RUN_THRESHOLD, length - RUN_THRESHOLD))
+        pos = start + length
+    segments.append((pos, len(symbols), None))
+    return segments
+
+
+# Status of the decoder kernels
+KERNEL_OK = 0
+KERNEL_CORRUPT_RUN = 1
+KERNEL_RUN_PAST_END = 2
+KERNEL_CORRUPT_SAMPLE = 3
+
+
+@njit(cache=True)
+def _encode_bit(y, slot, x1, x2, n0, n1, probs, out, n_out):
+    # One decision including the predictor update, returns the new coder state
+    xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[slot]
+    c0 = n0[slot]
+    c1 = n1[slot]
+    if y:
+        x2 = xmid
+        c1 += 1
+    else:
+        x1 = xmid + 1
+        c0 += 1
+    if c0 > MAX_COUNT or c1 > MAX_COUNT:
+        c0 >>= 1
+        c1 >>= 1
+    n0[slot] = c0
+    n1[slot] = c1
+    probs[slot] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+    while not (x1 ^ x2) & 0xff000000:
+        out[n_out] = x2 >> 24
+        n_out += 1
+        x1 = (x1 << 8) & 0xffffffff
+        x2 = ((x2 << 8) & 0xffffffff) | 255
+    return x1, x2, n_out
+
+
+@njit(cache=True)
+def _decode_bit(slot, x1, x2, x, buffer, pos, n0, n1, probs):
+    # Mirror of _encode_bit, bytes past the end of the buffer are read as zeros
+    xmid = x1 + ((x2 - x1) >> PROB_BITS) * probs[slot]
+    c0 = n0[slot]
+    c1 = n1[slot]
+    if x <= xmid:
+        y = 1
+        x2 = xmid
+        c1 += 1
+    else:
+        y = 0
+        x1 = xmid + 1
+        c0 += 1
+    if c0 > MAX_COUNT or c1 > MAX_COUNT:
+        c0 >>= 1
+        c1 >>= 1
+    n0[slot] = c0
+    n1[slot] = c1
+    probs[slot] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
+    while not (x1 ^ x2) & 0xff000000:
+        x1 = (x1 << 8) & 0xffffffff
+        x2 = ((x2 << 8) & 0xffffffff) | 255
+        x = ((x << 8) & 0xffffffff) | (buffer[pos] if pos < len(buffer) else 0)
+        pos += 1
+    return y, x1, x2, x, pos
+
+
+@njit(cache=True)
+def _init_x(buffer):
+    x = 0
+    for pos in range(4):  # first four bytes of the stream
+        x = (x << 8) | (buffer[pos] if pos < len(buffer) else 0)
+    return x
+
+
+@njit(cache=True)
+def _encode_bytes_kernel(data, runs, region_slots, last_region_slot, n0, n1, probs, out):
+    # Kernel of ArithmeticBitCoder.encode without continuation flags, returns the coder state before the flush and
+    # the number of bytes written. Runs are found on the fly instead of by run_segments.
+    x1 = 0
+    x2 = 0xffffffff
+    n_out = 0
+    last = -1
+    repeats = 0
+    i = 0
+    while i < len(data):
+        sample_idx = i >> 1
+        base = region_slots[sample_idx] if sample_idx < len(region_slots) else last_region_slot
+        b = data[i]
+        ctx = 1
+        for k in range(7, -1, -1):
+            y = (b >> k) & 1
+            x1, x2, n_out = _encode_bit(y, base + ctx, x1, x2, n0, n1, probs, out, n_out)
+            ctx += ctx + y
+        i += 1
+        if runs:
+            repeats = repeats + 1 if b == last else 1
+            last = b
+            if repeats == RUN_THRESHOLD:
+                run = 0
+                while i + run < len(data) and data[i + run] == b:
+                    run += 1
+                # Elias-gamma code of run + 1 in the region of the first sample after the coded bytes
+                sample_idx = i >> 1
+                base = region_slots[sample_idx] if sample_idx < len(region_slots) else last_region_slot
+                value = run + 1
+                n_bits = 1
+                while value >> n_bits:
+                    n_bits += 1
+                for k in range(n_bits):
+                    x1, x2, n_out = _encode_bit(int(k == n_bits - 1), base + RUN_PREFIX_CONTEXTS + k, x1, x2, n0, n1,
+                                                probs, out, n_out)
+                for k in range(n_bits - 2, -1, -1):
+                    x1, x2, n_out = _encode_bit((value >> k) & 1, base + RUN_BIT_CONTEXTS + k, x1, x2, n0, n1, probs,
+                                                out, n_out)
+                i += run
+                repeats = 0
+    return x1, x2, n_out
+
+
+@njit(cache=True)
+def _decode_bytes_kernel(buffer, runs, region_slots, last_region_slot, n0, n1, probs, out):
+    # Kernel of ArithmeticBitCoder.__decode_stream without continuation flags, fills out and returns the coder state
+    # and the read position
+    x1 = 0
+    x2 = 0xffffffff
+    x = _init_x(buffer)
+    pos = 4
+    context = 1
+    repeats = 0
+    i = 0
+    while i < len(out):
+        sample_idx = i >> 1
+        base = region_slots[sample_idx] if sample_idx < len(region_slots) else last_region_slot
+        b = 1
+        for _ in range(8):
+            y, x1, x2, x, pos = _decode_bit(base + b, x1, x2, x, buffer, pos, n0, n1, probs)
+            b += b + y
+        out[i] = b - 256
+        i += 1
+        if runs:
+            repeats = repeats + 1 if b == context else 1
+            if repeats == RUN_THRESHOLD:
+                sample_idx = i >> 1
+                base = region_slots[sample_idx] if sample_idx < len(region_slots) else last_region_slot
+                n_bits = 1
+                while True:
+                    y, x1, x2, x, pos = _decode_bit(base + RUN_PREFIX_CONTEXTS + n_bits - 1, x1, x2, x, buffer, pos,
+                                                    n0, n1, probs)
+                    if y:
+                        break
+                    if n_bits == 32:
+                        return x1, x2, x, pos, KERNEL_CORRUPT_RUN
+                    n_bits += 1
+                value = 1
+                for k in range(n_bits - 2, -1, -1):
+                    y, x1, x2, x, pos = _decode_bit(base + RUN_BIT_CONTEXTS + k, x1, x2, x, buffer, pos, n0, n1, probs)
+                    value += value + y
+                run = value - 1
+                if i + run > len(out):
+                    return x1, x2, x, pos, KERNEL_RUN_PAST_END
+                out[i:i + run] = b - 256
+                i += run
+                repeats = 0
+        context = b
+    return x1, x2, x, pos, KERNEL_OK
+
+
+@njit(cache=True)
+def _encode_samples_kernel(samples, region_slots, last_region_slot, n0, n1, probs, out):
+    # Kernel of ArithmeticBitCoder.encode_samples, returns the coder state before the flush and the number of bytes
+    # written
+    x1 = 0
+    x2 = 0xffffffff
+    n_out = 0
+    cls = 0  # magnitude class of the previous sample
+    for i in range(len(samples)):
+        base = region_slots[i] if i < len(region_slots) else last_region_slot
+        v = np.int64(samples[i])
+        x1, x2, n_out = _encode_bit(int(v == 0), base + SAMPLE_ZERO_CONTEXTS + cls, x1, x2, n0, n1, probs, out, n_out)
+        if v:
+            magnitude = abs(v)
+            x1, x2, n_out = _encode_bit(int(v < 0), base + SAMPLE_SIGN_CONTEXT, x1, x2, n0, n1, probs, out, n_out)
+            n_bits = 0
+            while magnitude >> (n_bits + 1):
+                n_bits += 1
+            prefix = base + SAMPLE_PREFIX_CONTEXTS + 16 * cls
+            for k in range(n_bits):
+                x1, x2, n_out = _encode_bit(1, prefix + k, x1, x2, n0, n1, probs, out, n_out)
+            x1, x2, n_out = _encode_bit(0, prefix + n_bits, x1, x2, n0, n1, probs, out, n_out)
+            for k in range(n_bits - 1, -1, -1):
+                x1, x2, n_out = _encode_bit((magnitude >> k) & 1, base + SAMPLE_BIT_CONTEXTS + k, x1, x2, n0, n1,
+                                            probs, out, n_out)
+        cls = min(abs(v), 2)
+    return x1, x2, n_out
+
+
+@njit(cache=True)
+def _decode_samples_kernel(buffer, region_slots, last_region_slot, n0, n1, probs, samples):
+    # Kernel of ArithmeticBitCoder.decode_samples, fills samples and returns the coder state and the read position
+    x1 = 0
+    x2 = 0xffffffff
+    x = _init_x(buffer)
+    pos = 4
+    cls = 0
+    for i in range(len(samples)):
+        base = region_slots[i] if i < len(region_slots) else last_region_slot
+        y, x1, x2, x, pos = _decode_bit(base + SAMPLE_ZERO_CONTEXTS + cls, x1, x2, x, buffer, pos, n0, n1, probs)
+        if y:
+            samples[i] = 0
+            cls = 0
+            continue
+        negative, x1, x2, x, pos = _decode_bit(base + SAMPLE_SIGN_CONTEXT, x1, x2, x, buffer, pos, n0, n1, probs)
+        prefix = base + SAMPLE_PREFIX_CONTEXTS + 16 * cls
+        n_bits = 0
+        while True:
+            y, x1, x2, x, pos = _decode_bit(prefix + n_bits, x1, x2, x, buffer, pos, n0, n1, probs)
+            if not y:
+                break
+            n_bits += 1
+            if n_bits >= MAX_MAGNITUDE_BITS:
+                return x1, x2, x, pos, KERNEL_CORRUPT_SAMPLE
+        magnitude = 1
+        for k in range(n_bits - 1, -1, -1):
+            y, x1, x2, x, pos = _decode_bit(base + SAMPLE_BIT_CONTEXTS + k, x1, x2, x, buffer, pos, n0, n1, probs)
+            magnitude += magnitude + y
+        samples[i] = -magnitude if negative else magnitude
+        cls = min(magnitude, 2)
+    return x1, x2, x, pos, KERNEL_OK
+
+
+ESTIMATE_BLOCK_GRANULES = 8  # granules per block of estimate_samples_size
+
+
+def estimate_samples_size(granules, predictor=None):
+    """
+    Estimate the total length of the streams encode_samples writes for granules coded one after the other with one
+    predictor, without coding them. Within a block of ESTIMATE_BLOCK_GRANULES granules, the code length of the
+    decisions of one slot only depends on how many 0s and 1s it codes, so these are counted with np.bincount.
+    :param granules: Integer samples, shape (granules, samples per granule)
+    :param predictor: MP3Predictor whose regions are used, a new one by default
+    :return: Estimated length in bytes, without the stream length prefixes
+    """
+    granules = np.asarray(granules, dtype=np.int64).reshape(len(granules), -1)
+    n_granules, n_samples = granules.shape
+    predictor = predictor or MP3Predictor(GRANULE_BYTES // 2)
+    n_slots = predictor.n_regions * N_CONTEXTS
+    n_blocks = max(1, -(-n_granules // ESTIMATE_BLOCK_GRANULES))
+    region_slots = np.asarray(predictor.region_slots, dtype=np.int64)[:n_samples]
+    region_slots = np.append(region_slots, np.full(n_samples - len(region_slots), predictor.last_region_slot))
+    # Magnitude class of the previous sample in the granule
+    classes = np.zeros_like(granules)
+    classes[:, 1:] = np.minimum(np.abs(granules[:, :-1]), SAMPLE_CLASSES - 1)
+    blocks = np.repeat(np.arange(n_granules) // ESTIMATE_BLOCK_GRANULES, n_samples) * n_slots
+    bases = blocks + np.tile(region_slots, n_granules)
+    values = granules.ravel()
+    classes = classes.ravel()
+    n0 = np.zeros(n_blocks * n_slots)
+    n1 = np.zeros(n_blocks * n_slots)
+
+    def count(slots, ones, zeros):
+        n1[:] += np.bincount(slots, weights=ones, minlength=len(n1))
+        n0[:] += np.bincount(slots, weights=zeros, minlength=len(n0))
+
+    zero = values == 0
+    count(bases + SAMPLE_ZERO_CONTEXTS + classes, zero, ~zero)
+    values, bases, classes = values[~zero], bases[~zero], classes[~zero]
+    negative = values < 0
+    count(bases + SAMPLE_SIGN_CONTEXT, negative, ~negative)
+    magnitudes = np.abs(values)
+    n_bits = np.frexp(magnitudes.astype(np.float64))[1] - 1  # Exp-Golomb prefix length
+    prefixes = bases + SAMPLE_PREFIX_CONTEXTS + 16 * classes
+    for k in range(int(n_bits.max(initial=0)) + 1):
+        count(prefixes + k, n_bits > k, n_bits == k)
+        coded = n_bits > k  # bit k is coded below the leading one
+        ones = coded & ((magnitudes >> k) & 1).astype(bool)
+        count(bases + SAMPLE_BIT_CONTEXTS + k, ones, coded & ~ones)
+    bits = adaptive_code_length(n0.reshape(n_blocks, n_slots).astype(np.int64),
+                                n1.reshape(n_blocks, n_slots).astype(np.int64))
+    # Every stream is rounded up to whole bytes by flush, which adds about half a byte
+    return int(np.ceil(bits / 8)) + n_granules // 2
+
+
+def adaptive_code_length(n0, n1):
+    """
+    Code length of decisions coded with the probabilities of MP3Predictor, as adaptive_code_length in
+    compressors/utils/ArithmeticBitCoder.py computes it for its own predictor, where the formula is derived. The two
+    source trees are run from their own directories and both have an ArithmeticBitCoder module, so neither imports
+    from the other.
+    :param n0: Number of 0s coded in every block and slot, shape (blocks, slots)
+    :param n1: Number of 1s coded in every block and slot
+    :return: Code length in bits
+    """
+    c0 = np.zeros(n0.shape[1], dtype=np.int64)
+    c1 = np.zeros(n0.shape[1], dtype=np.int64)
+    log_factorial = _log2_factorials(2 * MAX_COUNT + 2 * int(max(n0.max(initial=0), n1.max(initial=0))) + 4)
+    bits = 0.0
+    for m0, m1 in zip(n0, n1):
+        bits += np.sum(log_factorial[c0 + c1 + m0 + m1 + 1] - log_factorial[c0 + c1 + 1]
+                       - log_factorial[c0 + m0] + log_factorial[c0] - log_factorial[c1 + m1] + log_factorial[c1])
+        c0 += m0
+        c1 += m1
+        while c0.max() > MAX_COUNT or c1.max() > MAX_COUNT:
+            halve = (c0 > MAX_COUNT) | (c1 > MAX_COUNT)
+            c0[halve] >>= 1
+            c1[halve] >>= 1
+    return float(bits)
+
+
+def _log2_factorials(n):
+    # log2(k!) for k < n
+    return np.concatenate(([0.0], np.cumsum(np.log2(np.arange(1, n, dtype=np.float64)))))
 
 
 class NaivePredictor:
@@ -127,16 +964,77 @@ class NaivePredictor:
 
 def test():
     data = b'\r\x00\x05\x00\xfb\xff\xf5\xff\x02\x00\xcf\xff\xf6\xff\xfa\xff\x01\x00\xfc\xff\r\x00\xfb\xff\x0e\x00\xfd\xff\x03\x00\xff\xff\x07\x00\xff\xff\x06\x00\x00\x00\x06\x00\xfa\xff\x04\x00\xfe\xff\xfd\xff\xfe\xff\xff\xff\xff\xff\xf4\xff\xfb\xff\x01\x00\xfe\xff\x01\x00\x02\x00\x0b\x00\x04\x00\xfe\xff\xff\xff\xff\xff\xff\xff\xff\xff\x06\x00\x01\x00\x03\x00\xfe\xff\xff\xff\x02\x00\xff\xff\x00\x00\x00\x00\x00\x00\x04\x00\x07\x00\xfe\xff\x00\x00\x00\x00\xff\xff\xfe\xff\xfb\xff\x00\x00\x01\x00\xfe\xff\xff\xff\xff\xff\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\xfb\xff\x04\x00\xff\xff\x01\x00\x02\x00\x01\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\xff\xff\xfe\xff\x02\x00\x00\x00\x00\x00\xff\xff\xfe\xff\x03\x00\xfe\xff\xfe\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\xfe\xff\x01\x00\x02\x00\x02\x00\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x01\x00\x01\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x02\x00\x01\x00\xff\xff\x01\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x01\x00\x02\x00\x00\x00\x01\x00\x01\x00\x00\x00\x02\x00\xff\xff\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\x00\x00\x01\x00\x00\x00\xfd\xff\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x01\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x01\x00\x01\x00\xff\xff\x01\x00\x00\x00\x00\x00\x01\x00\x01\x00\xff\xff\x00\x00\x01\x00\xff\xff\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\xff\xff\x01\x00\x01\x00\x00\x00\x01\x00\xff\xff\x01\x00\x01\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x10\x00\r\x00\xf3\xff\x05\x00\xfe\xff\x0b\x00\x04\x00\x01\x00\xff\xff\x06\x00\x05\x00\xfb\xff\xfa\xff\xfe\xff\x00\x00\x03\x00\xfe\xff\x05\x00\xff\xff\x02\x00\xfc\xff\xfc\xff\xfd\xff\xfe\xff\x02\x00\xf8\xff\x04\x00\xfa\xff\xf9\xff\xff\xff\x02\x00\x02\x00\x00\x00\x03\x00\x05\x00\xfe\xff\xff\xff\xff\xff\xff\xff\xff\xff\x00\x00\x02\x00\x02\x00\xff\xff\x00\x00\xff\xff\x01\x00\x00\x00\xff\xff\x01\x00\x02\x00\x02\x00\x04\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\xfe\xff\x00\x00\x01\x00\xff\xff\x01\x00\xff\xff\xff\xff\x00\x00\x00\x00\x01\x00\xff\xff\x02\x00\xff\xff\x01\x00\x01\x00\x01\x00\xfd\xff\x03\x00\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x01\x00\x01\x00\xff\xff\xff\xff\xff\xff\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x01\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\r\x00\xfa\xff\xf8\xff\xf8\xff\x19\x00\xb5\xff\xc8\xff\xf6\xff\t\x00\x0c\x00\x15\x00\xe1\xff\x06\x00\xfb\xff\x06\x00\x07\x00\xfc\xff\x1a\x00\xfc\xff\xfe\xff\xee\xff\x01\x00\xfc\xff\x06\x00\x02\x00\x02\x00\xfd\xff\x00\x00\r\x00\xf4\xff\x03\x00\xff\xff\x01\x00\x04\x00\xeb\xff\xf4\xff\x00\x00\x00\x00\xff\xff\x01\x00\xfd\xff\xf6\xff\x03\x00\t\x00\xff\xff\x02\x00\xfe\xff\xff\xff\x02\x00\xfe\xff\xfd\xff\xff\xff\xfd\xff\xff\xff\x00\x00\x00\x00\x02\x00\xfd\xff\x01\x00\x03\x00\x01\x00\x01\x00\xfe\xff\xff\xff\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\xfa\xff\x05\x00\xfc\xff\x04\x00\xff\xff\x01\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\xff\xff\x00\x00\xff\xff\x02\x00\x01\x00\xfe\xff\x00\x00\x01\x00\x00\x00\x01\x00\xff\xff\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\xfe\xff\x02\x00\xfd\xff\xfd\xff\x01\x00\x01\x00\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\xff\xff\xff\xff\xff\xff\xff\xff\x01\x00\xff\xff\xff\xff\x00\x00\x01\x00\x00\x00\x01\x00\x01\x00\xff\xff\x00\x00\x00\x00\x01\x00\xff\xff\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x01\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\xff\xff\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\xff\xff\x02\x00\xfe\xff\xff\xff\x01\x00\x01\x00\x01\x00\x01\x00\xff\xff\x01\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x01\x00\xff\xff\x01\x00\x01\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x01\x00\x00\x00\xff\xff\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x0b\x00\x06\x00\x0e\x00\x04\x00\xfd\xff\x06\x00\x08\x00\x00\x00\xfe\xff\x02\x00\xfa\xff\x05\x00\xfc\xff\x01\x00\x06\x00\x00\x00\xfc\xff\xfb\xff\xfd\xff\x01\x00\xf6\xff\x05\x00\x03\x00\xfc\xff\xfe\xff\xfe\xff\x01\x00\x01\x00\x03\x00\x06\x00\xfa\xff\xfd\xff\xff\xff\xff\xff\xf5\xff\xfd\xff\x01\x00\x01\x00\x00\x00\xff\xff\x03\x00\xfb\xff\x00\x00\x01\x00\x02\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x02\x00\x03\x00\x00\x00\xff\xff\x01\x00\xff\xff\x00\x00\x04\x00\x00\x00\x01\x00\x02\x00\xff\xff\xff\xff\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\xfd\xff\xfe\xff\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\xff\xff\x00\x00\x01\x00\xfd\xff\x02\x00\x01\x00\x00\x00\xfe\xff\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\xff\xff\x00\x00\x00\x00\x02\x00\xff\xff\x00\x00\xfc\xff\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xfe\xff\x01\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\xff\xff\xff\xff\x00\x00\x00\x00\xff\xff\x01\x00\xff\xff\xff\xff\xff\xff\xfe\xff\x01\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x02\x00\x00\x00\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x01\x00\xff\xff\xff\xff\x01\x00\x01\x00\x00\x00\x02\x00\x01\x00\x00\x00\xff\xff\xff\xff\xff\xff\x01\x00\x00\x00\x00\x00\x00\x00\xff\xff\x00\x00\x01\x00\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\xff\xff\x00\x00\xff\xff\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-    bitcoder = ArithmeticBitCoder()
-    enc = bitcoder.encode(data)
-    bitcoder.__init__()
-    dec = bitcoder.decode(enc)
-    print(dec)
+    for legacy, runs in ((False, True), (False, False), (True, False)):
+        bitcoder = ArithmeticBitCoder()
+        enc = bitcoder.encode(data, legacy, runs)
+        bitcoder.__init__()
+        dec = bitcoder.decode(enc, len(data), legacy=legacy, runs=runs)
+        assert dec == data and bitcoder.n_consumed == len(enc)
+        print(f"{len(data)} bytes -> {len(enc)} bytes{' (legacy)' if legacy else ''}{' (runs)' if runs else ''},"
+              f" decoded correctly")
 
 
 def test_decode():
-    pass
+    # Consecutive streams share the predictor and are decoded from one buffer, as in a 3PM frame
+    rng = np.random.default_rng(0)
+    granules = [np.round(rng.laplace(0, 2 ** (i % 6), 576)).astype(np.int16).tobytes() for i in range(20)]
+    granules += [bytes(GRANULE_BYTES), bytes(1000) + b"\x01" * 152]
+    padding = bytes(rng.integers(0, 256, 64, np.uint8))
+    for runs in (True, False):
+        encoder = ArithmeticBitCoder()
+        streams = [bytes(encoder.encode(g, runs=runs)) for g in granules]
+        compressed = b"".join(np.uint16(len(s)).tobytes() + s for s in streams) + padding
+        decoder = ArithmeticBitCoder()
+        offset = 0
+        for g in granules:
+            length = int(np.frombuffer(compressed[offset:offset + LEN_STREAM_LENGTH], dtype=np.uint16)[0])
+            offset += LEN_STREAM_LENGTH
+            assert decoder.decode(memoryview(compressed)[offset:], limit=length, runs=runs) == g
+            offset += length
+        assert offset == len(compressed) - 64
+        print(f"Decoded {len(granules)} granules from {offset} bytes{' (runs)' if runs else ''}")
+
+    # Legacy streams are decoded without lengths
+    encoder = ArithmeticBitCoder()
+    compressed = b"".join(bytes(encoder.encode(g, legacy=True)) for g in granules) + padding
+    decoder = ArithmeticBitCoder()
+    offset = 0
+    for g in granules:
+        assert decoder.decode(memoryview(compressed)[offset:], legacy=True) == g
+        offset += decoder.n_consumed
+    assert offset == len(compressed) - 64
+    print(f"Decoded {len(granules)} legacy granules from {offset} bytes")
+
+
+def test_samples():
+    # Typical granules as well as values at the ends of the int16 range, decoded from one buffer
+    rng = np.random.default_rng(0)
+    granules = [np.round(rng.laplace(0, 2 ** (i % 6), 576)).astype(np.int16) for i in range(20)]
+    granules += [np.zeros(576, np.int16), np.array([-32768, 32767, 255, -256, 256, -255, 1, -1] * 72, np.int16)]
+    encoder = ArithmeticBitCoder()
+    streams = [bytes(encoder.encode_samples(g)) for g in granules]
+    compressed = b"".join(streams) + bytes(rng.integers(0, 256, 64, np.uint8))
+    decoder = ArithmeticBitCoder()
+    offset = 0
+    for g, stream in zip(granules, streams):
+        assert (decoder.decode_samples(memoryview(compressed)[offset:], len(g), len(stream)) == g).all()
+        offset += len(stream)
+    print(f"Decoded {len(granules)} sample granules from {offset} bytes")
+
+
+def test_estimate():
+    rng = np.random.default_rng(0)
+    for scale in (0.5, 3, 30):
+        granules = np.round(rng.laplace(0, scale, (100, 576)) * np.linspace(4, 0, 576) ** 2).astype(np.int16)
+        bitcoder = ArithmeticBitCoder()
+        real = sum(len(bitcoder.encode_samples(granule)) for granule in granules)
+        estimate = estimate_samples_size(granules)
+        assert abs(estimate - real) <= 0.005 * real, (estimate, real)
+        print(f"Estimated {estimate} bytes for {real}")
 
 
 if __name__ == "__main__":
     test()
+    test_decode()
+    test_samples()
+    test_estimate()
@@ -0,0 +1,66 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# Side index (.3pmi) for random access into a 3PM file. All frames share one predictor, so a frame can only be decoded
+# after every frame before it. The index stores a predictor snapshot taken before every interval-th frame, decoding
+# can start at any of these checkpoints instead of the first frame.
+# | INDEX_MAGIC (4 bytes) | interval (4 bytes) | # of checkpoints (4 bytes) |
+# | frame index (4 bytes each) | file offset (8 bytes each) | snapshot length (4 bytes each) | snapshots |
+INDEX_MAGIC = b"3PMI"
+LEN_INDEX_HEADER = 12
+DEFAULT_INTERVAL = 100  # frames between checkpoints, about 2.6 s of audio at 44.1 kHz
+
+
+class CheckpointIndex:
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.frames = []  # index of the first frame decoded after restoring the snapshot, ascending
+        self.offsets = []  # offset of that frame in the 3PM file
+        self.snapshots = []  # MP3Predictor.to_bytes before that frame
+
+    def add(self, frame_idx, offset, snapshot):
+        if self.frames and frame_idx <= self.frames[-1]:
+            raise ValueError("Checkpoints have to be added in frame order")
+        self.frames.append(frame_idx)
+        self.offsets.append(offset)
+        self.snapshots.append(bytes(snapshot))
+
+    def find(self, frame_idx):
+        """
+        :param frame_idx: Frame to decode
+        :return: (frame index, file offset, snapshot) of the last checkpoint at or before frame_idx, None if there is
+        no such checkpoint
+        """
+        i = bisect_right(self.frames, frame_idx) - 1
+        if i < 0:
+            return None
+        return self.frames[i], self.offsets[i], self.snapshots[i]
+
+    def to_bytes(self):
+        header = INDEX_MAGIC + bytes(np.array([self.interval, len(self.frames)], dtype=np.int32))
+        table = bytes(np.array(self.frames, dtype=np.int32)) + bytes(np.array(self.offsets, dtype=np.int64)) + \
+            bytes(np.array([len(s) for s in self.snapshots], dtype=np.int32))
+        return header + table + b"".join(self.snapshots)
+
+    @staticmethod
+    def from_bytes(data):
+        view = memoryview(data).cast("B")
+        if bytes(view[:len(INDEX_MAGIC)]) != INDEX_MAGIC:
+            raise ValueError("Not a 3PM checkpoint index")
+        interval, n_checkpoints = (int(v) for v in np.frombuffer(view[len(INDEX_MAGIC):LEN_INDEX_HEADER], np.int32))
+        index = CheckpointIndex(interval)
+        pos = LEN_INDEX_HEADER
+        frames = np.frombuffer(view[pos:pos + 4 * n_checkpoints], dtype=np.int32)
+        pos += 4 * n_checkpoints
+        offsets = np.frombuffer(view[pos:pos + 8 * n_checkpoints], dtype=np.int64)
+        pos += 8 * n_checkpoints
+        lengths = np.frombuffer(view[pos:pos + 4 * n_checkpoints], dtype=np.int32)
+        pos += 4 * n_checkpoints
+        for frame_idx, offset, length in zip(frames.tolist(), offsets.tolist(), lengths.tolist()):
+            if pos + length > len(view):
+                raise ValueError("Truncated 3PM checkpoint index")
+            index.add(frame_idx, offset, view[pos:pos + length])
+            pos += length
+        return index
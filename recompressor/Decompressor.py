@@ -0,0 +1,155 @@
+import numpy as np
+
+from ArithmeticBitCoder import ArithmeticBitCoder, GRANULE_BYTES, FILE_MAGIC, LEGACY_VERSION, COUNTED_VERSION, \
+    RUN_VERSION, SAMPLE_VERSION, LEVEL_VERSION, LEN_STREAM_LENGTH, LEVEL_STORE, LEVEL_HUFFMAN, LEVEL_ADAPTIVE
+import HuffmanSampleCoder
+from CheckpointIndex import CheckpointIndex
+from FrameHeader import FrameHeader, ChannelMode
+
+NUM_OF_SAMPLES = 576
+
+
+class Decompressor:
+    """
+    Reads a 3PM file written by Recompressor.write_to_3pm. The file starts with FILE_MAGIC and a version byte (legacy
+    files have neither), from LEVEL_VERSION on followed by the compression level. Every frame holds the original MP3
+    header (4 bytes, 6 with CRC) and side information, an int16 payload length and one stream per granule and channel,
+    coded as the level selects and prefixed with its uint16 length except in legacy files. The streams share one
+    predictor over the whole file, so frames have to be decoded in order, starting at the first frame or at a
+    checkpoint of the file's index.
+    """
+
+    def __init__(self, file_data, index_data=None):
+        """
+        :param file_data: Contents of the 3PM file
+        :param index_data: Contents of the checkpoint index (.3pmi) written along with the file, if any
+        """
+        self.__data = memoryview(file_data).cast("B")
+        # Files before LEVEL_VERSION are coded like the adaptive level of their version
+        self.level = LEVEL_ADAPTIVE
+        if bytes(self.__data[:len(FILE_MAGIC)]) == FILE_MAGIC:
+            self.version = self.__data[len(FILE_MAGIC)]
+            if self.version not in (COUNTED_VERSION, RUN_VERSION, SAMPLE_VERSION, LEVEL_VERSION):
+                raise ValueError(f"Unsupported 3PM version {self.version}")
+            self.__offset = len(FILE_MAGIC) + 1
+            if self.version >= LEVEL_VERSION:
+                self.level = self.__data[self.__offset]
+                if self.level not in (LEVEL_STORE, LEVEL_HUFFMAN, LEVEL_ADAPTIVE):
+                    raise ValueError(f"Unsupported 3PM compression level {self.level}")
+                self.__offset += 1
+        else:
+            self.version = LEGACY_VERSION
+            self.__offset = 0
+        self.__first_offset = self.__offset
+        self.__frame_idx = 0
+        self.__index = None if index_data is None else CheckpointIndex.from_bytes(index_data)
+        self.__decoder = ArithmeticBitCoder()
+        self.__header = FrameHeader()
+        self.__allsamples = []
+
+    def seek(self, frame_idx):
+        """
+        Continue decoding at the closest position at or before frame_idx: the current one, the last checkpoint or
+        the first frame. The frames from there up to frame_idx still have to be decoded.
+        :param frame_idx: Frame to decode next
+        """
+        checkpoint = None if self.__index is None else self.__index.find(frame_idx)
+        if self.__frame_idx <= frame_idx and (checkpoint is None or checkpoint[0] <= self.__frame_idx):
+            return
+        if checkpoint is None:
+            self.__decoder = ArithmeticBitCoder()
+            self.__frame_idx, self.__offset = 0, self.__first_offset
+        else:
+            self.__frame_idx, self.__offset, snapshot = checkpoint
+            self.__decoder.predictor.restore_bytes(snapshot)
+
+    def frames(self, start=None):
+        """
+        Decode the file frame by frame
+        :param start: Index of the first frame to return, decoding continues where it stopped if omitted
+        :return: Generator of (header bytes, side information bytes, samples of shape (2, 2, 576))
+        """
+        data = self.__data
+        if start is not None and start != self.__frame_idx:
+            self.seek(start)
+        while self.__offset < len(data):
+            offset = self.__offset
+            if len(data) - offset < 4 or data[offset] != 0xFF or data[offset + 1] < 0xE0:
+                raise ValueError(f"No 3PM frame header at offset {offset}")
+            self.__header.init_header_params(data, offset)
+            header_size = 6 if self.__header.crc == 0 else 4
+            side_info_size = 17 if self.__header.channel_mode == ChannelMode.Mono else 32
+            header_bytes = bytes(data[offset:offset + header_size])
+            offset += header_size
+            sideinfo_bytes = bytes(data[offset:offset + side_info_size])
+            offset += side_info_size
+            payload_size = int(np.frombuffer(data[offset:offset + 2], dtype=np.int16)[0])
+            offset += 2
+            payload = data[offset:offset + payload_size]
+
+            if self.version == LEGACY_VERSION:
+                granules = self.__decode_legacy_payload(payload, 2 * self.__header.channels)
+            else:
+                granules = self.__decode_payload(payload, 2 * self.__header.channels)
+            if granules is None:
+                raise ValueError(f"Corrupt 3PM frame at offset {self.__offset}")
+            samples = np.zeros((2, 2, NUM_OF_SAMPLES), dtype=np.int16)
+            for i, granule in enumerate(granules):
+                samples[i // self.__header.channels, i % self.__header.channels, :] = np.frombuffer(granule, np.int16)
+
+            self.__offset = offset + payload_size
+            self.__frame_idx += 1
+            if start is None or self.__frame_idx > start:
+                yield header_bytes, sideinfo_bytes, samples
+
+    def __decode_payload(self, payload, n_streams):
+        granules = []
+        pos = 0
+        for _ in range(n_streams):
+            if pos + LEN_STREAM_LENGTH > len(payload):
+                return None
+            length = int(np.frombuffer(payload[pos:pos + LEN_STREAM_LENGTH], dtype=np.uint16)[0])
+            pos += LEN_STREAM_LENGTH
+            if pos + length > len(payload):
+                return None
+            if self.level == LEVEL_STORE:
+                if length != GRANULE_BYTES:
+                    return None
+                granules.append(bytes(payload[pos:pos + length]))
+            elif self.level == LEVEL_HUFFMAN:
+                granules.append(HuffmanSampleCoder.decode_samples(payload[pos:], GRANULE_BYTES // 2, length).tobytes())
+            elif self.version >= SAMPLE_VERSION:
+                granules.append(self.__decoder.decode_samples(payload[pos:], GRANULE_BYTES // 2, length).tobytes())
+            else:
+                granules.append(self.__decoder.decode(payload[pos:], GRANULE_BYTES, length,
+                                                      runs=self.version >= RUN_VERSION))
+            pos += length
+        return granules if pos == len(payload) else None
+
+    def __decode_legacy_payload(self, payload, n_streams, pos=0):
+        # Only the length of the whole payload is stored, so the last stream ends exactly there. Where an earlier
+        # stream can end at more than one place, the candidates are tried until the rest of the frame decodes.
+        last = n_streams == 1
+        limit = len(payload) - pos if last else None
+        for granule in self.__decoder.decode_candidates(payload[pos:], GRANULE_BYTES, limit):
+            if last:
+                return [granule]
+            rest = self.__decode_legacy_payload(payload, n_streams - 1, pos + self.__decoder.n_consumed)
+            if rest is not None:
+                return [granule] + rest
+        return None
+
+    def decode_file(self, start=None):
+        num_of_frames = 0
+        for _, _, samples in self.frames(start):
+            self.__allsamples.append(samples)
+            num_of_frames += 1
+        return num_of_frames
+
+    def export_samples(self, filename):
+        print(f"Writing {len(self.__allsamples)} to {filename}")
+        np.save(filename, self.__allsamples)
+
+    @property
+    def sampling_rate(self):
+        return self.__header.sampling_rate
@@ -7,18 +7,150 @@ import util
 from FrameHeader import *
 from FrameSideInformation import FrameSideInformation
 # Use below for MP3 probability model
-from ArithmeticBitCoder import ArithmeticBitCoder
+from ArithmeticBitCoder import ArithmeticBitCoder, LEVEL_STORE, LEVEL_HUFFMAN, DEFAULT_LEVEL
 # Use below for order-0 coding
 # from NaiveArithmeticBitCoder import ArithmeticBitCoder
+import HuffmanSampleCoder
+from jit import JIT, njit
 from tsc import compress_tsc, reconstruct_tsc
 
 NUM_PREV_FRAMES = 9
 NUM_OF_SAMPLES = 576
 
+LOOKUP_BITS = 8  # bits indexing the first level of the big value lookup tables
+QUAD_LOOKUP_BITS = 6  # longest count1 code
+# Bits peeked at once for a pair of big values (code of up to 17 bits with linbits, 2 x (13 linbits + sign)) and for a
+# quadruple (code and 4 signs), so that the linbits and signs are taken from the same integer as the code
+PAIR_BITS = 48
+QUAD_BITS = QUAD_LOOKUP_BITS + 4
+
+
+def build_big_value_lookup():
+    """
+    Two-level prefix lookup tables of all big value Huffman tables, concatenated into flat lists. The first level of a
+    table has an entry for every LOOKUP_BITS bit prefix. A code of up to LOOKUP_BITS bits fills all entries it is a
+    prefix of, longer codes fill a second-level table indexed by the bits after the first LOOKUP_BITS.
+    :return: Offset of the first level of every table, and x, y and code length of every entry. A negative length -w
+    links to the second-level table at offset x, indexed by w more bits. Length 0 marks prefixes of no code.
+    """
+    roots = []
+    xs, ys, lengths = [], [], []
+    for table_num, table in enumerate(big_value_table):
+        n_max = big_value_max[table_num]
+        codes = [(table[2 * i] >> (32 - table[2 * i + 1]), table[2 * i + 1], i // n_max, i % n_max)
+                 for i in range(n_max * n_max)]
+        root = len(lengths)
+        roots.append(root)
+        xs.extend([0] * (1 << LOOKUP_BITS))
+        ys.extend([0] * (1 << LOOKUP_BITS))
+        lengths.extend([0] * (1 << LOOKUP_BITS))
+        widths = {}
+        for code, size, _, _ in codes:
+            if size > LOOKUP_BITS:
+                prefix = code >> (size - LOOKUP_BITS)
+                widths[prefix] = max(widths.get(prefix, 0), size - LOOKUP_BITS)
+        for prefix, width in sorted(widths.items()):
+            xs[root + prefix] = len(lengths)
+            lengths[root + prefix] = -width
+            xs.extend([0] * (1 << width))
+            ys.extend([0] * (1 << width))
+            lengths.extend([0] * (1 << width))
+        for code, size, x, y in codes:
+            if size <= LOOKUP_BITS:
+                first = root + (code << (LOOKUP_BITS - size))
+                n_entries = 1 << (LOOKUP_BITS - size)
+            else:
+                link = root + (code >> (size - LOOKUP_BITS))
+                width = -lengths[link]
+                first = xs[link] + ((code & ((1 << (size - LOOKUP_BITS)) - 1)) << (width + LOOKUP_BITS - size))
+                n_entries = 1 << (width + LOOKUP_BITS - size)
+            for entry in range(first, first + n_entries):
+                xs[entry], ys[entry], lengths[entry] = x, y, size
+    return roots, xs, ys, lengths
+
+
+def build_quad_lookup():
+    # Code length and values of the count1 code every QUAD_LOOKUP_BITS bit prefix starts with
+    lengths = [0] * (1 << QUAD_LOOKUP_BITS)
+    values = [[0, 0, 0, 0] for _ in range(1 << QUAD_LOOKUP_BITS)]
+    for code, size, value in zip(quad_table_1.hcod, quad_table_1.hlen, quad_table_1.value):
+        first = code >> (32 - QUAD_LOOKUP_BITS)
+        for entry in range(first, first + (1 << (QUAD_LOOKUP_BITS - size))):
+            lengths[entry] = size
+            values[entry] = value
+    return lengths, values
+
+
+BIG_VALUE_ROOTS, BIG_VALUE_X, BIG_VALUE_Y, BIG_VALUE_LENGTHS = build_big_value_lookup()
+QUAD_LENGTHS, QUAD_VALUES = build_quad_lookup()
+
+# Lookup tables as arrays for unpack_samples_kernel
+BIG_VALUE_ROOT_ARRAY = np.array(BIG_VALUE_ROOTS, dtype=np.int64)
+BIG_VALUE_X_ARRAY = np.array(BIG_VALUE_X, dtype=np.int64)
+BIG_VALUE_Y_ARRAY = np.array(BIG_VALUE_Y, dtype=np.int64)
+BIG_VALUE_LENGTH_ARRAY = np.array(BIG_VALUE_LENGTHS, dtype=np.int64)
+BIG_VALUE_MAX = np.array(big_value_max, dtype=np.int64)
+BIG_VALUE_LINBIT = np.array(big_value_linbit, dtype=np.int64)
+QUAD_LENGTH_ARRAY = np.array(QUAD_LENGTHS, dtype=np.int64)
+QUAD_VALUE_ARRAY = np.array(QUAD_VALUES, dtype=np.int64)
+
 SQRT2 = math.sqrt(2)
 PI = math.pi
 
 
+@njit(cache=True)
+def unpack_samples_kernel(main_data, bit, max_bit, n_big_values, region0, region1, table_select, count1_table,
+                          samples, roots, xs, ys, lengths, table_max, table_linbit, quad_lengths, quad_values):
+    # Kernel of Frame.__unpack_samples, fills samples and returns the number of unpacked samples
+    samples[:] = 0
+    sample = 0
+    while sample < n_big_values * 2:
+        table_num = table_select[0] if sample < region0 else table_select[1] if sample < region1 else table_select[2]
+        if table_num == 0:
+            sample += 2
+            continue
+        bit_sample = util.get_bits_kernel(main_data, bit, PAIR_BITS)
+        entry = roots[table_num] + (bit_sample >> (PAIR_BITS - LOOKUP_BITS))
+        size = lengths[entry]
+        if size < 0:
+            entry = xs[entry] + ((bit_sample >> (PAIR_BITS - LOOKUP_BITS + size)) & ((1 << -size) - 1))
+            size = lengths[entry]
+        if size > 0:
+            linbits = table_linbit[table_num]
+            for k in range(2):
+                v = xs[entry] if k == 0 else ys[entry]
+                if linbits != 0 and v == table_max[table_num] - 1:
+                    size += linbits
+                    v += (bit_sample >> (PAIR_BITS - size)) & ((1 << linbits) - 1)
+                if v > 0:
+                    size += 1
+                    if (bit_sample >> (PAIR_BITS - size)) & 1:
+                        v = -v
+                samples[sample + k] = v
+            bit += size
+        sample += 2
+
+    while bit < max_bit and sample + 4 < 576:
+        bit_sample = util.get_bits_kernel(main_data, bit, QUAD_BITS)
+        if count1_table == 1:
+            size = 4
+            for k in range(4):
+                samples[sample + k] = 0 if (bit_sample >> (QUAD_BITS - 1 - k)) & 1 else 1
+        else:
+            entry = bit_sample >> (QUAD_BITS - QUAD_LOOKUP_BITS)
+            size = quad_lengths[entry]
+            if size > 0:
+                samples[sample:sample + 4] = quad_values[entry]
+        for k in range(4):
+            if samples[sample + k] > 0:
+                size += 1
+                if (bit_sample >> (QUAD_BITS - size)) & 1:
+                    samples[sample + k] = -samples[sample + k]
+        bit += size
+        sample += 4
+    return sample
+
+
 def init_synth_filterbank_block():
     n = np.zeros((64, 32))
     for i in range(64):
@@ -56,9 +188,11 @@ def create_sine_block():
 
 
 class Frame:
-    def __init__(self):
+    def __init__(self, level=DEFAULT_LEVEL):
+        """
+        :param level: Compression level of the 3PM frames, see ArithmeticBitCoder
+        """
         # Declarations
-        self.__buffer: list = []
         self.__prev_frame_size: np.ndarray = np.zeros(NUM_PREV_FRAMES)
         self.__frame_size: int = 0
         self.__side_info: FrameSideInformation = FrameSideInformation()
@@ -72,16 +206,22 @@ class Frame:
         self.__sine_block = create_sine_block()
         self.__synth_filterbank_block = init_synth_filterbank_block()
         self.__encoder = ArithmeticBitCoder()
+        self.__level = level
         self.enc_sizes = []
 
-    def init_frame_params(self, buffer, file_data, curr_offset):
-        self.__buffer = buffer
+    def init_frame_params(self, file_data, curr_offset):
+        """
+        Unpack the frame starting at curr_offset, its header must have been set with init_header_params
+        :param file_data: Byte buffer of the whole file, e.g. a memoryview of a memory-mapped file. Frames are read
+        at their offsets into it, only the main data of a frame is copied
+        :param curr_offset: Offset of the frame header in file_data
+        """
         self.set_frame_size()
 
-        starting_side_info_idx = 6 if self.__header.crc == 0 else 4
-        self.__side_info.set_side_info(self.__buffer[starting_side_info_idx:], self.__header)
-        self.__header_bytes = bytes(self.__buffer[:starting_side_info_idx])
-        self.__sideinfo_bytes = bytes(self.__buffer[starting_side_info_idx:starting_side_info_idx+self.__side_info.offset])
+        side_info_offset = curr_offset + (6 if self.__header.crc == 0 else 4)
+        self.__side_info.set_side_info(file_data, self.__header, side_info_offset)
+        self.__header_bytes = bytes(file_data[curr_offset:side_info_offset])
+        self.__sideinfo_bytes = bytes(file_data[side_info_offset:side_info_offset + self.__side_info.offset])
         self.__set_main_data(file_data, curr_offset)
         self.__export_samples = self.__samples.copy()
         # for gr in range(2):
@@ -132,9 +272,14 @@ class Frame:
         if self.__header.padding == 1:
             self.frame_size += 1
 
+    # Forget the previous frames, e.g. when the next frame is not behind the current one in the file.
+    def clear_reservoir(self):
+        self.prev_frame_size[:] = 0
+        self.frame_size = 0
+
     # Due to the Huffman bits' varying length the main_data isn't aligned with the frames.
     # Unpacks the scaling factors and quantized samples.
-    def __set_main_data(self, file_data: list, curr_offset: int):
+    def __set_main_data(self, file_data: memoryview, curr_offset: int):
         # Side information is 17 or 32 byte, plus 4 bytes from header an optional 2 bytes from CRC
         constant = 21 if self.__header.channel_mode == ChannelMode.Mono else 36
         if self.__header.crc == 0:
@@ -143,7 +288,7 @@ class Frame:
         # We'll put the main data in its own buffer. Main data may be larger than the previous frame and doesn't
         # Include the size of side info and headers
         if self.__side_info.main_data_begin == 0:
-            self.__main_data = self.__buffer[constant: self.frame_size]
+            self.__main_data = bytearray(file_data[curr_offset + constant: curr_offset + self.frame_size])
         else:
             bound = 0
             for frame in range(NUM_PREV_FRAMES):
@@ -158,25 +303,30 @@ class Frame:
                         part[frame] -= part[i]
 
                     loc = int(curr_offset - ptr_offset)
-                    self.__main_data = file_data[loc: loc + int(part[frame])]
+                    self.__main_data = bytearray(file_data[loc: loc + int(part[frame])])
                     ptr_offset -= (part[frame] + constant)
                     for i in range(frame - 1, -1, -1):
                         loc = int(curr_offset - ptr_offset)
-                        self.__main_data.extend(file_data[loc: loc + int(part[i])])
+                        self.__main_data += file_data[loc: loc + int(part[i])]
                         ptr_offset -= (part[i] + constant)
-                    self.__main_data.extend((self.__buffer[constant: self.frame_size]))
+                    self.__main_data += file_data[curr_offset + constant: curr_offset + self.frame_size]
                     break
-        bit = 0
+            else:
+                # main_data_begin reaches before the previous frames, only the frame's own part is left
+                self.__main_data = bytearray(file_data[curr_offset + constant: curr_offset + self.frame_size])
+        if JIT:
+            self.__main_data_array = np.frombuffer(self.__main_data, dtype=np.uint8)
+        self.__reader = util.BitReader(self.__main_data)
         for gr in range(2):
             for ch in range(self.__header.channels):
-                max_bit = int(bit + self.__side_info.part2_3_length[gr][ch])
-                bit = self.__unpack_scalefac(gr, ch, bit)
-                self.__unpack_samples(gr, ch, bit, max_bit)
-                bit = max_bit
+                max_bit = int(self.__reader.bit + self.__side_info.part2_3_length[gr][ch])
+                self.__unpack_scalefac(gr, ch)
+                self.__unpack_samples(gr, ch, max_bit)
+                self.__reader.bit = max_bit
 
     # Unpack the scale factor indices from the main data. slen1 and slen2 are the size (in bits) of each scaling factor.
     # There are 21 scaling factors for long windows and 12 for each short window.
-    def __unpack_scalefac(self, gr: int, ch: int, bit: int):
+    def __unpack_scalefac(self, gr: int, ch: int):
         sfb = 0
         window = 0
         scalefactor_length = [slen[int(self.__side_info.scalefac_compress[gr][ch])][0],
@@ -186,27 +336,19 @@ class Frame:
         if self.__side_info.block_type[gr][ch] == 2 and self.__side_info.window_switching[gr][ch]:
             if self.__side_info.mixed_block_flag[gr][ch] == 1:  # Mixed blocks.
                 for sfb in range(8):
-                    self.__side_info.scalefac_l[gr][ch][sfb] = util.get_bits(self.__main_data, bit,
-                                                                             scalefactor_length[0])
-                    bit += scalefactor_length[0]
+                    self.__side_info.scalefac_l[gr][ch][sfb] = self.__reader.read(scalefactor_length[0])
 
                 for sfb in range(3, 6):
                     for window in range(3):
-                        self.__side_info.scalefac_s[gr][ch][window][sfb] = util.get_bits(self.__main_data, bit,
-                                                                                         scalefactor_length[0])
-                        bit += scalefactor_length[0]
+                        self.__side_info.scalefac_s[gr][ch][window][sfb] = self.__reader.read(scalefactor_length[0])
             else:  # Short blocks.
                 for sfb in range(6):
                     for window in range(3):
-                        self.__side_info.scalefac_s[gr][ch][window][sfb] = util.get_bits(self.__main_data, bit,
-                                                                                         scalefactor_length[0])
-                        bit += scalefactor_length[0]
+                        self.__side_info.scalefac_s[gr][ch][window][sfb] = self.__reader.read(scalefactor_length[0])
 
             for sfb in range(6, 12):
                 for window in range(3):
-                    self.__side_info.scalefac_s[gr][ch][window][sfb] = util.get_bits(self.__main_data, bit,
-                                                                                     scalefactor_length[1])
-                    bit += scalefactor_length[1]
+                    self.__side_info.scalefac_s[gr][ch][window][sfb] = self.__reader.read(scalefactor_length[1])
 
             for window in range(3):
                 self.__side_info.scalefac_s[gr][ch][window][12] = 0
@@ -215,13 +357,9 @@ class Frame:
         else:
             if gr == 0:
                 for sfb in range(11):
-                    self.__side_info.scalefac_l[gr][ch][sfb] = util.get_bits(self.__main_data, bit,
-                                                                             scalefactor_length[0])
-                    bit += scalefactor_length[0]
+                    self.__side_info.scalefac_l[gr][ch][sfb] = self.__reader.read(scalefactor_length[0])
                 for sfb in range(11, 21):
-                    self.__side_info.scalefac_l[gr][ch][sfb] = util.get_bits(self.__main_data, bit,
-                                                                             scalefactor_length[1])
-                    bit += scalefactor_length[1]
+                    self.__side_info.scalefac_l[gr][ch][sfb] = self.__reader.read(scalefactor_length[1])
             else:  # Scale factors might be reused in the second granule.
                 SB = [6, 11, 16, 21]
                 PREV_SB = [0, 6, 11, 16]
@@ -230,25 +368,18 @@ class Frame:
                         if self.__side_info.scfsi[ch][i]:
                             self.__side_info.scalefac_l[gr][ch][sfb] = self.__side_info.scalefac_l[0][ch][sfb]
                         else:
-                            self.__side_info.scalefac_l[gr][ch][sfb] = util.get_bits(self.__main_data, bit,
-                                                                                     scalefactor_length[0])
-                            bit += scalefactor_length[0]
+                            self.__side_info.scalefac_l[gr][ch][sfb] = self.__reader.read(scalefactor_length[0])
                 for i in range(2, 4):
                     for sfb in range(PREV_SB[i], SB[i]):
                         if self.__side_info.scfsi[ch][i]:
                             self.__side_info.scalefac_l[gr][ch][sfb] = self.__side_info.scalefac_l[0][ch][sfb]
                         else:
-                            self.__side_info.scalefac_l[gr][ch][sfb] = util.get_bits(self.__main_data, bit,
-                                                                                     scalefactor_length[1])
-                            bit += scalefactor_length[1]
+                            self.__side_info.scalefac_l[gr][ch][sfb] = self.__reader.read(scalefactor_length[1])
 
             self.__side_info.scalefac_l[gr][ch][21] = 0
 
-        return bit
-
-    def __unpack_samples(self, gr, ch, bit, max_bit):
-        for i in range(NUM_OF_SAMPLES):
-            self.__samples[gr][ch][i] = 0
+    def __unpack_samples(self, gr, ch, max_bit):
+        reader = self.__reader
 
         # Get big value region boundaries.
         if self.side_info.window_switching[gr][ch] and self.side_info.block_type[gr][ch] == 2:
@@ -259,99 +390,93 @@ class Frame:
             region1 = self.__header.band_index.long_win[int(self.side_info.region0_count[gr][ch]) + 1 +
                                                         int(self.side_info.region1_count[gr][ch]) + 1]
 
+        if JIT:
+            table_select = np.array(self.side_info.table_select[gr][ch], dtype=np.int64)
+            self.__nonzero_samples_size[gr][ch] = unpack_samples_kernel(
+                self.__main_data_array, reader.bit, max_bit, int(self.side_info.big_value[gr][ch]), region0, region1,
+                table_select, int(self.side_info.count1table_select[gr][ch]), self.__samples[gr][ch],
+                BIG_VALUE_ROOT_ARRAY, BIG_VALUE_X_ARRAY, BIG_VALUE_Y_ARRAY, BIG_VALUE_LENGTH_ARRAY, BIG_VALUE_MAX,
+                BIG_VALUE_LINBIT, QUAD_LENGTH_ARRAY, QUAD_VALUE_ARRAY)
+            return
+
+        # The samples are collected in a list, which is much faster to index than the array
+        samples = [0] * NUM_OF_SAMPLES
+        table_select = [int(table_num) for table_num in self.side_info.table_select[gr][ch]]
+
         # Get the samples in the big value region. Each entry in the Huffman tables yields two samples.
         sample = 0
-        while sample < self.side_info.big_value[gr][ch] * 2:
+        n_big_values = int(self.side_info.big_value[gr][ch]) * 2
+        while sample < n_big_values:
             if sample < region0:
-                table_num = int(self.side_info.table_select[gr][ch][0])
-                table = big_value_table[table_num]
+                table_num = table_select[0]
             elif sample < region1:
-                table_num = int(self.side_info.table_select[gr][ch][1])
-                table = big_value_table[table_num]
+                table_num = table_select[1]
             else:
-                table_num = int(self.side_info.table_select[gr][ch][2])
-                table = big_value_table[table_num]
+                table_num = table_select[2]
 
             if table_num == 0:
-                self.__samples[gr][ch][sample] = 0
                 sample += 2
                 continue
 
-            repeat = True
-            bit_sample = util.get_bits(self.__main_data, bit, 32)
-
-            # Cycle through the Huffman table and find a matching bit pattern.
-            row = 0
-            while row < big_value_max[table_num] and repeat:
-                for col in range(big_value_max[table_num]):
-                    i = 2 * big_value_max[table_num] * row + 2 * col
-                    value = table[i]
-                    size = table[i + 1]
-                    if value >> (32 - size) == bit_sample >> (32 - size):
-                        bit += size
-                        values = (row, col)
-                        for i in range(2):
-
-                            # linbits extend the sample's size if needed.
-                            linbit = 0
-                            if big_value_linbit[table_num] != 0 and values[i] == big_value_max[table_num] - 1:
-                                linbit = util.get_bits(self.__main_data, bit, big_value_linbit[table_num])
-                                bit += big_value_linbit[table_num]
-
-                            # If the sample is negative or positive.
-                            sign = 1
-                            if values[i] > 0:
-                                sign = -1 if util.get_bits(self.__main_data, bit, 1) > 0 else 1
-                                bit += 1
-
-                            self.__samples[gr][ch][sample + i] = float(sign * (values[i] + linbit))
-
-                        repeat = False
-                        break
-                row += 1
+            # Look up the code in the first and, for long codes, the second level of the table. size counts the
+            # bits of the pair so far.
+            bit_sample = reader.peek(PAIR_BITS)
+            entry = BIG_VALUE_ROOTS[table_num] + (bit_sample >> (PAIR_BITS - LOOKUP_BITS))
+            size = BIG_VALUE_LENGTHS[entry]
+            if size < 0:
+                entry = BIG_VALUE_X[entry] + ((bit_sample >> (PAIR_BITS - LOOKUP_BITS + size)) & ((1 << -size) - 1))
+                size = BIG_VALUE_LENGTHS[entry]
+            if size > 0:
+                linbits = big_value_linbit[table_num]
+                for i, value in enumerate((BIG_VALUE_X[entry], BIG_VALUE_Y[entry])):
+
+                    # linbits extend the sample's size if needed.
+                    if linbits != 0 and value == big_value_max[table_num] - 1:
+                        size += linbits
+                        value += (bit_sample >> (PAIR_BITS - size)) & ((1 << linbits) - 1)
+
+                    # If the sample is negative or positive.
+                    if value > 0:
+                        size += 1
+                        if (bit_sample >> (PAIR_BITS - size)) & 1:
+                            value = -value
+
+                    samples[sample + i] = value
+                reader.skip(size)
             sample += 2
 
         # Quadruples region.
-        while bit < max_bit and sample + 4 < 576:
+        while reader.bit < max_bit and sample + 4 < 576:
             values = [0, 0, 0, 0]
+            bit_sample = reader.peek(QUAD_BITS)
 
             # Flip bits.
             if self.side_info.count1table_select[gr][ch] == 1:
-                bit_sample = util.get_bits(self.__main_data, bit, 4)
-                bit += 4
-                values[0] = 0 if (bit_sample & 0x08) > 0 else 1
-                values[1] = 0 if (bit_sample & 0x04) > 0 else 1
-                values[2] = 0 if (bit_sample & 0x02) > 0 else 1
-                values[3] = 0 if (bit_sample & 0x01) > 0 else 1
+                size = 4
+                values[0] = 0 if (bit_sample & 0x200) > 0 else 1
+                values[1] = 0 if (bit_sample & 0x100) > 0 else 1
+                values[2] = 0 if (bit_sample & 0x080) > 0 else 1
+                values[3] = 0 if (bit_sample & 0x040) > 0 else 1
             else:
-                bit_sample = util.get_bits(self.__main_data, bit, 32)
-                for entry in range(16):
-                    value = quad_table_1.hcod[entry]
-                    size = quad_table_1.hlen[entry]
-
-                    if value >> (32 - size) == bit_sample >> (32 - size):
-                        bit += size
-                        for i in range(4):
-                            values[i] = int(quad_table_1.value[entry][i])
-                        break
+                size = QUAD_LENGTHS[bit_sample >> (QUAD_BITS - QUAD_LOOKUP_BITS)]
+                if size > 0:
+                    values = list(QUAD_VALUES[bit_sample >> (QUAD_BITS - QUAD_LOOKUP_BITS)])
 
             # Get the sign bit.
             for i in range(4):
                 if values[i] > 0:
-                    if util.get_bits(self.__main_data, bit, 1) == 1:
+                    size += 1
+                    if (bit_sample >> (QUAD_BITS - size)) & 1:
                         values[i] = -values[i]
-                    bit += 1
+            reader.skip(size)
 
-            for i in range(4):
-                self.__samples[gr][ch][sample + i] = values[i]
+            samples[sample:sample + 4] = values
 
             sample += 4
 
-        # Fill remaining samples with zero.
+        # The remaining samples stay zero.
         self.__nonzero_samples_size[gr][ch] = sample
-        while sample < 576:
-            self.__samples[gr][ch][sample] = 0
-            sample += 1
+        self.__samples[gr][ch][:] = samples
 
     # The reduced samples are rescaled to their original scales and precisions.
     def __requantize(self, gr: int, ch: int):
@@ -567,19 +692,39 @@ class Frame:
     def sampling_rate(self):
         return self.__header.sampling_rate
 
-    def init_header_params(self, buffer):
-        self.__header.init_header_params(buffer)
+    def init_header_params(self, buffer, offset=0):
+        self.__header.init_header_params(buffer, offset)
 
     def get_samples(self):
         return self.__export_samples.astype(np.int16)
 
+    def get_granules(self):
+        # Samples of the granule streams in the order get_3pm_bytes codes them, shape (granules, NUM_OF_SAMPLES)
+        return np.array([self.__samples[gr, ch, :] for gr in range(2) for ch in range(self.__header.channels)],
+                        dtype=np.int16)
+
+    def get_3pm_overhead(self):
+        # Bytes of the 3PM frame besides the granule streams: header, side information and the length prefixes
+        return len(self.__header_bytes) + len(self.__sideinfo_bytes) + 2 + 2 * 2 * self.__header.channels
+
+    def get_predictor_snapshot(self):
+        # State the next frame's streams are coded with, see CheckpointIndex
+        return self.__encoder.predictor.to_bytes()
+
+    def get_parsed_frame(self):
+        # What init_frame_params unpacked, to hand a frame parsed in another process to set_parsed_frame
+        return self.frame_size, self.__header_bytes, self.__sideinfo_bytes, self.__samples.copy()
+
+    def set_parsed_frame(self, parsed_frame):
+        # Instead of init_frame_params, after init_header_params with the same frame
+        self.frame_size, self.__header_bytes, self.__sideinfo_bytes, samples = parsed_frame
+        self.__samples[:] = samples
+        self.__export_samples = self.__samples.copy()
+
     def interleave(self):
-        pcm = np.zeros((2 * NUM_OF_SAMPLES, self.__header.channels))
-        for gr in range(2):
-            for sample in range(576):
-                for ch in range(self.__header.channels):
-                    pcm[sample + NUM_OF_SAMPLES * gr][ch] = self.__samples[gr][ch][sample]
-        return pcm
+        # Samples of both granules one after the other, shape (2 * NUM_OF_SAMPLES, channels)
+        channels = self.__header.channels
+        return self.__samples[:, :channels, :].transpose(0, 2, 1).reshape(2 * NUM_OF_SAMPLES, channels)
 
     def get_3pm_bytes(self):
         """
@@ -592,11 +737,19 @@ class Frame:
         # Use following line to export uncoded bytes or to compress it as whole (TSC, order-0 arithmetic coding)
         # new_main_data = bytes((self.__samples.flatten()).astype(np.int16))
 
-        # Use following four lines with the MP3 probability model
+        # Every granule is coded as selected by the compression level and prefixed with its length
         encoded = bytearray()
         for gr in range(2):
-           for ch in range(self.__header.channels):
-               encoded.extend(self.__encoder.encode(self.__samples[gr, ch, :].astype(np.int16).tobytes()))
+            for ch in range(self.__header.channels):
+                samples = self.__samples[gr, ch, :].astype(np.int16)
+                if self.__level == LEVEL_STORE:
+                    stream = samples.tobytes()
+                elif self.__level == LEVEL_HUFFMAN:
+                    stream = HuffmanSampleCoder.encode_samples(samples)
+                else:
+                    stream = self.__encoder.encode_samples(samples)
+                encoded.extend(np.uint16(len(stream)).tobytes())
+                encoded.extend(stream)
 
         # Use following line for the naive (order-0) probability model
         # new_main_data = self.__export_samples.flatten().astype(np.int16).tobytes()
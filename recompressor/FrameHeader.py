@@ -30,7 +30,7 @@ class Emphasis(Enum):
 class FrameHeader:
     def __init__(self):
         # Declarations
-        self.__buffer: list = []
+        self.__buffer: bytes = bytes(4)
         self.__mpeg_version: float = 0.0
         self.__layer: int = 0
         self.__crc: bool = False
@@ -46,9 +46,10 @@ class FrameHeader:
         self.__band_width: Band = Band()
 
     # Unpack the MP3 header.
-    # @param buffer A pointer that points to the first byte of the frame header.
-    def init_header_params(self, buffer):
-        self.__buffer = buffer
+    # @param buffer A buffer that contains the frame header, e.g. the whole file.
+    # @param offset The offset of the first byte of the frame header in buffer.
+    def init_header_params(self, buffer, offset=0):
+        self.__buffer = bytes(buffer[offset:offset + 4])
         self.__set_mpeg_version()
         self.__set_layer(self.__buffer[1])
         self.__set_crc()
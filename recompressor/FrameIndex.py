@@ -0,0 +1,145 @@
+import numpy as np
+
+from ID3_Parser import ID3
+
+# Table of the MPEG audio layer III frames of a file, found without decoding them one after the other. Every pair of
+# bytes that starts with the 11 bit sync word 0xFFE is a candidate header. All candidate headers are decoded at once
+# with NumPy, and a candidate is taken as a frame if the frame size it states leads to another candidate of the same
+# stream, MIN_CHAIN times in a row or up to the end of the file. Frames behind corrupt data are found again at the
+# next such chain, the table then has a gap between them and the frames before.
+MIN_CHAIN = 3
+
+# Indexed by the version bits of the header: MPEG 2.5, reserved, MPEG 2, MPEG 1
+SAMPLING_RATES = np.array([[11025, 12000, 8000, 0], [0, 0, 0, 0], [22050, 24000, 16000, 0], [44100, 48000, 32000, 0]])
+BIT_RATES = np.array([[0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0]] * 3 +
+                     [[0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0]]) * 1000
+SAMPLES_PER_FRAME = np.array([576, 0, 576, 1152])
+LAYER_III = 1  # layer bits of the header
+
+FRAME_DTYPE = np.dtype([("offset", np.int64), ("size", np.int32), ("bit_rate", np.int32),
+                        ("sampling_rate", np.int32), ("channel_mode", np.uint8)])
+
+
+def scan_frames(file_data, offset=0):
+    """
+    Find the layer III frames of a file
+    :param file_data: Bytes of the whole file, e.g. a memory-mapped file
+    :param offset: Offset the search starts at, e.g. behind the ID3 tag
+    :return: Structured array of FRAME_DTYPE in file order, the channel mode as in FrameHeader.ChannelMode
+    """
+    data = np.frombuffer(file_data, dtype=np.uint8)
+    n_bytes = len(data)
+    # Headers are 4 bytes, a candidate in the last 3 bytes of the file cannot be a frame
+    positions = offset + np.flatnonzero((data[offset:n_bytes - 3] == 0xFF) & (data[offset + 1:n_bytes - 2] >= 0xE0))
+
+    byte1 = data[positions + 1]
+    byte2 = data[positions + 2]
+    version = (byte1 >> 3) & 3
+    layer = (byte1 >> 1) & 3
+    bit_rate_idx = byte2 >> 4
+    sampling_idx = (byte2 >> 2) & 3
+    sampling_rate = SAMPLING_RATES[version, sampling_idx]
+    bit_rate = BIT_RATES[version, bit_rate_idx]
+    valid = (layer == LAYER_III) & (sampling_rate > 0) & (bit_rate > 0)
+    if not valid.any():
+        return np.zeros(0, dtype=FRAME_DTYPE)
+    positions, version, sampling_idx = positions[valid], version[valid], sampling_idx[valid]
+    sampling_rate, bit_rate, byte2 = sampling_rate[valid], bit_rate[valid], byte2[valid]
+    sizes = SAMPLES_PER_FRAME[version] // 8 * bit_rate // sampling_rate + ((byte2 >> 1) & 1)
+
+    # Index of the candidate behind every candidate, -1 if there is none of the same stream
+    ends = positions + sizes
+    reaches_end = ends >= n_bytes
+    following = np.minimum(np.searchsorted(positions, ends), len(positions) - 1)
+    following[(positions[following] != ends) | (version[following] != version) |
+              (sampling_idx[following] != sampling_idx)] = -1
+
+    # Candidates that start a chain of MIN_CHAIN frames or a shorter one up to the end of the file
+    confirmed = reaches_end.copy()
+    current = np.arange(len(positions))
+    alive = np.ones(len(positions), dtype=bool)
+    for _ in range(MIN_CHAIN - 1):
+        step = following[current]
+        alive &= step >= 0
+        current = np.where(alive, step, current)
+        confirmed |= alive & reaches_end[current]
+    confirmed |= alive
+    # The last frames in front of corrupt data or a trailing tag are taken with the chain they end
+    for _ in range(MIN_CHAIN - 1):
+        confirmed[following[confirmed & (following >= 0)]] = True
+
+    # A false sync word inside a frame can only start a chain of its own by chance, the first frame wins
+    frames = np.flatnonzero(confirmed)
+    keep = []
+    end = offset
+    for i in frames.tolist():
+        if positions[i] >= end:
+            keep.append(i)
+            end = ends[i]
+
+    table = np.zeros(len(keep), dtype=FRAME_DTYPE)
+    table["offset"] = positions[keep]
+    table["size"] = sizes[keep]
+    table["bit_rate"] = bit_rate[keep]
+    table["sampling_rate"] = sampling_rate[keep]
+    table["channel_mode"] = data[positions[keep] + 3] >> 6
+    return table
+
+
+class FrameIndex:
+
+    def __init__(self, file_data, offset=0):
+        """
+        :param file_data: Bytes of the whole file, e.g. a memory-mapped file
+        :param offset: Offset of the first frame, e.g. behind the ID3 tag
+        """
+        self.frames = scan_frames(file_data, offset)
+        self.offsets = self.frames["offset"]
+        self.sizes = self.frames["size"]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def find(self, offset):
+        """
+        :param offset: Offset in the file
+        :return: Index of the frame that contains offset, or of the first frame behind it if offset is in no frame
+        """
+        i = int(np.searchsorted(self.offsets, offset, side="right")) - 1
+        if i < 0 or offset >= self.offsets[i] + self.sizes[i]:
+            i += 1
+        return i
+
+    def gaps(self):
+        """
+        :return: Indices of the frames that do not start where the frame before them ends, i.e. behind corrupt data
+        """
+        return np.flatnonzero(self.offsets[1:] != self.offsets[:-1] + self.sizes[:-1]) + 1
+
+
+def test():
+    with open("tranceshort.mp3", "rb") as file:
+        data = file.read()
+    id3 = ID3(data)
+    index = FrameIndex(data, id3.offset if id3.is_valid else 0)
+    # Walk the frames one after the other, as the recompressor did before
+    offset = index.offsets[0]
+    for frame in index.frames:
+        assert frame["offset"] == offset
+        offset += frame["size"]
+    assert offset >= len(data) - 128 and len(index.gaps()) == 0
+    print(f"{len(index)} frames, {index.frames['bit_rate'].min() // 1000}-{index.frames['bit_rate'].max() // 1000} kbit/s")
+
+    # Corrupt a few frames in the middle, the frames behind them are found again
+    corrupt = bytearray(data)
+    start = int(index.offsets[100])
+    corrupt[start:start + 2000] = bytes(2000)
+    resynced = FrameIndex(corrupt, int(index.offsets[0]))
+    assert set(resynced.offsets.tolist()) <= set(index.offsets.tolist())
+    assert len(resynced.gaps()) == 1 and resynced.offsets[-1] == index.offsets[-1]
+    assert index.find(start + 5) == 100 and index.find(0) == 0
+    print(f"Resynced after corrupt data, {len(index) - len(resynced)} frames lost")
+
+
+if __name__ == "__main__":
+    test()
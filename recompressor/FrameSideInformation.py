@@ -37,14 +37,14 @@ class FrameSideInformation:
         self.__scalefac_s: np.ndarray = np.zeros((2, 2, 3, 13))
         self.__offset: int = 0
 
-    def set_side_info(self, buffer: list, header: FrameHeader):
-        offset = 0
+    # Unpack the side information starting at byte offset of buffer, e.g. right after the header in the whole file.
+    def set_side_info(self, buffer: memoryview, header: FrameHeader, offset: int = 0):
+        reader = BitReader(buffer, offset << 3)
 
         # Get main data begin pointer from buffer
-        self.__main_data_begin = get_bits(buffer, 0, 9)
-        offset += 9
+        self.__main_data_begin = reader.read(9)
         # Skip private bits
-        offset += 5 if header.channel_mode == ChannelMode.Mono else 3
+        reader.skip(5 if header.channel_mode == ChannelMode.Mono else 3)
 
         # Scale factor selection info:
         # If scfsi[scfsi_band] == 1, then scale factors for 1st granule are reused in the 2nd granule.
@@ -52,23 +52,18 @@ class FrameSideInformation:
         # scfsi_band indicates what group of scaling factors are reused (1-4)
         for ch in range(header.channels):
             for scfsi_band in range(4):
-                self.__scfsi[ch][scfsi_band] = get_bits(buffer, offset, 1) != 0
-                offset += 1
+                self.__scfsi[ch][scfsi_band] = reader.read(1) != 0
 
         for gr in range(2):
             for ch in range(header.channels):
                 # Length of scaling factors and main data in bits.
-                self.__part2_3_length[gr][ch] = get_bits(buffer, offset, 12)
-                offset += 12
+                self.__part2_3_length[gr][ch] = reader.read(12)
                 # Number of values is each big_region.
-                self.__big_value[gr][ch] = get_bits(buffer, offset, 9)
-                offset += 9
+                self.__big_value[gr][ch] = reader.read(9)
                 # Quantizer step size.
-                self.__global_gain[gr][ch] = get_bits(buffer, offset, 8)
-                offset += 8
+                self.__global_gain[gr][ch] = reader.read(8)
                 # Used to determine the values of slen1 and slen2.
-                self.__scalefac_compress[gr][ch] = get_bits(buffer, offset, 4)
-                offset += 4
+                self.__scalefac_compress[gr][ch] = reader.read(4)
                 # Number of bits given to a range of scale factors.
                 # - Normal blocks: slen1 0 - 10, slen2 11-20
                 # - Short blocks: Short blocks && mixed_block_flag == 1: slen1 0 - 5, slen2 6-11
@@ -76,16 +71,13 @@ class FrameSideInformation:
                 self.__slen1[gr][ch] = slen[int(self.__scalefac_compress[gr][ch])][0]
                 self.__slen2[gr][ch] = slen[int(self.__scalefac_compress[gr][ch])][1]
                 # If set, a not normal window is being used.
-                self.__window_switching[gr][ch] = get_bits(buffer, offset, 1) == 1
-                offset += 1
+                self.__window_switching[gr][ch] = reader.read(1) == 1
 
                 if self.__window_switching[gr][ch]:
                     # Window type for the granule: 0=reserved, 1=start block, 2=3 short blocks, 3=end block
-                    self.__block_type[gr][ch] = get_bits(buffer, offset, 2)
-                    offset += 2
+                    self.__block_type[gr][ch] = reader.read(2)
                     # Number of scale factor bands before window switching.
-                    self.__mixed_block_flag[gr][ch] = get_bits(buffer, offset, 1) == 1
-                    offset += 1
+                    self.__mixed_block_flag[gr][ch] = reader.read(1) == 1
                     if self.__mixed_block_flag[gr][ch]:
                         self.__switch_point_l[gr][ch] = 8
                         self.__switch_point_s[gr][ch] = 3
@@ -97,11 +89,9 @@ class FrameSideInformation:
 
                     for region in range(2):
                         # Huffman table number for a big region
-                        self.__table_select[gr][ch][region] = get_bits(buffer, offset, 5)
-                        offset += 5
+                        self.__table_select[gr][ch][region] = reader.read(5)
                     for window in range(3):
-                        self.__subblock_gain[gr][ch][window] = get_bits(buffer, offset, 3)
-                        offset += 3
+                        self.__subblock_gain[gr][ch][window] = reader.read(3)
 
                 else:
                     # Set by default if window_switching not set.
@@ -109,27 +99,21 @@ class FrameSideInformation:
                     self.__mixed_block_flag[gr][ch] = False
 
                     for region in range(3):
-                        self.__table_select[gr][ch][region] = get_bits(buffer, offset, 5)
-                        offset += 5
+                        self.__table_select[gr][ch][region] = reader.read(5)
 
                     # Number of scale factor bands in the first big value region.
-                    self.__region0_count[gr][ch] = get_bits(buffer, offset, 4)
-                    offset += 4
+                    self.__region0_count[gr][ch] = reader.read(4)
                     # Number of scale factor bands in the third big value region.
-                    self.__region1_count[gr][ch] = get_bits(buffer, offset, 3)
-                    offset += 3
+                    self.__region1_count[gr][ch] = reader.read(3)
                     # scale factor bands is 12*3 = 36
 
                 # if set, adds values from a table to the scaling factor
-                self.__preflag[gr][ch] = get_bits(buffer, offset, 1)
-                offset += 1
+                self.__preflag[gr][ch] = reader.read(1)
                 # Determines the step size.
-                self.__scalefac_scale[gr][ch] = get_bits(buffer, offset, 1)
-                offset += 1
+                self.__scalefac_scale[gr][ch] = reader.read(1)
                 # Table that determines which count1 table is used.
-                self.__count1table_select[gr][ch] = get_bits(buffer, offset, 1)
-                offset += 1
-        self.__offset = offset >> 3 # convert to bytes
+                self.__count1table_select[gr][ch] = reader.read(1)
+        self.__offset = (reader.bit >> 3) - offset # convert to bytes, relative to the start of the side information
 
     @property
     def main_data_begin(self):
@@ -0,0 +1,129 @@
+import numpy as np
+
+# Static canonical Huffman code for the fast compression level. Like the DC coefficients of JPEG, a sample is coded
+# as its magnitude class (the bit length of |sample|, 0 for zero) with a fixed Huffman code, followed by the sign and
+# the bits below the leading one of the magnitude as raw bits. END_OF_GRANULE codes the zeros up to the end of the
+# granule. The code lengths were derived from the class frequencies of tranceshort.mp3, classes that did not occur
+# counted once.
+N_CLASSES = 16
+END_OF_GRANULE = N_CLASSES
+CODE_LENGTHS = [1, 2, 3, 4, 5, 6, 8, 9, 10, 13, 13, 13, 13, 13, 13, 12, 7]
+MAX_CODE_LENGTH = max(CODE_LENGTHS)
+
+
+def canonical_codes(lengths):
+    """
+    :param lengths: Code length of every symbol
+    :return: Code of every symbol, assigned in order of (length, symbol)
+    """
+    codes = [0] * len(lengths)
+    code = 0
+    prev_length = 0
+    for symbol in sorted(range(len(lengths)), key=lambda s: (lengths[s], s)):
+        code <<= lengths[symbol] - prev_length
+        codes[symbol] = code
+        code += 1
+        prev_length = lengths[symbol]
+    return codes
+
+
+CODES = canonical_codes(CODE_LENGTHS)
+CODE_ARRAY = np.array(CODES, dtype=np.int64)
+LENGTH_ARRAY = np.array(CODE_LENGTHS, dtype=np.int64)
+
+# (symbol, code length) for every MAX_CODE_LENGTH bit prefix of the stream, (-1, 0) where no code matches
+DECODE_SYMBOLS = [-1] * (1 << MAX_CODE_LENGTH)
+DECODE_LENGTHS = [0] * (1 << MAX_CODE_LENGTH)
+for _symbol, (_code, _length) in enumerate(zip(CODES, CODE_LENGTHS)):
+    _first = _code << (MAX_CODE_LENGTH - _length)
+    for _prefix in range(_first, _first + (1 << (MAX_CODE_LENGTH - _length))):
+        DECODE_SYMBOLS[_prefix] = _symbol
+        DECODE_LENGTHS[_prefix] = _length
+
+
+def encode_samples(samples):
+    """
+    Encode one granule with the static code, vectorised with NumPy
+    :param samples: Integer samples (np.int16 array), magnitudes below 2 ** 15
+    :return: Compressed stream, padded with zero bits to whole bytes
+    """
+    samples = np.asarray(samples, dtype=np.int64)
+    nonzero = np.flatnonzero(samples)
+    end = int(nonzero[-1]) + 1 if len(nonzero) else 0
+    magnitudes = np.abs(samples[:end])
+    classes = np.frexp(magnitudes.astype(np.float64))[1].astype(np.int64)
+    # Code, sign and bits below the leading one of every sample as one value, MSB first
+    has_sign = (classes > 0).astype(np.int64)
+    extra = classes - has_sign
+    signs = (samples[:end] < 0).astype(np.int64)
+    values = (((CODE_ARRAY[classes] << has_sign) | signs) << extra) | (magnitudes & ((1 << extra) - 1))
+    lengths = LENGTH_ARRAY[classes] + has_sign + extra
+    if end < len(samples):
+        values = np.append(values, CODES[END_OF_GRANULE])
+        lengths = np.append(lengths, CODE_LENGTHS[END_OF_GRANULE])
+    return pack_bits(values, lengths)
+
+
+def pack_bits(values, lengths):
+    """
+    :param values: Codes as integers
+    :param lengths: Number of bits of every code
+    :return: The codes concatenated MSB first, padded with zero bits to whole bytes
+    """
+    ends = np.cumsum(lengths)
+    total = int(ends[-1]) if len(ends) else 0
+    owner = np.repeat(np.arange(len(values)), lengths)
+    shifts = ends[owner] - 1 - np.arange(total)  # position of every output bit within its code, from the LSB
+    return np.packbits((values[owner] >> shifts) & 1).tobytes()
+
+
+def decode_samples(compressed, n_samples, limit=None):
+    """
+    Decode one granule written by encode_samples
+    :param compressed: Buffer that starts with the stream
+    :param n_samples: Number of samples to decode
+    :param limit: Length of the stream, needed whenever other data follows
+    :return: np.int16 array of samples
+    """
+    buffer = memoryview(compressed).cast("B")
+    size = len(buffer) if limit is None else min(limit, len(buffer))
+    # The stream as one integer, followed by MAX_CODE_LENGTH zero bits so that every prefix can be looked up
+    bits = int.from_bytes(buffer[:size], "big") << MAX_CODE_LENGTH
+    n_bits = 8 * size
+    samples = np.zeros(n_samples, dtype=np.int16)
+    pos = 0
+    for i in range(n_samples):
+        prefix = (bits >> (n_bits - pos)) & ((1 << MAX_CODE_LENGTH) - 1)
+        symbol = DECODE_SYMBOLS[prefix]
+        pos += DECODE_LENGTHS[prefix]
+        if symbol < 0 or pos > n_bits:
+            raise ValueError("Corrupt Huffman stream")
+        if symbol == END_OF_GRANULE:
+            break
+        if symbol:
+            pos += symbol
+            if pos > n_bits:
+                raise ValueError("Corrupt Huffman stream")
+            raw = (bits >> (n_bits + MAX_CODE_LENGTH - pos)) & ((1 << symbol) - 1)
+            magnitude = (1 << (symbol - 1)) | (raw & ((1 << (symbol - 1)) - 1))
+            samples[i] = -magnitude if raw >> (symbol - 1) else magnitude
+    return samples
+
+
+def test():
+    rng = np.random.default_rng(0)
+    granules = [np.zeros(576, dtype=np.int16), np.full(576, -1, dtype=np.int16),
+                np.array([8206, -8206] + [0] * 574, dtype=np.int16)]
+    for _ in range(20):
+        granule = np.round(rng.laplace(0, 3, 576) * np.linspace(4, 0, 576)).astype(np.int16)
+        granules.append(granule)
+    n_bytes = 0
+    for granule in granules:
+        stream = encode_samples(granule)
+        assert np.array_equal(decode_samples(stream + b"\xff", len(granule), len(stream)), granule)
+        n_bytes += len(stream)
+    print(f"Coded {len(granules)} granules into {n_bytes} bytes")
+
+
+if __name__ == "__main__":
+    test()
@@ -125,10 +125,11 @@ class ID3:
         footer_size = self.__id3_flags[0] * 10
         size = self.__offset - self.__extended_header_size - footer_size
         i = 0
+        reader = util.BitReader(self.__buffer)
 
         valid = True
         while i < size and valid:
-            frame_id = self.__buffer[start + i: start + i + 4]
+            frame_id = list(self.__buffer[start + i: start + i + 4])
             for c in frame_id:
                 if not (chr(c).isupper() or chr(c).isdigit()):  # Check for legal ID
                     valid = False
@@ -137,7 +138,8 @@ class ID3:
                 i += 4
                 field_size = util.char_to_int(self.__buffer[start + i: start + i + 4])  # 4 Bytes
                 i += 4
-                frame_flags = util.get_bits(self.__buffer, util.BYTE_LENGTH * (start + i), 16)  # 2 Bytes
+                reader.bit = util.BYTE_LENGTH * (start + i)
+                frame_flags = reader.read(16)  # 2 Bytes
                 i += 2
                 frame_content = bytes(self.__buffer[start + i: start + i + field_size])
                 i += field_size
@@ -1,12 +1,35 @@
+import zlib
+
 import numpy as np
 
+from jit import JIT
+
+N_CONTEXTS = 512
+PROB_BITS = 12
+MAX_COUNT = 65534  # bit counts are halved once a count exceeds this value
+
 
 class MP3Predictor:
+    """
+    Bit probabilities per sample region and bit context. Counts and 12-bit probabilities are kept in flat lists
+    indexed by a slot (region * N_CONTEXTS + context) and regions are looked up in a precomputed table. With the JIT
+    backend the lists are int64 arrays, which the kernels of ArithmeticBitCoder update in place.
+    """
 
     def __init__(self, n_samples):
         self.n_regions = 20
         self.region_size = n_samples // self.n_regions
-        self.counter = np.zeros((self.n_regions, 512, 2), dtype=int)  # bitcounts per byte and per sample
+        # First slot of the region of every sample index. Samples past n_samples belong to the last region.
+        self.region_slots = [self.get_region(i) * N_CONTEXTS for i in range(n_samples)]
+        self.last_region_slot = (self.n_regions - 1) * N_CONTEXTS
+        self.n0 = [0] * (self.n_regions * N_CONTEXTS)  # bitcounts per region and context
+        self.n1 = [0] * (self.n_regions * N_CONTEXTS)
+        self.probs = [1 << (PROB_BITS - 1)] * (self.n_regions * N_CONTEXTS)
+        if JIT:
+            self.region_slots = np.array(self.region_slots, dtype=np.int64)
+            self.n0 = np.array(self.n0, dtype=np.int64)
+            self.n1 = np.array(self.n1, dtype=np.int64)
+            self.probs = np.array(self.probs, dtype=np.int64)
 
     def get_region(self, sample_idx):
         upper = self.region_size
@@ -16,15 +39,66 @@ class MP3Predictor:
             upper += self.region_size
         return self.n_regions - 1
 
+    def slot(self, sample_idx, context):
+        if sample_idx < len(self.region_slots):
+            return self.region_slots[sample_idx] + context
+        return self.last_region_slot + context
+
     def p(self, sample_idx, context):
-        return np.int64(4096 * (self.counter[self.get_region(sample_idx), context, 1] + 1) / (
-                self.counter[self.get_region(sample_idx), context, 0] + self.counter[self.get_region(sample_idx), context, 1] + 2))
+        return self.probs[self.slot(sample_idx, context)]
 
     def update(self, y, sample_idx, context):
-        self.counter[self.get_region(sample_idx), context, y] += 1
-        if self.counter[self.get_region(sample_idx), context, y] > 65534:
-            self.counter[self.get_region(sample_idx), context, 0] >>= 1
-            self.counter[self.get_region(sample_idx), context, 1] >>= 1
+        self.update_slot(y, self.slot(sample_idx, context))
+
+    def p_and_update(self, y, sample_idx, context):
+        """
+        Fused prediction and update for the encoder, which knows the bit in advance
+        :return: Probability of a 1 before the update
+        """
+        slot = self.slot(sample_idx, context)
+        p = self.probs[slot]
+        self.update_slot(y, slot)
+        return p
+
+    def copy_state(self):
+        return self.n0.copy(), self.n1.copy(), self.probs.copy()
+
+    def restore_state(self, state):
+        self.n0[:], self.n1[:], self.probs[:] = state
+
+    def to_bytes(self):
+        """
+        Compact snapshot of the predictor. Only the counts are stored (never above MAX_COUNT, so they fit uint16),
+        the probabilities follow from them. Most contexts are never used and compress away.
+        :return: Snapshot bytes
+        """
+        return zlib.compress(np.array([self.n0, self.n1], dtype=np.uint16).tobytes())
+
+    def restore_bytes(self, snapshot):
+        """
+        Restore a snapshot written by to_bytes
+        :param snapshot: Snapshot bytes
+        """
+        counts = np.frombuffer(zlib.decompress(snapshot), dtype=np.uint16).reshape(2, -1)
+        if counts.shape[1] != len(self.n0):
+            raise ValueError("Predictor snapshot does not match the number of regions and contexts")
+        self.n0[:] = counts[0].tolist()
+        self.n1[:] = counts[1].tolist()
+        self.probs[:] = [((c1 + 1) << PROB_BITS) // (c0 + c1 + 2) for c0, c1 in zip(self.n0, self.n1)]
+
+    def update_slot(self, y, slot):
+        c0 = self.n0[slot]
+        c1 = self.n1[slot]
+        if y:
+            c1 += 1
+        else:
+            c0 += 1
+        if c0 > MAX_COUNT or c1 > MAX_COUNT:
+            c0 >>= 1
+            c1 >>= 1
+        self.n0[slot] = c0
+        self.n1[slot] = c1
+        self.probs[slot] = ((c1 + 1) << PROB_BITS) // (c0 + c1 + 2)
         # self.context += self.context + y # done by caller
         # if self.context >= 256:
         #     self.context = 1
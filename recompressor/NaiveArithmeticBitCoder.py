@@ -1,4 +1,5 @@
 import numpy as np
+from util import byte_reader
 
 
 # Python translation of fpaq0 coder by M. Mahoney (http://mattmahoney.net/dc/fpaq0.cpp)
@@ -10,6 +11,7 @@ class ArithmeticBitCoder:
         self.x2 = np.int64(0xffffffff)
         self.x = np.int64(0)
         self.compressed = bytearray()
+        self.reader = iter(())
         self.context = 1
 
     def encode(self, data: bytes):
@@ -46,15 +48,12 @@ class ArithmeticBitCoder:
             self.x1 <<= 8
             self.x2 = (self.x2 << 8) + 255
 
-    def decode(self, compressed: bytearray):
-        self.compressed = compressed
+    def decode(self, compressed):
+        # compressed may be any buffer (bytes, memoryview, mmap) or a file-like object, it is read through a cursor
+        self.reader = byte_reader(compressed)
         decompressed = bytearray()
         for i in range(4):  # initialise first four bytes of x with compressed file
-            if len(compressed) == 0:
-                b = 0
-            else:
-                b = compressed.pop(0)
-            self.x = (self.x << 8) + (b & 0xff)
+            self.x = (self.x << 8) + next(self.reader, 0)
 
         while self.decode_symbol() == 0:
             b = 1
@@ -78,11 +77,7 @@ class ArithmeticBitCoder:
         while ((self.x1 ^ self.x2) & 0xff000000) == 0:
             self.x1 <<= 8
             self.x2 = (self.x2 << 8) + 255
-            if len(self.compressed) == 0:
-                c = 0
-            else:
-                c = self.compressed.pop(0)
-            self.x = (self.x << 8) + c
+            self.x = (self.x << 8) + next(self.reader, 0)
 
         return y
 
@@ -1,67 +1,158 @@
 # Original code from: https://github.com/tomershay100/mp3-steganography-lib
 
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 from tqdm import tqdm
 from Frame import *
+from ArithmeticBitCoder import FILE_MAGIC, LEVEL_VERSION, DEFAULT_LEVEL, estimate_samples_size
+import HuffmanSampleCoder
+from CheckpointIndex import CheckpointIndex
+from FrameIndex import FrameIndex
 from scipy.io.wavfile import write
 
 HEADER_SIZE = 4
+FILE_HEADER_SIZE = len(FILE_MAGIC) + 2  # magic, version and level in front of the first 3PM frame
+CHUNKS_PER_WORKER = 4  # chunks of frames handed to every parallel worker, more balance the load better
+MIN_CHUNK_FRAMES = 64  # every chunk also parses the headers of up to NUM_PREV_FRAMES frames in front of it
+
+
+def parse_frames(file_path, offsets, n_lookback):
+    """
+    Parse a chunk of frames in a worker process, as Recompressor.parse_file does
+    :param file_path: MP3 file, memory-mapped again in the worker
+    :param offsets: Offsets of the frames, the chunk starts behind the first n_lookback of them
+    :param n_lookback: Frames in front of the chunk the bit reservoir of its first frame can reach into. Only their
+    headers are read, for the frame sizes. Together with the frames before the chunk, this has to start at the first
+    frame of the file or cover NUM_PREV_FRAMES frames.
+    :return: Frame.get_parsed_frame of every frame of the chunk
+    """
+    with open(file_path, 'rb') as f:
+        file_data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    frame = Frame()
+    # The same state as Recompressor.__init__ leaves for the first frame of the file
+    frame.init_header_params(file_data, offsets[0])
+    frame.set_frame_size()
+    next_offset = offsets[0]
+    parsed_frames = []
+    for i, offset in enumerate(offsets):
+        if offset != next_offset:
+            frame.clear_reservoir()
+        frame.init_header_params(file_data, offset)
+        if i < n_lookback:
+            frame.set_frame_size()
+        else:
+            frame.init_frame_params(file_data, offset)
+            parsed_frames.append(frame.get_parsed_frame())
+        next_offset = offset + frame.frame_size
+    return parsed_frames
 
 
 class Recompressor:
 
-    def __init__(self, file_data, offset, file_path):
+    def __init__(self, file_data, offset, file_path, checkpoint_interval=None, level=DEFAULT_LEVEL,
+                 estimate_only=False):
+        """
+        :param file_data: Bytes of the whole file, e.g. a memory-mapped file. Frames are parsed at their offsets into
+        it without copying it
+        :param offset: Offset of the first frame, after the ID3 tag
+        :param checkpoint_interval: Write a checkpoint index (.3pmi) with a predictor snapshot every this many frames
+        :param level: Compression level, see ArithmeticBitCoder
+        :param estimate_only: Only keep the granules for estimate_sizes instead of coding them
+        """
         # Declarations
         # self.__curr_header: FrameHeader = FrameHeader()
-        self.__curr_frame: Frame = Frame()
+        self.__curr_frame: Frame = Frame(level)
+        self.__level = level
         self.__valid: bool = False
-        # List of integers that contain the file (without ID3) data
-        self.__file_data: list = []
-        self.__buffer: list = []
+        # Byte view of the whole file, frames are read at self.__offset
+        self.__file_data: memoryview = memoryview(b"")
         self.__file_length: int = 0
         self.__file_path = file_path
         self.__new_file_path = self.__file_path[:-4] + '.3pm'
+        self.__index = None if checkpoint_interval is None else CheckpointIndex(checkpoint_interval)
         self.__allsamples = []
         self.__pcm = []
+        self.__estimate_only = estimate_only
+        self.__granules = []
+        self.__overhead = 0  # 3PM frame bytes besides the granule streams, see estimate_sizes
 
         self.__bytes = bytearray()
 
-        # cut the id3 from hex_data
-        self.__buffer = file_data[offset:]
+        # skip the id3 in front of the first frame, the frames are looked up in one pass over the file
+        file_data = memoryview(file_data).cast("B")
+        self.__frame_index = FrameIndex(file_data, offset)
 
-        if self.__buffer[0] == 0xFF and self.__buffer[1] >= 0xE0:
+        if len(self.__frame_index) > 0:
             self.__valid = True
             self.__file_data = file_data
             self.__file_length = len(file_data)
-            self.__offset = offset
+            self.__offset = int(self.__frame_index.offsets[0])
             self.__init_curr_header()
             self.__curr_frame.set_frame_size()
         else:
             self.__valid = False
 
     def __init_curr_header(self):
-        if self.__buffer[0] == 0xFF and self.__buffer[1] >= 0xE0:
-            self.__curr_frame.init_header_params(self.__buffer)
-        else:
-            self.__valid = False
+        self.__curr_frame.init_header_params(self.__file_data, self.__offset)
 
     def __init_curr_frame(self):
-        self.__curr_frame.init_frame_params(self.__buffer, self.__file_data, self.__offset)
-
-    def parse_file(self):
+        self.__curr_frame.init_frame_params(self.__file_data, self.__offset)
+
+    def __parse_in_parallel(self, workers):
+        # Frames are parsed in chunks by a process pool, every chunk with the frames its bit reservoir can reach
+        # into. Yields (offset, Frame.get_parsed_frame) of every frame in file order.
+        offsets = self.__frame_index.offsets.tolist()
+        chunk_size = max(MIN_CHUNK_FRAMES, -(-len(offsets) // (CHUNKS_PER_WORKER * workers)))
+        starts = range(0, len(offsets), chunk_size)
+        lookbacks = [min(start, NUM_PREV_FRAMES) for start in starts]
+        chunks = [offsets[start - lookback:start + chunk_size] for start, lookback in zip(starts, lookbacks)]
+        with ProcessPoolExecutor(workers) as executor:
+            results = executor.map(parse_frames, repeat(self.__file_path), chunks, lookbacks)
+            for start, parsed_frames in zip(starts, results):
+                yield from zip(offsets[start:start + chunk_size], parsed_frames)
+
+    def parse_file(self, workers=1):
+        """
+        Parse all frames and code them as 3PM frames, or keep their granules with estimate_only
+        :param workers: Processes that parse the frames in parallel, file_path is memory-mapped again in each. The
+        frames are still coded one after the other, and the result is the same as with 1. Only the parsing scales,
+        which is most of the time with estimate_only and at level 0, but not at level 2.
+        :return: Number of parsed frames
+        """
         num_of_parsed_frames = 0
 
         pbar = tqdm(total=self.__file_length + 1 - HEADER_SIZE, desc='decoding')
-        while self.__valid and self.__file_length > self.__offset + HEADER_SIZE:
+        if not self.__valid:
+            frames = []
+        elif workers > 1:
+            frames = self.__parse_in_parallel(workers)
+        else:
+            frames = ((frame_offset, None) for frame_offset in self.__frame_index.offsets.tolist())
+        for frame_offset, parsed_frame in frames:
+            if frame_offset != self.__offset:
+                # Resync behind corrupt data, the bit reservoir of the next frames cannot reach across it
+                self.__curr_frame.clear_reservoir()
+                self.__offset = frame_offset
             self.__init_curr_header()
-            if self.__valid:
+            if parsed_frame is None:
                 self.__init_curr_frame()
-                num_of_parsed_frames += 1
-                self.__offset += self.__curr_frame.frame_size
-                self.__buffer = self.__file_data[self.__offset:]
-                # print(f'Parsed: {num_of_parsed_frames}')
-
-            b = self.__curr_frame.get_3pm_bytes()
-            self.__bytes.extend(b)
+            else:
+                self.__curr_frame.set_parsed_frame(parsed_frame)
+            num_of_parsed_frames += 1
+            self.__offset += self.__curr_frame.frame_size
+            # print(f'Parsed: {num_of_parsed_frames}')
+
+            if self.__estimate_only:
+                self.__granules.append(self.__curr_frame.get_granules())
+                self.__overhead += self.__curr_frame.get_3pm_overhead()
+            else:
+                if self.__index is not None and len(self.__allsamples) % self.__index.interval == 0:
+                    self.__index.add(len(self.__allsamples), FILE_HEADER_SIZE + len(self.__bytes),
+                                     self.__curr_frame.get_predictor_snapshot())
+                b = self.__curr_frame.get_3pm_bytes()
+                self.__bytes.extend(b)
             self.__allsamples.append(self.__curr_frame.get_samples())
             self.__pcm.extend(list(self.__curr_frame.interleave()))
             pbar.update(self.__curr_frame.frame_size)
@@ -70,14 +161,29 @@ class Recompressor:
 
         return num_of_parsed_frames
 
+    def estimate_sizes(self):
+        """
+        Estimate the size of the 3PM file at every compression level from the granules parse_file kept with
+        estimate_only. Level 0 and 1 are exact, level 2 is estimated with estimate_samples_size.
+        :return: List of file sizes in bytes, indexed by level
+        """
+        granules = np.concatenate(self.__granules) if self.__granules else np.zeros((0, NUM_OF_SAMPLES), np.int16)
+        fixed = FILE_HEADER_SIZE + self.__overhead
+        huffman = sum(len(HuffmanSampleCoder.encode_samples(granule)) for granule in granules)
+        return [fixed + granules.nbytes, fixed + huffman, fixed + estimate_samples_size(granules)]
+
     def export_samples(self, filename):
         print(f"Writing {len(self.__allsamples)} to {filename}")
         np.save(filename, self.__allsamples)
 
     def write_to_3pm(self):
         with open(self.__new_file_path, "wb") as file:
+            file.write(FILE_MAGIC + bytes((LEVEL_VERSION, self.__level)))
             file.write(self.__bytes)
             file.close()
+        if self.__index is not None:
+            with open(self.__new_file_path + 'i', "wb") as file:
+                file.write(self.__index.to_bytes())
 
     def write_to_wav(self):
         # Convert PCM to WAV (from 32-bit floating-point to 16-bit PCM by mult by 32767)
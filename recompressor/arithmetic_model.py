@@ -1,3 +1,5 @@
+from bisect import bisect_left
+
 CHAR_FREQ = [
     0,
     1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 124, 1, 1, 1, 1, 1,
@@ -89,24 +91,27 @@ THIRD_QUARTER = 3 * FIRST_QUARTER
 N_CHARS = 256
 EOF = N_CHARS + 1
 N_SYMBOLS = N_CHARS + 1
+TREE_STEPS = tuple(1 << k for k in range(N_SYMBOLS.bit_length() - 1, -1, -1))  # binary indexed tree descent
+
+# Binary coder streams end with a version byte. Legacy streams have none, their last byte holds the last bits padded with
+# zeros and is below 0x80. They lose the pending opposite bits of their termination and are decoded as they were then.
+TERMINATED_STREAM = 0x81  # the termination writes the pending opposite bits
 
 def get_model_params(model):
+    """
+    Frequency tables of a model. Static models are built once at import and shared, their tables are tuples and
+    must not be changed. Only the dynamic model (model=None) gets fresh tables for every call.
+    :param model: "MP3", "MP3_DIFF", "CHAR" or None for the dynamic model
+    :return: freq, cumfreq, ch2idx, idx2ch
+    """
     if model:
-        if model == "MP3":
-            freq = MP3_FREQ.copy()
-        if model =="MP3_DIFF":
-            freq = MP3_DIFF_FREQ.copy()
-        elif model == "CHAR":
-            freq = CHAR_FREQ.copy()
-
-        cumfreq = [0] * (N_SYMBOLS + 1)
-        cumfreq[N_SYMBOLS] = 0
-        for i in range(N_SYMBOLS, 0, -1):
-            cumfreq[i - 1] = cumfreq[i] + freq[i]
-
-    else:  # dynamic model
-        freq = [1] * (N_SYMBOLS+1)
-        cumfreq = [N_SYMBOLS - i for i in range(N_SYMBOLS+1)]
+        if model not in STATIC_MODELS:
+            raise ValueError(f"Unknown model {model}")
+        return STATIC_MODELS[model]
+
+    # dynamic model
+    freq = [1] * (N_SYMBOLS+1)
+    cumfreq = [N_SYMBOLS - i for i in range(N_SYMBOLS+1)]
 
     ch2idx = {}
     idx2ch = {}
@@ -115,3 +120,212 @@ def get_model_params(model):
         idx2ch[i + 1] = i
 
     return freq, cumfreq, ch2idx, idx2ch
+
+
+def build_static_model(freq):
+    cumfreq = [0] * (N_SYMBOLS + 1)
+    cumfreq[N_SYMBOLS] = 0
+    for i in range(N_SYMBOLS, 0, -1):
+        cumfreq[i - 1] = cumfreq[i] + freq[i]
+
+    # Static models never swap symbols, so chars map to index char + 1. Index 0 is unused.
+    ch2idx = tuple(range(1, N_CHARS + 1))
+    idx2ch = (0,) + tuple(range(N_CHARS))
+    return tuple(freq), tuple(cumfreq), ch2idx, idx2ch
+
+
+def get_symbol_table(cumfreq):
+    """
+    Lookup table from a cumulative frequency to the symbol index whose interval contains it, for static models
+    :param cumfreq: Cumulative frequencies as returned by get_model_params, decreasing with the symbol index
+    :return: List with the symbol index for every value in [0, cumfreq[0])
+    """
+    table = [0] * cumfreq[0]
+    for symbol_index in range(1, N_SYMBOLS + 1):
+        for cum in range(cumfreq[symbol_index], cumfreq[symbol_index - 1]):
+            table[cum] = symbol_index
+    return table
+
+
+class AdaptiveModel:
+    """
+    Model of the dynamic coder (model=None). Symbols are kept sorted by decreasing frequency by swapping a symbol
+    to the front of its run of equal frequencies before incrementing it. Frequencies are held in a binary indexed
+    (Fenwick) tree, so cumulative lookups and updates take O(log N_SYMBOLS) steps instead of walking cumfreq.
+    cumfreq[i] of the table-based model corresponds to total - prefix(i).
+    """
+
+    def __init__(self):
+        # Negated frequencies, non-decreasing from index 1 so that runs can be found with bisect. Index 0 is unused.
+        self.neg_freq = [0] + [-1] * N_SYMBOLS
+        self.tree = [0] * (N_SYMBOLS + 1)
+        self.total = 0
+        self.ch2idx = [i + 1 for i in range(N_CHARS)]
+        self.idx2ch = [0] * (N_SYMBOLS + 1)
+        for i in range(N_CHARS):
+            self.idx2ch[i + 1] = i
+        self.__build_tree()
+
+    def __build_tree(self):
+        tree = [0] * (N_SYMBOLS + 1)
+        for i in range(1, N_SYMBOLS + 1):
+            tree[i] -= self.neg_freq[i]
+            parent = i + (i & -i)
+            if parent <= N_SYMBOLS:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.total = -sum(self.neg_freq)
+
+    def interval(self, symbol_index):
+        """
+        :return: cumfreq[symbol_index - 1], cumfreq[symbol_index] and the total frequency
+        """
+        tree = self.tree
+        prefix = 0
+        i = symbol_index - 1
+        while i > 0:
+            prefix += tree[i]
+            i &= i - 1
+        high = self.total - prefix
+        return high, high + self.neg_freq[symbol_index], self.total
+
+    def find(self, cum):
+        """
+        Symbol whose interval contains cum, the smallest index with cumfreq[index] <= cum
+        :return: Symbol index, cumfreq[index - 1], cumfreq[index]
+        """
+        total = self.total
+        if cum >= total + self.neg_freq[1]:  # the most frequent symbol, skip the tree
+            return 1, total, total + self.neg_freq[1]
+        tree = self.tree
+        target = total - cum  # smallest index whose prefix sum reaches target
+        pos = 0
+        prefix = 0
+        for step in TREE_STEPS:
+            nxt = pos + step
+            if nxt <= N_SYMBOLS and prefix + tree[nxt] < target:
+                pos = nxt
+                prefix += tree[nxt]
+        high = total - prefix
+        return pos + 1, high, high + self.neg_freq[pos + 1]
+
+    def update(self, symbol_index):
+        if self.total == MAX_FREQ:
+            # Halve all frequencies, rounding up so that none becomes zero
+            self.neg_freq = [0] + [-((1 - f) >> 1) for f in self.neg_freq[1:]]
+            self.__build_tree()
+
+        neg_freq = self.neg_freq
+        i = bisect_left(neg_freq, neg_freq[symbol_index], 1, symbol_index)  # first symbol with the same frequency
+        if i < symbol_index:
+            ch_i = self.idx2ch[i]  # chars are one lower than indexes
+            ch_symbol = self.idx2ch[symbol_index]
+            self.idx2ch[i] = ch_symbol
+            self.idx2ch[symbol_index] = ch_i
+            self.ch2idx[ch_i] = symbol_index
+            self.ch2idx[ch_symbol] = i
+        neg_freq[i] -= 1
+        self.total += 1
+        tree = self.tree
+        while i <= N_SYMBOLS:
+            tree[i] += 1
+            i += i & -i
+
+
+class TableModel:
+    """
+    Previous adaptive model with plain frequency and cumfreq lists, updated by walking cumfreq (O(N_SYMBOLS) per
+    symbol). Kept as reference for benchmark_models, same interface and results as AdaptiveModel.
+    """
+
+    def __init__(self):
+        self.freq = [0] + [1] * N_SYMBOLS
+        self.cumfreq = [N_SYMBOLS - i for i in range(N_SYMBOLS + 1)]
+        self.ch2idx = [i + 1 for i in range(N_CHARS)]
+        self.idx2ch = [0] * (N_SYMBOLS + 1)
+        for i in range(N_CHARS):
+            self.idx2ch[i + 1] = i
+
+    @property
+    def total(self):
+        return self.cumfreq[0]
+
+    def interval(self, symbol_index):
+        return self.cumfreq[symbol_index - 1], self.cumfreq[symbol_index], self.cumfreq[0]
+
+    def find(self, cum):
+        symbol_index = 1
+        while self.cumfreq[symbol_index] > cum:
+            symbol_index += 1
+        return symbol_index, self.cumfreq[symbol_index - 1], self.cumfreq[symbol_index]
+
+    def update(self, symbol_index):
+        if self.cumfreq[0] == MAX_FREQ:
+            cum = 0
+            for i in range(N_SYMBOLS, 0, -1):
+                self.freq[i] = (self.freq[i] + 1) // 2
+                self.cumfreq[i] = cum
+                cum += self.freq[i]
+            self.cumfreq[0] = cum
+
+        i = symbol_index
+        while self.freq[i] == self.freq[i - 1]: i -= 1
+        if i < symbol_index:
+            ch_i = self.idx2ch[i]
+            ch_symbol = self.idx2ch[symbol_index]
+            self.idx2ch[i] = ch_symbol
+            self.idx2ch[symbol_index] = ch_i
+            self.ch2idx[ch_i] = symbol_index
+            self.ch2idx[ch_symbol] = i
+        self.freq[i] += 1
+        while i > 0:
+            i -= 1
+            self.cumfreq[i] += 1
+
+
+def benchmark_models(n_bytes=100000):
+    import time
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    inputs = {
+        "uniform": rng.integers(0, N_CHARS, n_bytes, dtype=np.uint8).tobytes(),
+        "laplace": np.round(rng.laplace(0, 30, n_bytes)).astype(np.int8).tobytes(),
+        "int16 samples": np.round(rng.laplace(0, 2, n_bytes // 2)).astype(np.int16).tobytes(),
+    }
+    for name, data in inputs.items():
+        results = []
+        for model_class in (TableModel, AdaptiveModel):
+            # Encoder side (interval + update) and decoder side (find + update) of every byte
+            model = model_class()
+            start = time.time()
+            intervals = []
+            for b in data:
+                symbol_index = model.ch2idx[b]
+                intervals.append(model.interval(symbol_index))
+                model.update(symbol_index)
+            encode_time = time.time() - start
+
+            model = model_class()
+            start = time.time()
+            for b, (cum_high, cum_low, total) in zip(data, intervals):
+                symbol_index, _, _ = model.find(cum_low)
+                assert model.idx2ch[symbol_index] == b
+                model.update(symbol_index)
+            decode_time = time.time() - start
+            results.append(intervals)
+            print(f"{name:14s} {model_class.__name__:14s} encode {n_bytes / encode_time / 1e3:7.1f} KB/s, "
+                  f"decode {n_bytes / decode_time / 1e3:7.1f} KB/s")
+        assert results[0] == results[1]
+
+
+STATIC_MODELS = {
+    "MP3": build_static_model(MP3_FREQ),
+    "MP3_DIFF": build_static_model(MP3_DIFF_FREQ),
+    "CHAR": build_static_model(CHAR_FREQ),
+}
+STATIC_SYMBOL_TABLES = {model: tuple(get_symbol_table(params[1])) for model, params in STATIC_MODELS.items()}
+
+
+if __name__ == "__main__":
+    benchmark_models()
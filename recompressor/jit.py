@@ -0,0 +1,16 @@
+import os
+
+# Optional Numba backend. The hot loops of the bit coder, the predictor updates and the Huffman decoding also exist as
+# kernels over NumPy arrays, which are compiled and used when numba is installed. Both give identical output, set
+# NO_JIT=1 to force the pure-Python loops.
+try:
+    if os.environ.get("NO_JIT"):
+        raise ImportError("JIT disabled by NO_JIT")
+    from numba import njit
+    JIT = True
+except ImportError:
+    JIT = False
+
+    def njit(*args, **kwargs):
+        # The kernels are then never called, the decorator only keeps them importable
+        return lambda function: function
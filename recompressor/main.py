@@ -1,10 +1,15 @@
 # Original code from: https://github.com/tomershay100/mp3-steganography-lib
 
+import mmap
+import os
 import sys
 import time
 
 from Recompressor import Recompressor
+from Decompressor import Decompressor
 from ID3_Parser import ID3
+from jit import JIT
+from ArithmeticBitCoder import DEFAULT_LEVEL, LEVEL_ADAPTIVE
 
 
 def parse_metadata(file_name: str, id3_parser: ID3):
@@ -30,22 +35,76 @@ def parse_metadata(file_name: str, id3_parser: ID3):
             metadata.write('\n')
 
 
+# Printed with the timings, the numba kernels parse and decode several times faster than the pure-Python loops
+BACKEND = '(numba kernels)' if JIT else '(pure Python)'
+
+
+def pop_option(argv, name):
+    # Removes "name value" from argv and returns the value as int, None if the option is not given
+    if name not in argv:
+        return None
+    i = argv.index(name)
+    if i + 1 >= len(argv) or not argv[i + 1].isdigit():
+        print(f"{name} expects a number.")
+        exit(-1)
+    value = int(argv[i + 1])
+    del argv[i:i + 2]
+    return value
+
+
 if __name__ == '__main__':
-    if len(sys.argv) > 2:
+    argv = sys.argv[:]
+    # --checkpoints K writes a checkpoint index (.3pmi) with a predictor snapshot every K frames next to the 3PM file,
+    # --start N decodes from frame N on, starting at the closest checkpoint if the index exists,
+    # --level L selects the compression level from 0 (fastest) to 2 (smallest),
+    # --estimate-only prints the estimated size at every level instead of writing the 3PM file,
+    # --workers W parses the frames in W processes
+    estimate_only = '--estimate-only' in argv
+    if estimate_only:
+        argv.remove('--estimate-only')
+    checkpoint_interval = pop_option(argv, '--checkpoints')
+    start_frame = pop_option(argv, '--start')
+    workers = pop_option(argv, '--workers')
+    if workers is None:
+        workers = 1
+    level = pop_option(argv, '--level')
+    if level is None:
+        level = DEFAULT_LEVEL
+    elif level > LEVEL_ADAPTIVE:
+        print(f"--level expects a level from 0 to {LEVEL_ADAPTIVE}.")
+        exit(-1)
+    if len(argv) > 2:
         print("Unexpected number of arguments.")
         exit(-1)
-    if len(sys.argv) < 2:
+    if len(argv) < 2:
         print("No directory specified.")
         exit(-1)
-    file_path = sys.argv[1]
+    file_path = argv[1]
+
+    if file_path.endswith('.3pm'):
+        with open(file_path, 'rb') as f:
+            file_data = f.read()
+        index_data = None
+        if os.path.exists(file_path + 'i'):
+            with open(file_path + 'i', 'rb') as f:
+                index_data = f.read()
+        d = Decompressor(file_data, index_data)
+        start = time.time()
+        num_of_decoded_frames = d.decode_file(start_frame)
+        decoding_time = time.time() - start
+        audio_time = num_of_decoded_frames * 1152 / d.sampling_rate
+        print('Decoded', num_of_decoded_frames, 'frames in', decoding_time, 'seconds',
+              f'({audio_time / decoding_time:.2f}x real time)', BACKEND)
+        d.export_samples(file_path[:-4] + '_samples.npy')
+        exit(0)
 
+    # The MP3 file is memory-mapped, the frames are parsed in place instead of from a copy of the file
     with open(file_path, 'rb') as f:
-        hex_data = [c for c in f.read()]
-        f.close()
+        file_data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
 
     ################################
 
-    id3_decoder = ID3(hex_data)
+    id3_decoder = ID3(file_data)
     if id3_decoder.is_valid:
         parse_metadata(file_path, id3_decoder)
         offset = id3_decoder.offset
@@ -53,10 +112,19 @@ if __name__ == '__main__':
     else:
         offset = 0
 
-    r = Recompressor(hex_data, offset, file_path)
+    r = Recompressor(file_data, offset, file_path, checkpoint_interval, level, estimate_only)
     start = time.time()
-    num_of_parsed_frames = r.parse_file()
+    num_of_parsed_frames = r.parse_file(workers)
     parsing_time = time.time() - start
-    print('Parsed', num_of_parsed_frames, 'frames in', parsing_time, 'seconds')
+    if estimate_only:
+        print('Parsed', num_of_parsed_frames, 'frames in', parsing_time, 'seconds', BACKEND)
+        start = time.time()
+        sizes = r.estimate_sizes()
+        estimation_time = time.time() - start
+        for estimated_level, size in enumerate(sizes):
+            print(f'Level {estimated_level}: {size} bytes, ratio {len(file_data) / size:.3f}')
+        print(f'Estimated in {estimation_time * 1000:.0f} ms')
+        exit(0)
+    print('Parsed', num_of_parsed_frames, 'frames in', parsing_time, 'seconds', BACKEND, f'(level {level})')
     # r.export_samples("allsamples_trance.npy")
     r.write_to_3pm()
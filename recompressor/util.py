@@ -2,7 +2,10 @@
 
 import sys
 
+from jit import njit
+
 BYTE_LENGTH = 8
+READ_CHUNK_SIZE = 1 << 16
 
 
 class Offset:
@@ -38,37 +41,62 @@ def left_shift_char(a: bytes, b: int):
     return result_int.to_bytes(len(a), byteorder="big")
 
 
-def get_bits(buffer: list, start_bit: int, slice_len: int):
-    # exclude the last bit of the slice
-    end_bit = start_bit + slice_len - 1
-
-    start_byte = start_bit >> 3
-    end_byte = end_bit >> 3
-
-    buff_copy = buffer.copy()
-
-    buff_len = len(buffer)
-    if end_byte >= buff_len:
-        # pad with zeros
-        buff_copy.extend([0 for _ in range(end_byte - buff_len + 1)])
-
-    bits = []
-    for idx in range(start_byte, end_byte + 1):
-        num = buff_copy[idx]
-        out = [1 if num & (1 << (BYTE_LENGTH - 1 - n)) else 0 for n in range(BYTE_LENGTH)]
-        bits.extend(out)
-
-    # update to relative positions in the bits array
-    start_bit %= 8
-    end_bit = start_bit + slice_len - 1
-
-    bit_slice = bits[start_bit:end_bit + 1]
-
+def byte_reader(source):
+    # Iterate over a buffer (bytes, memoryview, mmap) or a file-like object without copying or consuming it
+    if hasattr(source, "read"):
+        return _file_reader(source)
+    return iter(memoryview(source).cast("B"))
+
+
+def _file_reader(file):
+    chunk = file.read(READ_CHUNK_SIZE)
+    while chunk:
+        yield from chunk
+        chunk = file.read(READ_CHUNK_SIZE)
+
+
+class BitReader:
+    """
+    Bit cursor over a buffer (bytes, memoryview or list of byte values), most significant bit first. Every operation
+    only converts the bytes under the requested bits into an int and never copies the buffer. Bits past the end of
+    the buffer are read as zeros.
+    """
+
+    def __init__(self, buffer, bit: int = 0):
+        self.__buffer = memoryview(buffer).cast("B") if isinstance(buffer, (bytes, bytearray, memoryview)) else buffer
+        self.bit = bit
+
+    def peek(self, n: int):
+        """
+        :param n: Number of bits
+        :return: The next n bits as int, without moving the cursor
+        """
+        start_byte = self.bit >> 3
+        end_byte = (self.bit + n + 7) >> 3
+        value = int.from_bytes(self.__buffer[start_byte:end_byte], "big")
+        missing = end_byte - max(start_byte, len(self.__buffer))
+        if missing > 0:
+            value <<= missing << 3
+        return (value >> (((end_byte - start_byte) << 3) - (self.bit & 7) - n)) & ((1 << n) - 1)
+
+    def read(self, n: int):
+        """
+        :param n: Number of bits
+        :return: The next n bits as int, the cursor is moved past them
+        """
+        value = self.peek(n)
+        self.bit += n
+        return value
+
+    def skip(self, n: int):
+        self.bit += n
+
+
+@njit(cache=True)
+def get_bits_kernel(data, start_bit: int, slice_len: int):
+    # BitReader.peek for a uint8 array, used by the JIT backend. Bits past the end of data are read as zeros.
     result = 0
-
-    bit_slice.reverse()
-
-    for i in range(len(bit_slice)):
-        result += (2 ** i) * bit_slice[i]
-
+    for bit in range(start_bit, start_bit + slice_len):
+        byte = bit >> 3
+        result = (result << 1) | ((data[byte] >> (7 - (bit & 7))) & 1 if byte < len(data) else 0)
     return result